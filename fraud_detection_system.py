@@ -1,97 +1,910 @@
 import os
+import sys
+import gc
+import signal
+import socket
+import copy
+import contextlib
+import random
+import bisect
+import json
+import time
+import hashlib
+import hmac
+import io
+import itertools
+import importlib.util
+import queue
+import threading
+import multiprocessing
+from functools import partial
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import argparse
+import asyncio
+import tracemalloc
 import numpy as np
 import pandas as pd
 import torch
+import torch.distributed as dist
 import torch.nn.functional as F
 from torch_geometric.data import HeteroData
 from torch_geometric.nn import HGTConv, Linear
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_auc_score, precision_recall_curve, average_precision_score
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
+
+# ---------------------------
+# Node ID Index
+# ---------------------------
+class NodeIndex:
+    """Array-backed mapping between original node IDs and consecutive indices."""
+
+    def __init__(self, ids):
+        # Indices follow first-appearance order (same as the old dict mappings),
+        # a sorted copy plus its permutation serves the forward lookups.
+        ids = pd.unique(np.asarray(ids))
+        self._set_arrays(ids, np.argsort(ids, kind='stable'))
+
+    def _set_arrays(self, ids, order):
+        self._ids = ids  # may carry spare capacity past _size after appends
+        self._size = len(ids)
+        # (sorted ids, their permutation, IDs appended since the last compaction and resolved
+        # by hash until merged): swapped as one tuple so lock-free readers never mix versions
+        self._lookup = (ids[order], order, {})
+
+    @property
+    def _order(self):
+        return self._lookup[1]
+
+    @classmethod
+    def from_arrays(cls, ids, order):
+        """Rebuild an index from its persisted id and sort-order arrays without re-sorting."""
+        index = cls.__new__(cls)
+        index._set_arrays(ids, order)
+        return index
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        return bool(self.get_indexer([key])[0] >= 0)
+
+    def __getitem__(self, key):
+        return int(self.lookup([key])[0])
+
+    def _coerce(self, ids):
+        ids = np.asarray(ids)
+        target = self._ids.dtype
+        if target.kind == 'U' and ids.dtype.kind != 'U':
+            # Convert at the IDs' own width; casting to the index's width would truncate
+            return ids.astype(str)
+        if target.kind in 'iu' and ids.dtype.kind == 'f':
+            # 42.0 from a JSON payload is 42; 42.5 (or an out-of-range float) is no integer ID
+            if not ((ids == np.floor(ids)).all() and _fits_integer(ids, np.int64)):
+                return None
+            return ids.astype(np.int64)
+        # Same-kind arrays (e.g. int32 vs int64, or strings of different widths) compare as-is
+        if ids.dtype != target and not (ids.dtype.kind == target.kind and target.kind in 'iufU'):
+            try:
+                ids = ids.astype(target)
+            except (TypeError, ValueError):
+                return None
+        return ids
+
+    def get_indexer(self, ids):
+        """Return the index of each ID, or -1 where the ID is unknown."""
+        ids = np.asarray(ids)
+        result = np.full(ids.shape, -1, dtype=np.int64)
+        if self._size == 0 or ids.size == 0:
+            return result
+        if ids.ndim != 1:
+            return self.get_indexer(ids.ravel()).reshape(ids.shape)
+        # Missing IDs (None/NaN in request payloads) never match, and must not reach searchsorted
+        valid = pd.notna(ids)
+        if not valid.all():
+            result[valid] = self.get_indexer(ids[valid])
+            return result
+        sorted_ids, order, pending = self._lookup
+        coerced = self._coerce(ids)
+        try:
+            if coerced is None:
+                raise TypeError
+            if len(sorted_ids):
+                pos = np.searchsorted(sorted_ids, coerced)
+                pos = np.minimum(pos, len(sorted_ids) - 1)
+                found = sorted_ids[pos] == coerced
+                result[found] = order[pos[found]]
+        except TypeError:
+            if ids.size == 1:
+                return result
+            # Mixed-type IDs that don't convert or order against the index: resolve one by one
+            return np.array([self.get_indexer(ids[i:i + 1])[0] for i in range(ids.size)], dtype=np.int64)
+        if pending:
+            missing = result < 0
+            result[missing] = [pending.get(key, -1) for key in coerced[missing].tolist()]
+        return result
+
+    def lookup(self, ids):
+        """Return the index of each ID, raising KeyError for unknown IDs."""
+        indices = self.get_indexer(ids)
+        missing = indices < 0
+        if missing.any():
+            unknown = np.asarray(ids)[missing]
+            raise KeyError(f"{missing.sum()} unknown IDs, e.g. {unknown[:5].tolist()}")
+        return indices
+
+    def get_ids(self, indices):
+        """Reverse lookup: consecutive indices back to original IDs."""
+        return self.ids[np.asarray(indices)]
+
+    def append(self, ids):
+        """Give new, unseen IDs the next consecutive indices; returns those indices."""
+        ids = self._coerce(pd.unique(np.asarray(ids)))
+        if ids is None:
+            raise ValueError("New IDs are not compatible with the existing ID dtype")
+        if (self.get_indexer(ids) >= 0).any():
+            raise ValueError("NodeIndex.append() only accepts IDs that are not indexed yet")
+        start, end = self._size, self._size + len(ids)
+        dtype = self._ids.dtype
+        if ids.dtype.kind == 'U' or (dtype.kind in 'iu' and len(ids) and not _fits_integer(ids, dtype)):
+            # Compact (e.g. int32) IDs widen instead of wrapping around
+            dtype = np.result_type(dtype, ids.dtype)
+        if end > len(self._ids) or dtype != self._ids.dtype:
+            # Geometric growth keeps repeated small appends amortized O(1)
+            grown = np.empty(max(end, 2 * len(self._ids), 16), dtype=dtype)
+            grown[:start] = self.ids
+            self._ids = grown
+        self._ids[start:end] = ids
+        self._size = end
+        sorted_ids, _, pending = self._lookup
+        pending.update(zip(ids.tolist(), range(start, end)))
+        if len(pending) > max(1024, len(sorted_ids) // 64):
+            self.compact()
+        return np.arange(start, end, dtype=np.int64)
+
+    def compact(self):
+        """Merge appended IDs into the sorted lookup arrays."""
+        if self._lookup[2]:
+            ids = self.ids
+            order = np.argsort(ids, kind='stable')
+            self._lookup = (ids[order], order, {})
+
+def _fits_integer(values, dtype):
+    info = np.iinfo(dtype)
+    return info.min <= values.min() and values.max() <= info.max
+
+def _compact_ids(values):
+    """Integer IDs as int32 when they fit; other IDs are returned unchanged."""
+    if pd.api.types.is_integer_dtype(values.dtype) and (values.empty or _fits_integer(values, np.int32)):
+        return values.astype(np.int32)
+    return values
+
+class GrowableTensor:
+    """Tensor with spare capacity along one dimension so appends are amortized O(1)."""
+
+    def __init__(self, tensor, dim=0):
+        self.dim = dim
+        self._storage = tensor
+        self.length = tensor.size(dim)
+
+    @property
+    def tensor(self):
+        return self._storage.narrow(self.dim, 0, self.length)
+
+    def append(self, values):
+        count = values.size(self.dim)
+        needed = self.length + count
+        capacity = self._storage.size(self.dim)
+        if needed > capacity:
+            shape = list(self._storage.shape)
+            shape[self.dim] = max(needed, 2 * capacity, 16)
+            storage = self._storage.new_empty(shape)
+            storage.narrow(self.dim, 0, self.length).copy_(self.tensor)
+            self._storage = storage
+        self._storage.narrow(self.dim, self.length, count).copy_(values)
+        self.length = needed
+        return self.tensor
+
+def _file_fingerprint(path, hash_contents=False):
+    """Size/mtime (and optionally sha256) of a source file, used to invalidate caches."""
+    stat = os.stat(path)
+    fingerprint = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if hash_contents:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        fingerprint['sha256'] = digest.hexdigest()
+    return fingerprint
+
+# ---------------------------
+# Velocity Features
+# ---------------------------
+def epoch_seconds(values):
+    """Timestamps (datetime strings, naive = UTC, or epoch seconds) as float seconds, NaN if missing."""
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float).to_numpy()
+    stamps = pd.to_datetime(values, utc=True, errors='coerce')
+    return ((stamps - pd.Timestamp(0, tz='UTC')) / pd.Timedelta(seconds=1)).astype(float).to_numpy()
+
+def velocity_keys(kind, ids):
+    """Store keys like 'user:42'; integral floats/strings normalize so CSV and JSON IDs agree."""
+    ids = pd.Series(ids, dtype=object)
+    numeric = pd.to_numeric(ids, errors='coerce')
+    integral = (numeric.notna() & (numeric == np.floor(numeric))).to_numpy()
+    keys = ids.astype(str).to_numpy(dtype=object)
+    keys[integral] = numeric[integral].astype(np.int64).astype(str).to_numpy()
+    keys = (kind + ':') + keys
+    keys[ids.isna().to_numpy()] = None
+    return keys
+
+class VelocityFeatureStore:
+    """Sliding-window order counts and amount sums per key (user or payment instrument).
+
+    Each window is a ring of `resolution` time buckets, so update and read are O(1):
+    a read at time t covers the buckets (b - resolution, b] with b = floor(t / width),
+    i.e. the window rounded to its bucket width. Keys live in fixed slots; a key idle
+    for longer than the largest window is expired, and past max_keys the least
+    recently updated key is evicted.
+    """
+
+    def __init__(self, windows, resolution=10, max_keys=100000):
+        self.windows = np.asarray(list(windows), dtype=np.float64)
+        self.widths = self.windows / resolution
+        self.resolution = resolution
+        self.max_keys = max_keys
+        self.horizon = float(self.windows.max())
+        self._slots = OrderedDict()
+        self._free = []
+        shape = (0, len(self.windows), resolution)
+        self._count = np.zeros(shape, dtype=np.int32)
+        self._amount = np.zeros(shape, dtype=np.float64)
+        self._bucket = np.zeros(shape, dtype=np.int64)
+        self._last_seen = np.zeros(0, dtype=np.float64)
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _grow(self):
+        size = len(self._last_seen)
+        grow = min(max(size, 1024), self.max_keys - size)
+        shape = (grow, len(self.windows), self.resolution)
+        self._count = np.concatenate([self._count, np.zeros(shape, dtype=np.int32)])
+        self._amount = np.concatenate([self._amount, np.zeros(shape, dtype=np.float64)])
+        self._bucket = np.concatenate([self._bucket, np.zeros(shape, dtype=np.int64)])
+        self._last_seen = np.concatenate([self._last_seen, np.zeros(grow)])
+        self._free.extend(range(size + grow - 1, size - 1, -1))
+
+    def _expire(self, now):
+        # Least recently updated keys come first, so this stops at the first active one
+        while self._slots:
+            key, slot = next(iter(self._slots.items()))
+            if self._last_seen[slot] >= now - self.horizon and len(self._slots) < self.max_keys:
+                break
+            if self._last_seen[slot] >= now - self.horizon:
+                self.evictions += 1
+            del self._slots[key]
+            self._free.append(slot)
+
+    def _slot(self, key, now):
+        slot = self._slots.get(key)
+        if slot is not None:
+            self._slots.move_to_end(key)
+            return slot
+        self._expire(now)
+        if not self._free:
+            self._grow()
+        slot = self._slots[key] = self._free.pop()
+        # Buckets far before any timestamp read later count as empty
+        self._bucket[slot] = np.iinfo(np.int64).min // 2
+        self._count[slot] = 0
+        self._amount[slot] = 0
+        self._last_seen[slot] = now
+        return slot
+
+    def update(self, key, timestamp, amount):
+        """Record one order and return the [count, amount] per window seen *before* it."""
+        slot = self._slot(key, timestamp)
+        current = np.floor(timestamp / self.widths).astype(np.int64)
+        buckets = self._bucket[slot]
+        live = (buckets > (current - self.resolution)[:, None]) & (buckets <= current[:, None])
+        features = np.empty(2 * len(self.windows))
+        features[0::2] = (self._count[slot] * live).sum(axis=1)
+        features[1::2] = (self._amount[slot] * live).sum(axis=1)
+
+        rows, pos = np.arange(len(self.windows)), current % self.resolution
+        # A slot holding a newer bucket means the event is older than the ring; it is dropped
+        held = buckets[rows, pos]
+        recycle = held < current
+        self._count[slot, rows[recycle], pos[recycle]] = 0
+        self._amount[slot, rows[recycle], pos[recycle]] = 0
+        buckets[rows[recycle], pos[recycle]] = current[recycle]
+        keep = held <= current
+        self._count[slot, rows[keep], pos[keep]] += 1
+        self._amount[slot, rows[keep], pos[keep]] += amount
+        self._last_seen[slot] = max(self._last_seen[slot], timestamp)
+        return features
+
+    def replay(self, keys, timestamps, amounts):
+        """Features every event would get from update() if events arrived in time order.
+
+        Vectorized (sort + searchsorted + cumulative sums) for building training
+        features; the store itself is not touched. Rows without a key or timestamp get 0.
+        """
+        features = np.zeros((len(keys), 2 * len(self.windows)), dtype=np.float32)
+        codes, _ = pd.factorize(pd.Series(keys, dtype=object))
+        rows = np.flatnonzero((codes >= 0) & ~np.isnan(timestamps))
+        if not len(rows):
+            return features
+        # Stable sort by key, then time: ties keep file order, like sequential updates would
+        rows = rows[np.lexsort((timestamps[rows], codes[rows]))]
+        codes, times = codes[rows].astype(np.int64), timestamps[rows]
+        cumulative = np.concatenate([[0.0], np.cumsum(amounts[rows])])
+        position = np.arange(len(rows))
+        for w, width in enumerate(self.widths):
+            bucket = np.floor(times / width).astype(np.int64)
+            bucket -= bucket.min()
+            # (key, bucket) is sorted, so the first event in the window is one searchsorted away
+            span = int(bucket.max()) + self.resolution + 1
+            first = np.searchsorted(codes * span + bucket, codes * span + bucket - self.resolution + 1, 'left')
+            features[rows, 2 * w] = position - first
+            features[rows, 2 * w + 1] = cumulative[position] - cumulative[first]
+        return features
+
+    def seed(self, keys, timestamps, amounts):
+        """Replay historical events into the store; only the last horizon of them can matter."""
+        valid = np.flatnonzero(pd.notna(keys) & ~np.isnan(timestamps))
+        if not len(valid):
+            return 0
+        recent = valid[timestamps[valid] > timestamps[valid].max() - self.horizon]
+        recent = recent[np.argsort(timestamps[recent], kind='stable')]
+        for i in recent.tolist():
+            self.update(keys[i], timestamps[i], amounts[i])
+        return len(recent)
+
+    def stats(self):
+        return {'keys': len(self._slots), 'capacity': len(self._last_seen), 'evictions': self.evictions,
+                'bytes': int(self._count.nbytes + self._amount.nbytes + self._bucket.nbytes
+                             + self._last_seen.nbytes)}
 
 # ---------------------------
 # Data Processor
 # ---------------------------
 class DataProcessor:
-    def __init__(self, order_data_path, user_data_path, payment_data_path):
+    CACHE_VERSION = 4
+    USER_FEATURE_COLUMNS = ['age', 'account_age_days', 'total_past_orders']
+    ORDER_FEATURE_COLUMNS = ['order_amount', 'num_items']
+    # Request payloads use different names for some user fields
+    REQUEST_FIELD_ALIASES = {'age': 'user_age', 'total_past_orders': 'user_total_orders'}
+    # Shared attribute values become nodes of their own, so users or payments sharing an IP,
+    # device or card are linked: (source type, id column, attribute column, relation, node type).
+    # Every relation also gets its reverse, (node type, 'shared_by', source type).
+    # is_international is deliberately not one: with two values it would make two hubs each
+    # linking about half the graph, which MAX_ATTRIBUTE_DEGREE sampling reduces to noise.
+    # A binary flag like that belongs among the payment's own features, not in the graph.
+    ATTRIBUTE_RELATIONS = [
+        ('user', 'user_id', 'registration_ip', 'registered_from', 'ip'),
+        ('user', 'user_id', 'registration_device', 'registered_on', 'device'),
+        ('user', 'user_id', 'email_domain', 'emails_at', 'email_domain'),
+        ('user', 'user_id', 'location', 'located_in', 'location'),
+        ('payment', 'payment_id', 'card_fingerprint', 'card', 'card_fingerprint'),
+    ]
+    # Hub values (gmail.com, a carrier NAT IP) keep a random sample of this many edges
+    MAX_ATTRIBUTE_DEGREE = 1000
+    # Order velocity features: orders and amount per user and payment over these windows,
+    # computed when orders.csv has one of TIMESTAMP_COLUMNS
+    VELOCITY_WINDOWS = {'10m': 600, '1h': 3600, '24h': 86400}
+    TIMESTAMP_COLUMNS = ('timestamp', 'order_date', 'created_at')
+    ID_COLUMNS = ('order_id', 'user_id', 'payment_id')
+    # Strings that are only ever compared or one-hot encoded load as categoricals
+    CATEGORICAL_COLUMNS = ('payment_type', 'registration_ip', 'registration_device', 'email_domain', 'location')
+
+    def __init__(self, order_data_path, user_data_path, payment_data_path, cache_dir=None, hash_sources=False,
+                 shared_attributes=None, csv_engine=None):
         self.order_data_path = order_data_path
         self.user_data_path = user_data_path
         self.payment_data_path = payment_data_path
+        # Optional on-disk graph cache; hash_sources adds a sha256 of each CSV to the
+        # mtime/size check at the cost of reading the files once per start.
+        self.cache_dir = cache_dir
+        self.hash_sources = hash_sources
+        # Attribute node types to build (default: all of ATTRIBUTE_RELATIONS); a model trained
+        # without some of them must be served from a graph without them
+        self.attribute_relations = [relation for relation in self.ATTRIBUTE_RELATIONS
+                                    if shared_attributes is None or relation[-1] in shared_attributes]
+        # 'pyarrow' parses CSVs multi-threaded when pyarrow is installed; None is pandas' C parser
+        if csv_engine == 'pyarrow' and importlib.util.find_spec('pyarrow') is None:
+            print("Warning: pyarrow is not installed; reading CSVs with the default parser.")
+            csv_engine = None
+        self.csv_engine = csv_engine
 
         self.node_mappings = {}
         self.edge_indices = {}
         self.node_features = {}
         self.labels = {}
+        self.feature_vocab = {}
+        self.feature_columns = {}
+        self.graph = None
+        self._buffers = {}
+        self._attribute_stats = {}
+        # Velocity history for appended orders that arrive without velocity columns
+        self._append_velocity_store = None
+
+    def _compact_dtypes(self):
+        dtypes = dict.fromkeys(self.USER_FEATURE_COLUMNS + self.ORDER_FEATURE_COLUMNS + ['card_last4'], 'float32')
+        dtypes.update(dict.fromkeys(self.CATEGORICAL_COLUMNS, 'category'))
+        dtypes['is_fraud'] = 'int8'
+        return dtypes
+
+    def _read_columns(self, path, columns):
+        """Read only the given columns of a CSV, with compact dtypes and int32 IDs where they fit."""
+        header = pd.read_csv(path, nrows=0).columns
+        usecols = [column for column in header if column in columns]
+        dtype = {column: kind for column, kind in self._compact_dtypes().items() if column in usecols}
+        try:
+            frame = pd.read_csv(path, usecols=usecols, dtype=dtype, engine=self.csv_engine)
+        except (TypeError, ValueError) as e:
+            # Malformed numbers: infer dtypes, the feature builders coerce them to floats later
+            print(f"Warning: {os.path.basename(path)} does not fit compact dtypes ({e}); inferring dtypes")
+            frame = pd.read_csv(path, usecols=usecols, engine=self.csv_engine)
+        for column in self.ID_COLUMNS:
+            if column in frame.columns:
+                frame[column] = _compact_ids(frame[column])
+        return frame
 
     def load_data(self):
-        """Load raw data from CSV files."""
-        self.orders_df = pd.read_csv(self.order_data_path)
-        self.users_df = pd.read_csv(self.user_data_path)
-        self.payments_df = pd.read_csv(self.payment_data_path)
+        """Load the columns that become nodes, features, edges or labels from the CSV files."""
+        # Only the first timestamp column is used for velocity features
+        header = pd.read_csv(self.order_data_path, nrows=0).columns
+        time_columns = [c for c in self.TIMESTAMP_COLUMNS if c in header][:1]
+        self.orders_df = self._read_columns(
+            self.order_data_path, {'order_id', 'user_id', 'payment_id', 'is_fraud', *time_columns,
+                                   *self.ORDER_FEATURE_COLUMNS})
+        attributes = {}
+        for source_type, _, column, _, _ in self.attribute_relations:
+            attributes.setdefault(source_type, set()).add('card_last4' if column == 'card_fingerprint' else column)
+        self.users_df = self._read_columns(
+            self.user_data_path, {'user_id', *self.USER_FEATURE_COLUMNS, *attributes.get('user', ())})
+        self.payments_df = self._read_columns(
+            self.payment_data_path, {'payment_id', 'payment_type', *attributes.get('payment', ())})
         if 'is_fraud' not in self.orders_df.columns:
             raise ValueError("Order data must have 'is_fraud' column")
 
+    def release_frames(self):
+        """Drop the raw DataFrames once the graph tensors are built."""
+        for name in ('orders_df', 'users_df', 'payments_df'):
+            self.__dict__.pop(name, None)
+        gc.collect()
+
     def create_node_mappings(self):
-        """Create mappings from original IDs to consecutive indices."""
-        unique_users = self.users_df['user_id'].astype(str).unique()
-        self.node_mappings['user'] = {uid: idx for idx, uid in enumerate(unique_users)}
+        """Create array-backed mappings from original IDs to consecutive indices."""
+        self.node_mappings['user'] = NodeIndex(self.users_df['user_id'].values)
+        self.node_mappings['order'] = NodeIndex(self.orders_df['order_id'].values)
+        self.node_mappings['payment'] = NodeIndex(self.payments_df['payment_id'].values)
+
+    @staticmethod
+    def _numeric_features(df, columns):
+        values = df.reindex(columns=columns).apply(pd.to_numeric, errors='coerce').fillna(0)
+        return torch.from_numpy(values.to_numpy(dtype=np.float32))
+
+    def build_user_features(self, users_df):
+        """User feature matrix; shared by graph construction and online scoring."""
+        return self._numeric_features(users_df, self.feature_columns.get('user', self.USER_FEATURE_COLUMNS))
+
+    def build_order_features(self, orders_df):
+        """Order feature matrix; shared by graph construction and online scoring."""
+        return self._numeric_features(orders_df, self.feature_columns.get('order', self.ORDER_FEATURE_COLUMNS))
+
+    @classmethod
+    def velocity_columns(cls, kind=None):
+        """Velocity feature names, in VelocityFeatureStore output order."""
+        kinds = ('user', 'payment') if kind is None else (kind,)
+        return [f'{kind}_{stat}_{label}' for kind in kinds
+                for label in cls.VELOCITY_WINDOWS for stat in ('orders', 'amount')]
+
+    def new_velocity_store(self, max_keys=100000):
+        return VelocityFeatureStore(self.VELOCITY_WINDOWS.values(), max_keys=max_keys)
+
+    def order_timestamps(self, orders_df):
+        """Order timestamps in epoch seconds, or None when the frame has no timestamp column."""
+        for column in self.TIMESTAMP_COLUMNS:
+            if column in orders_df.columns:
+                return epoch_seconds(orders_df[column])
+        return None
+
+    def velocity_frame(self, orders_df, timestamps):
+        """Point-in-time velocity features of every order, from the orders before it."""
+        store = self.new_velocity_store()
+        amounts = pd.to_numeric(orders_df.get('order_amount', pd.Series(0, index=orders_df.index)),
+                                errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        features = [store.replay(velocity_keys(kind, orders_df[f'{kind}_id']), timestamps, amounts)
+                    for kind in ('user', 'payment')]
+        return pd.DataFrame(np.concatenate(features, axis=1).astype(np.float32), columns=self.velocity_columns(),
+                            index=orders_df.index)
 
-        unique_orders = self.orders_df['order_id'].astype(str).unique()
-        self.node_mappings['order'] = {oid: idx for idx, oid in enumerate(unique_orders)}
+    def order_time_column(self, path=None):
+        """The timestamp column velocity features use in an orders CSV, or None."""
+        header = pd.read_csv(path or self.order_data_path, nrows=0).columns
+        return next((c for c in self.TIMESTAMP_COLUMNS if c in header), None)
 
-        unique_payments = self.payments_df['payment_id'].astype(str).unique()
-        self.node_mappings['payment'] = {pid: idx for idx, pid in enumerate(unique_payments)}
+    def velocity_event_chunks(self, path=None, chunk_size=100000):
+        """(user keys, payment keys, epoch seconds, amounts) of an orders CSV, chunk by chunk.
+
+        Only the ID, amount and timestamp columns are read and timestamps are parsed per
+        chunk, so memory is O(chunk_size). Amounts are rounded to float32 as in load_data.
+        """
+        path = path or self.order_data_path
+        header = pd.read_csv(path, nrows=0).columns
+        time_column = self.order_time_column(path)
+        if time_column is None:
+            return
+        usecols = [c for c in ('user_id', 'payment_id', 'order_amount', time_column) if c in header]
+        # The pyarrow engine can't read in chunks, so this always uses pandas' parser
+        for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunk_size):
+            amounts = pd.to_numeric(chunk.get('order_amount', pd.Series(0, index=chunk.index)), errors='coerce')
+            amounts = amounts.fillna(0).to_numpy(dtype=np.float32).astype(np.float64)
+            keys = [velocity_keys(kind, chunk[f'{kind}_id']) if f'{kind}_id' in chunk.columns
+                    else np.full(len(chunk), None, dtype=object) for kind in ('user', 'payment')]
+            yield keys[0], keys[1], epoch_seconds(chunk[time_column]), amounts
+
+    def seed_velocity(self, store, chunk_size=100000):
+        """Load the recent order history from orders.csv into a serving velocity store.
+
+        The file is read in chunks and only events within the store's largest window of
+        the newest one are kept, so memory is O(chunk_size + recent events).
+        """
+        if not self.order_data_path or not os.path.exists(self.order_data_path):
+            return 0
+        recent, latest = [], -np.inf
+        for chunk in self.velocity_event_chunks(chunk_size=chunk_size):
+            timestamps = chunk[2]
+            if np.isfinite(timestamps).any():
+                latest = max(latest, np.nanmax(timestamps))
+            recent.append(chunk)
+            # Events that fell out of the window of the newest one can no longer affect a read
+            recent = [tuple(column[part[2] > latest - store.horizon] for column in part) for part in recent]
+            recent = [part for part in recent if len(part[2])]
+        if not recent:
+            return 0
+        users, payments, timestamps, amounts = (np.concatenate(columns) for columns in zip(*recent))
+        seeded = sum(store.seed(keys, timestamps, amounts) for keys in (users, payments))
+        print(f"Velocity store seeded with {seeded:,} recent order events ({len(store):,} keys)")
+        return seeded
+
+    def build_payment_features(self, payments_df):
+        """One-hot 'payment_type' over the training vocabulary; unseen types encode as all zeros."""
+        vocab = self.feature_vocab['payment_type']
+        if 'payment_type' in payments_df.columns:
+            types = payments_df['payment_type'].astype(str)
+        else:
+            types = pd.Series([None] * len(payments_df), dtype=object)
+        codes = pd.Categorical(types, categories=vocab).codes
+        features = np.zeros((len(codes), len(vocab)), dtype=np.float32)
+        known = codes >= 0
+        features[np.flatnonzero(known), codes[known]] = 1
+        return torch.from_numpy(features)
+
+    def request_frame(self, orders):
+        """Turn request payloads into a frame that the build_*_features methods accept."""
+        frame = pd.DataFrame.from_records(list(orders))
+        for column, alias in self.REQUEST_FIELD_ALIASES.items():
+            if column not in frame.columns and alias in frame.columns:
+                frame[column] = frame[alias]
+        if 'payment_type' not in frame.columns:
+            # Older clients send the one-hot position instead of the type name
+            vocab = self.feature_vocab.get('payment_type', [])
+            idx = pd.to_numeric(frame.get('payment_type_idx', pd.Series(index=frame.index, dtype=float)),
+                                errors='coerce')
+            frame['payment_type'] = [vocab[int(i)] if i == i and 0 <= i < len(vocab) else None for i in idx]
+        for column in ('user_id', 'payment_id'):
+            if column not in frame.columns:
+                frame[column] = None
+        return frame
 
     def extract_node_features(self):
         """Extract and store features for each node type as tensors."""
         # For users, use the available columns: 'age', 'account_age_days', 'total_past_orders'
-        user_cols = ['age', 'account_age_days', 'total_past_orders']
-        missing_user_cols = set(user_cols) - set(self.users_df.columns)
+        missing_user_cols = set(self.USER_FEATURE_COLUMNS) - set(self.users_df.columns)
         if missing_user_cols:
             print(f"Warning: The following expected user columns are missing: {missing_user_cols}")
-        user_features = self.users_df[[col for col in user_cols if col in self.users_df.columns]].values
-        self.node_features['user'] = torch.tensor(user_features, dtype=torch.float)
+        self.feature_columns['user'] = [col for col in self.USER_FEATURE_COLUMNS if col in self.users_df.columns]
+        self.node_features['user'] = self.build_user_features(self.users_df)
 
         # For orders, use 'order_amount' and 'num_items'
-        order_cols = ['order_amount', 'num_items']
-        missing_order_cols = set(order_cols) - set(self.orders_df.columns)
+        missing_order_cols = set(self.ORDER_FEATURE_COLUMNS) - set(self.orders_df.columns)
         if missing_order_cols:
             print(f"Warning: The following expected order columns are missing: {missing_order_cols}")
-        order_features = self.orders_df[[col for col in order_cols if col in self.orders_df.columns]].values
-        self.node_features['order'] = torch.tensor(order_features, dtype=torch.float)
+        self.feature_columns['order'] = [col for col in self.ORDER_FEATURE_COLUMNS if col in self.orders_df.columns]
+        # Velocity features are replayed in time order so each order only sees the orders before it
+        timestamps = self.order_timestamps(self.orders_df)
+        if timestamps is None:
+            print(f"Warning: orders have none of {list(self.TIMESTAMP_COLUMNS)}; velocity features disabled")
+        else:
+            velocity = self.velocity_frame(self.orders_df, timestamps)
+            self.orders_df = pd.concat([self.orders_df.drop(columns=velocity.columns, errors='ignore'), velocity],
+                                       axis=1)
+            self.feature_columns['order'] += self.velocity_columns()
+        self.node_features['order'] = self.build_order_features(self.orders_df)
 
         # For payments: one-hot encode 'payment_type'
         if 'payment_type' not in self.payments_df.columns:
             raise ValueError("payments.csv must have a 'payment_type' column")
-        payment_types = pd.get_dummies(self.payments_df['payment_type']).values
-        self.node_features['payment'] = torch.tensor(payment_types, dtype=torch.float)
+        self.feature_vocab['payment_type'] = sorted(self.payments_df['payment_type'].dropna().astype(str).unique())
+        self.node_features['payment'] = self.build_payment_features(self.payments_df)
 
         # Fraud labels for orders (assume 0: legitimate, 1: fraud)
         self.labels['order'] = torch.tensor(self.orders_df['is_fraud'].values, dtype=torch.long)
 
+    def _edge_index(self, df, src_col, src_type, dst_col, dst_type):
+        """Map an ID-pair frame to a [2, E] edge index without per-row Python work."""
+        src = self.node_mappings[src_type].lookup(df[src_col].values)
+        dst = self.node_mappings[dst_type].lookup(df[dst_col].values)
+        return torch.from_numpy(np.stack([src, dst]))
+
     def create_edge_indices(self):
         """Create edge indices (relationships) between node types."""
         # User places Order edges
         user_order_df = self.orders_df[['user_id', 'order_id']].drop_duplicates()
-        user_indices = [self.node_mappings['user'][str(uid)] for uid in user_order_df['user_id']]
-        order_indices = [self.node_mappings['order'][str(oid)] for oid in user_order_df['order_id']]
-        self.edge_indices[('user', 'places', 'order')] = torch.tensor([user_indices, order_indices])
-        self.edge_indices[('order', 'placed_by', 'user')] = torch.tensor([order_indices, user_indices])
+        edge_index = self._edge_index(user_order_df, 'user_id', 'user', 'order_id', 'order')
+        self.edge_indices[('user', 'places', 'order')] = edge_index
+        self.edge_indices[('order', 'placed_by', 'user')] = edge_index.flip(0)
 
         # Order uses Payment edges
         order_payment_df = self.orders_df[['order_id', 'payment_id']].drop_duplicates()
-        order_indices = [self.node_mappings['order'][str(oid)] for oid in order_payment_df['order_id']]
-        payment_indices = [self.node_mappings['payment'][str(pid)] for pid in order_payment_df['payment_id']]
-        self.edge_indices[('order', 'uses', 'payment')] = torch.tensor([order_indices, payment_indices])
-        self.edge_indices[('payment', 'used_by', 'order')] = torch.tensor([payment_indices, order_indices])
+        edge_index = self._edge_index(order_payment_df, 'order_id', 'order', 'payment_id', 'payment')
+        self.edge_indices[('order', 'uses', 'payment')] = edge_index
+        self.edge_indices[('payment', 'used_by', 'order')] = edge_index.flip(0)
+
+    @staticmethod
+    def attribute_values(frame, column):
+        """Normalized attribute values of a user/payment frame, NaN where missing.
+
+        'card_fingerprint' is derived from payment_type and card_last4, the closest
+        thing to a card identity the payment data carries.
+        """
+        if column == 'card_fingerprint':
+            if 'card_last4' not in frame.columns:
+                return pd.Series(np.nan, index=frame.index, dtype=object)
+            last4 = pd.to_numeric(frame['card_last4'], errors='coerce')
+            kind = frame['payment_type'].astype(str) + ':' if 'payment_type' in frame.columns else ''
+            return (kind + last4.map('{:04.0f}'.format)).where(last4.notna())
+        if column not in frame.columns:
+            return pd.Series(np.nan, index=frame.index, dtype=object)
+        values = frame[column].astype(str).str.strip().str.lower()
+        return values.where(frame[column].notna() & (values != ''))
+
+    def _attribute_edges(self, relation, frame, source_idx):
+        """(source, attribute) index pairs for frame rows, capping every attribute's degree.
+
+        Values are grouped by hashing, so this is linear in the number of rows. Also
+        returns the attribute index of every distinct pair before the cap, for counting.
+        """
+        _, _, column, _, attr_type = relation
+        values = self.attribute_values(frame, column)
+        has_value = values.notna().to_numpy()
+        pairs = pd.DataFrame({'src': source_idx[has_value], 'value': values.to_numpy()[has_value]})
+        pairs = pairs.drop_duplicates()
+        if attr_type in self.node_mappings:
+            # Appending to a built graph: unseen values become new attribute nodes
+            index = self.node_mappings[attr_type]
+            dst = index.get_indexer(pairs['value'].to_numpy())
+            unseen = pd.unique(pairs['value'].to_numpy()[dst < 0])
+            if len(unseen):
+                self._append_rows(attr_type, unseen, torch.zeros(len(unseen), 1))
+                dst = index.get_indexer(pairs['value'].to_numpy())
+            degree = self._attribute_state(relation)['degree']
+        else:
+            dst, uniques = pd.factorize(pairs['value'])
+            self.node_mappings[attr_type] = NodeIndex(np.asarray(uniques, dtype=object))
+            degree = np.zeros(len(uniques), dtype=np.int64)
+        pairs['dst'] = dst
+
+        # Shuffle, then keep the first (cap - existing degree) edges of every value
+        pairs = pairs.sample(frac=1, random_state=0)
+        room = self.MAX_ATTRIBUTE_DEGREE - degree[pairs['dst'].to_numpy()]
+        pairs = pairs[pairs.groupby('dst').cumcount().to_numpy() < room].sort_index()
+        return pairs['src'].to_numpy(dtype=np.int64), pairs['dst'].to_numpy(dtype=np.int64), dst
+
+    def create_attribute_edges(self):
+        """Add a node type per shared attribute, linked to the users/payments carrying it.
+
+        An attribute node's only feature is log1p(number of users/payments sharing the
+        value), counted before the degree cap.
+        """
+        for relation in self.attribute_relations:
+            source_type, id_column, column, name, attr_type = relation
+            frame = self.users_df if source_type == 'user' else self.payments_df
+            if ('card_last4' if column == 'card_fingerprint' else column) not in frame.columns:
+                continue
+            source_idx = self.node_mappings[source_type].lookup(frame[id_column].values)
+            src, dst, all_dst = self._attribute_edges(relation, frame, source_idx)
+            counts = np.bincount(all_dst, minlength=len(self.node_mappings[attr_type]))
+            self.node_features[attr_type] = torch.from_numpy(np.log1p(counts).astype(np.float32)[:, None])
+            edge_index = torch.from_numpy(np.stack([src, dst]))
+            self.edge_indices[(source_type, name, attr_type)] = edge_index
+            self.edge_indices[(attr_type, 'shared_by', source_type)] = edge_index.flip(0)
+            print(f"Shared attribute '{attr_type}': {len(counts):,} values, {len(src):,} edges "
+                  f"({int((counts > self.MAX_ATTRIBUTE_DEGREE).sum())} capped at {self.MAX_ATTRIBUTE_DEGREE})")
+
+    def _dict_edge_indices(self):
+        """Baseline dict-based construction, kept for benchmarking the vectorized path."""
+        mappings = {
+            'user': {uid: idx for idx, uid in enumerate(self.users_df['user_id'].astype(str).unique())},
+            'order': {oid: idx for idx, oid in enumerate(self.orders_df['order_id'].astype(str).unique())},
+            'payment': {pid: idx for idx, pid in enumerate(self.payments_df['payment_id'].astype(str).unique())},
+        }
+        edge_indices = {}
+        user_order_df = self.orders_df[['user_id', 'order_id']].drop_duplicates()
+        user_indices = [mappings['user'][str(uid)] for uid in user_order_df['user_id']]
+        order_indices = [mappings['order'][str(oid)] for oid in user_order_df['order_id']]
+        edge_indices[('user', 'places', 'order')] = torch.tensor([user_indices, order_indices])
+        edge_indices[('order', 'placed_by', 'user')] = torch.tensor([order_indices, user_indices])
+
+        order_payment_df = self.orders_df[['order_id', 'payment_id']].drop_duplicates()
+        order_indices = [mappings['order'][str(oid)] for oid in order_payment_df['order_id']]
+        payment_indices = [mappings['payment'][str(pid)] for pid in order_payment_df['payment_id']]
+        edge_indices[('order', 'uses', 'payment')] = torch.tensor([order_indices, payment_indices])
+        edge_indices[('payment', 'used_by', 'order')] = torch.tensor([payment_indices, order_indices])
+        return edge_indices
+
+    def benchmark_construction(self):
+        """Time dict-based vs vectorized mapping/edge construction on the loaded data.
+
+        Peak memory is the tracemalloc peak, which covers Python objects and numpy
+        buffers but not torch-owned storage.
+        """
+        if not hasattr(self, 'orders_df'):
+            self.load_data()
+        num_rows = len(self.orders_df) + len(self.users_df) + len(self.payments_df)
+
+        def measure(fn):
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return result, elapsed, peak
+
+        def vectorized():
+            self.create_node_mappings()
+            self.create_edge_indices()
+            return dict(self.edge_indices)
+
+        baseline_edges, baseline_time, baseline_peak = measure(self._dict_edge_indices)
+        vectorized_edges, vectorized_time, vectorized_peak = measure(vectorized)
+
+        identical = all(torch.equal(baseline_edges[k], vectorized_edges[k]) for k in baseline_edges)
+        report = {
+            'rows': num_rows,
+            'dict': {'seconds': baseline_time, 'rows_per_sec': num_rows / max(baseline_time, 1e-9),
+                     'peak_mb': baseline_peak / 2**20},
+            'vectorized': {'seconds': vectorized_time, 'rows_per_sec': num_rows / max(vectorized_time, 1e-9),
+                           'peak_mb': vectorized_peak / 2**20},
+            'identical_edges': identical,
+        }
+        for name in ('dict', 'vectorized'):
+            stats = report[name]
+            print(f"{name:>10}: {stats['seconds']:.3f}s, {stats['rows_per_sec']:,.0f} rows/sec, "
+                  f"peak {stats['peak_mb']:.1f} MB")
+        print(f"Edge indices identical: {identical}")
+        return report
+
+    @classmethod
+    def feature_layout(cls):
+        """The candidate feature columns this code builds; a cache built with others is stale."""
+        return {'user': list(cls.USER_FEATURE_COLUMNS),
+                'order': list(cls.ORDER_FEATURE_COLUMNS) + cls.velocity_columns(),
+                'timestamp_columns': list(cls.TIMESTAMP_COLUMNS)}
+
+    def _source_fingerprints(self):
+        paths = [self.order_data_path, self.user_data_path, self.payment_data_path]
+        return [_file_fingerprint(path, self.hash_sources) for path in paths]
+
+    @staticmethod
+    def _edge_file(edge_type):
+        return 'edge_' + '__'.join(edge_type) + '.npy'
+
+    def save_cache(self):
+        """Persist features, edge indices, ID mappings and vocabularies as .npy files."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest_path = os.path.join(self.cache_dir, 'manifest.json')
+        # Drop the manifest first so a crash mid-write leaves an invalid (not corrupt) cache
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        for node_type, features in self.node_features.items():
+            np.save(os.path.join(self.cache_dir, f'x_{node_type}.npy'), features.numpy())
+        for edge_type, edge_index in self.edge_indices.items():
+            np.save(os.path.join(self.cache_dir, self._edge_file(edge_type)), edge_index.numpy())
+        for node_type, index in self.node_mappings.items():
+            index.compact()
+            if index.ids.dtype == object:
+                # Object arrays need pickle and cannot be memory-mapped
+                index = NodeIndex(index.ids.astype(str))
+                self.node_mappings[node_type] = index
+            np.save(os.path.join(self.cache_dir, f'ids_{node_type}.npy'), index.ids)
+            np.save(os.path.join(self.cache_dir, f'order_{node_type}.npy'), index._order)
+        np.save(os.path.join(self.cache_dir, 'y_order.npy'), self.labels['order'].numpy())
+
+        manifest = {
+            'version': self.CACHE_VERSION,
+            'sources': self._source_fingerprints(),
+            'node_types': list(self.node_features.keys()),
+            'edge_types': [list(edge_type) for edge_type in self.edge_indices.keys()],
+            'feature_vocab': self.feature_vocab,
+            'feature_columns': self.feature_columns,
+            'attribute_types': [relation[-1] for relation in self.attribute_relations],
+            'feature_layout': self.feature_layout(),
+        }
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    def load_cache(self):
+        """Memory-map a previously saved graph; return False if missing or stale."""
+        manifest_path = os.path.join(self.cache_dir, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            return False
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') != self.CACHE_VERSION:
+                return False
+            if manifest['attribute_types'] != [relation[-1] for relation in self.attribute_relations]:
+                print("Graph cache was built with other shared attributes, rebuilding...")
+                return False
+            if manifest.get('feature_layout') != self.feature_layout():
+                print("Graph cache was built with other node features, rebuilding...")
+                return False
+            if manifest['sources'] != self._source_fingerprints():
+                print("Graph cache is stale, rebuilding from CSV files...")
+                return False
+
+            def load(name):
+                # Copy-on-write mapping: pages are shared with the file until written
+                return np.load(os.path.join(self.cache_dir, name), mmap_mode='c')
+
+            for node_type in manifest['node_types']:
+                self.node_features[node_type] = torch.from_numpy(load(f'x_{node_type}.npy'))
+                self.node_mappings[node_type] = NodeIndex.from_arrays(
+                    load(f'ids_{node_type}.npy'), load(f'order_{node_type}.npy'))
+            for edge_type in manifest['edge_types']:
+                edge_type = tuple(edge_type)
+                self.edge_indices[edge_type] = torch.from_numpy(load(self._edge_file(edge_type)))
+            self.labels['order'] = torch.from_numpy(load('y_order.npy'))
+            self.feature_vocab = manifest['feature_vocab']
+            self.feature_columns = manifest['feature_columns']
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Warning: Could not load graph cache ({e}), rebuilding from CSV files...")
+            self.node_features, self.edge_indices, self.node_mappings = {}, {}, {}
+            return False
+        return True
 
     def create_heterograph(self):
         """Create and return a heterogeneous graph using HeteroData."""
-        self.load_data()
-        self.create_node_mappings()
-        self.extract_node_features()
-        self.create_edge_indices()
+        if self.cache_dir and self.load_cache():
+            print(f"Loaded graph from cache {self.cache_dir}")
+        else:
+            self.load_data()
+            self.create_node_mappings()
+            self.extract_node_features()
+            self.create_edge_indices()
+            self.create_attribute_edges()
+            self.release_frames()
+            if self.cache_dir:
+                self.save_cache()
+        return self._assemble_graph()
 
+    def _assemble_graph(self):
         data = HeteroData()
         # Set node features
         for node_type, features in self.node_features.items():
@@ -104,17 +917,221 @@ class DataProcessor:
         # Set fraud labels for orders
         data['order'].y = self.labels['order']
 
+        self.graph = data
+        self._buffers = {}
+        self._attribute_stats = {}
         return data
 
-    def split_data(self, data, test_size=0.2, val_size=0.1):
+    def _as_frame(self, rows):
+        """Accept a DataFrame, a CSV path or a list of dicts for append()."""
+        if rows is None or isinstance(rows, pd.DataFrame):
+            return rows
+        if isinstance(rows, (str, os.PathLike)):
+            return pd.read_csv(rows)
+        return self.request_frame(rows)
+
+    def _buffer(self, key, tensor, dim=0):
+        # Reuse the growth buffer only while the graph still holds its tensor
+        buffer = self._buffers.get(key)
+        if (buffer is None or buffer.length != tensor.size(dim)
+                or buffer.tensor.data_ptr() != tensor.data_ptr()):
+            buffer = self._buffers[key] = GrowableTensor(tensor, dim)
+        return buffer
+
+    def _append_rows(self, node_type, ids, features):
+        """Append brand-new nodes, their features and (for orders) labels and masks."""
+        if len(ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        indices = self.node_mappings[node_type].append(ids)
+        store = self.graph[node_type]
+        store.x = self.node_features[node_type] = self._buffer(node_type, store.x).append(features)
+        return indices
+
+    def _append_edges(self, edge_type, src, dst, new_edges):
+        if edge_type not in self.edge_indices or len(src) == 0:
+            return
+        store = self.graph[edge_type]
+        pairs = torch.from_numpy(np.stack([src, dst]).astype(np.int64))
+        store.edge_index = self.edge_indices[edge_type] = self._buffer(edge_type, store.edge_index, 1).append(pairs)
+        new_edges[edge_type] = (src, dst)
+
+    def _attribute_state(self, relation):
+        """Per-node value counts and capped edge degrees of an attribute type, kept for appends."""
+        source_type, _, _, name, attr_type = relation
+        num_nodes = len(self.node_mappings[attr_type])
+        state = self._attribute_stats.get(attr_type)
+        if state is None:
+            # Rebuilt once from the graph itself, which may have come from the cache
+            x = self.graph[attr_type].x[:, 0].double().numpy()
+            edge_index = self.graph[(source_type, name, attr_type)].edge_index
+            state = self._attribute_stats[attr_type] = {
+                'count': np.rint(np.expm1(x)).astype(np.int64),
+                'degree': np.bincount(edge_index[1].numpy(), minlength=len(x)).astype(np.int64),
+            }
+        if len(state['count']) < num_nodes:
+            grow = max(num_nodes, 2 * len(state['count'])) - len(state['count'])
+            for key in state:
+                state[key] = np.concatenate([state[key], np.zeros(grow, dtype=np.int64)])
+        return state
+
+    def _link_attributes(self, source_type, frame, source_idx, new_edges, touched):
+        """Connect newly added users/payments to their (possibly new) attribute nodes."""
+        for relation in self.attribute_relations:
+            source, _, _, name, attr_type = relation
+            if source != source_type or attr_type not in self.node_mappings:
+                continue
+            src, dst, all_dst = self._attribute_edges(relation, frame, source_idx)
+            if len(all_dst) == 0:
+                continue
+            state = self._attribute_state(relation)
+            np.add.at(state['count'], all_dst, 1)
+            np.add.at(state['degree'], dst, 1)
+            changed = np.unique(all_dst)
+            self.graph[attr_type].x[torch.from_numpy(changed)] = torch.from_numpy(
+                np.log1p(state['count'][changed]).astype(np.float32)[:, None])
+            self._append_edges((source, name, attr_type), src, dst, new_edges)
+            self._append_edges((attr_type, 'shared_by', source), dst, src, new_edges)
+            touched[attr_type].append(changed)
+
+    def _upsert_nodes(self, node_type, id_column, frame, build_features, new_edges, touched):
+        """Overwrite features of known nodes and append unknown ones; returns their indices.
+
+        Attribute edges are only added for the appended nodes.
+        """
+        frame = frame[frame[id_column].notna()].drop_duplicates(subset=id_column, keep='last')
+        ids = frame[id_column].to_numpy()
+        indices = self.node_mappings[node_type].get_indexer(ids)
+        features = build_features(frame)
+        known = indices >= 0
+        if known.any():
+            self.graph[node_type].x[torch.from_numpy(indices[known])] = features[torch.from_numpy(known)]
+        new_indices = self._append_rows(node_type, ids[~known], features[torch.from_numpy(~known)])
+        if len(new_indices):
+            self._link_attributes(node_type, frame[~known], new_indices, new_edges, touched)
+        return np.concatenate([indices[known], new_indices])
+
+    def _append_velocity(self, orders):
+        """Velocity columns for appended orders, continuing the recent history of orders.csv.
+
+        Orders are recorded in time order into a store seeded like the serving one, so a
+        delta of new orders gets the features create_heterograph would give them.
+        """
+        timestamps = self.order_timestamps(orders)
+        if timestamps is None:
+            raise ValueError(f"Appended orders need one of {list(self.TIMESTAMP_COLUMNS)} for velocity features")
+        if self._append_velocity_store is None:
+            self._append_velocity_store = self.new_velocity_store()
+            self.seed_velocity(self._append_velocity_store)
+        store = self._append_velocity_store
+        amounts = pd.to_numeric(orders.get('order_amount', pd.Series(0, index=orders.index)),
+                                errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        features = {}
+        for kind in ('user', 'payment'):
+            ids = orders[f'{kind}_id'] if f'{kind}_id' in orders.columns else pd.Series(None, index=orders.index)
+            features[kind] = (velocity_keys(kind, ids), np.zeros((len(orders), 2 * len(self.VELOCITY_WINDOWS)),
+                                                                 dtype=np.float32))
+        for i in np.argsort(timestamps, kind='stable').tolist():
+            if np.isnan(timestamps[i]):
+                continue
+            for keys, values in features.values():
+                if keys[i] is not None:
+                    values[i] = store.update(keys[i], timestamps[i], amounts[i])
+        columns = {}
+        for kind, (_, values) in features.items():
+            columns.update(zip(self.velocity_columns(kind), values.T))
+        return orders.assign(**columns)
+
+    def append(self, orders=None, users=None, payments=None):
+        """Grow the built graph in place with new orders, users and payments.
+
+        Each argument may be a DataFrame, a CSV path or a list of dicts. Supplied users
+        and payments that already exist get their features overwritten; users and
+        payments referenced by new orders but not supplied are created from the order
+        rows. Orders already in the graph are skipped. New orders keep their is_fraud
+        label when present (0 otherwise) and are in no train/val/test mask. Velocity
+        features are computed from their timestamps unless the rows already carry them.
+
+        Returns the indices of every node whose features or edges changed and the new
+        edges per relation, so samplers and caches can be updated incrementally.
+        """
+        if self.graph is None:
+            raise ValueError("create_heterograph() must run before append()")
+        empty = np.zeros(0, dtype=np.int64)
+        touched = {node_type: [empty] for node_type in self.graph.node_types}
+        new_edges = {}
+        users, payments, orders = self._as_frame(users), self._as_frame(payments), self._as_frame(orders)
+
+        if users is not None and len(users):
+            touched['user'].append(
+                self._upsert_nodes('user', 'user_id', users, self.build_user_features, new_edges, touched))
+        if payments is not None and len(payments):
+            touched['payment'].append(self._upsert_nodes('payment', 'payment_id', payments,
+                                                         self.build_payment_features, new_edges, touched))
+
+        skipped = 0
+        if orders is not None and len(orders):
+            orders = orders.drop_duplicates(subset='order_id', keep='last')
+            known = self.node_mappings['order'].get_indexer(orders['order_id'].to_numpy()) >= 0
+            skipped = int(known.sum())
+            orders = orders[~known]
+            velocity = self.velocity_columns()
+            if set(velocity) <= set(self.feature_columns.get('order', [])) and not set(velocity) <= set(orders.columns):
+                orders = self._append_velocity(orders)
+
+            # Referenced users/payments that were never supplied are built from the order rows
+            endpoints = {}
+            for node_type, id_column, build_features in (
+                    ('user', 'user_id', self.build_user_features),
+                    ('payment', 'payment_id', self.build_payment_features)):
+                if id_column not in orders.columns:
+                    endpoints[node_type] = np.full(len(orders), -1, dtype=np.int64)
+                    continue
+                ids = orders[id_column].to_numpy()
+                unseen = (self.node_mappings[node_type].get_indexer(ids) < 0) & orders[id_column].notna().to_numpy()
+                if unseen.any():
+                    self._upsert_nodes(node_type, id_column, orders[unseen], build_features, new_edges, touched)
+                endpoints[node_type] = self.node_mappings[node_type].get_indexer(ids)
+
+            order_idx = self._append_rows('order', orders['order_id'].to_numpy(), self.build_order_features(orders))
+            if len(order_idx):
+                store = self.graph['order']
+                labels = pd.to_numeric(orders['is_fraud'], errors='coerce') if 'is_fraud' in orders.columns \
+                    else pd.Series(np.zeros(len(orders)))
+                labels = torch.from_numpy(labels.fillna(0).to_numpy(dtype=np.int64))
+                store.y = self.labels['order'] = self._buffer(('order', 'y'), store.y).append(labels)
+                for mask_name in ('train_mask', 'val_mask', 'test_mask'):
+                    if mask_name in store:
+                        store[mask_name] = self._buffer(('order', mask_name), store[mask_name]).append(
+                            torch.zeros(len(order_idx), dtype=torch.bool))
+
+                user_idx, payment_idx = endpoints['user'], endpoints['payment']
+                has_user, has_payment = user_idx >= 0, payment_idx >= 0
+                self._append_edges(('user', 'places', 'order'), user_idx[has_user], order_idx[has_user], new_edges)
+                self._append_edges(('order', 'placed_by', 'user'), order_idx[has_user], user_idx[has_user], new_edges)
+                self._append_edges(('order', 'uses', 'payment'), order_idx[has_payment], payment_idx[has_payment],
+                                   new_edges)
+                self._append_edges(('payment', 'used_by', 'order'), payment_idx[has_payment], order_idx[has_payment],
+                                   new_edges)
+                touched['order'].append(order_idx)
+                touched['user'].append(user_idx[has_user])
+                touched['payment'].append(payment_idx[has_payment])
+
+        return {
+            'nodes': {node_type: np.unique(np.concatenate(parts)) for node_type, parts in touched.items()},
+            'edges': new_edges,
+            'skipped_orders': skipped,
+        }
+
+    def split_data(self, data, test_size=0.2, val_size=0.1, random_state=None):
         """Split the order nodes into train, validation, and test masks."""
         num_orders = data['order'].x.size(0)
         order_indices = np.arange(num_orders)
         train_val_idx, test_idx = train_test_split(order_indices, test_size=test_size, 
-                                                  stratify=data['order'].y.numpy())
+                                                  stratify=data['order'].y.numpy(), random_state=random_state)
         val_size_adjusted = val_size / (1 - test_size)
         train_idx, val_idx = train_test_split(train_val_idx, test_size=val_size_adjusted,
-                                             stratify=data['order'].y[train_val_idx].numpy())
+                                             stratify=data['order'].y[train_val_idx].numpy(),
+                                             random_state=random_state)
 
         train_mask = torch.zeros(num_orders, dtype=torch.bool)
         val_mask = torch.zeros(num_orders, dtype=torch.bool)
@@ -130,6 +1147,190 @@ class DataProcessor:
 
         return data
 
+# ---------------------------
+# Neighborhood Sampling
+# ---------------------------
+class HeteroNeighborSampler:
+    """Fixed-fanout k-hop neighborhood sampler over a HeteroData graph.
+
+    Each relation is stored as CSR keyed by destination node, so sampling the
+    incoming neighbors of a frontier (the nodes HGTConv aggregates from) is a
+    handful of vectorized numpy operations per hop.
+    """
+
+    def __init__(self, data, num_neighbors, seed=None, csr=None):
+        self.data = data
+        self.num_neighbors = list(num_neighbors)
+        self.rng = np.random.default_rng(seed)
+        if csr is None:
+            self.rebuild()
+        else:
+            # CSR built by another sampler (see share_memory()), used without copying
+            self._set_csr({edge_type: tuple(array.numpy() for array in arrays) for edge_type, arrays in csr.items()})
+
+    def rebuild(self):
+        """(Re)build the CSR arrays from the graph, folding in edges added since."""
+        self._set_csr({edge_type: self._build_csr(self.data[edge_type].edge_index, self.data[edge_type[2]].num_nodes)
+                       for edge_type in self.data.edge_types})
+
+    def share_memory(self):
+        """Move the CSR arrays to shared memory and return them as tensors for `csr=` in other processes."""
+        shared = {}
+        for edge_type, arrays in self.csr.items():
+            shared[edge_type] = tuple(torch.from_numpy(array) for array in arrays)
+            for tensor in shared[edge_type]:
+                _share_tensor(tensor)
+        self.csr = {edge_type: tuple(tensor.numpy() for tensor in tensors) for edge_type, tensors in shared.items()}
+        return shared
+
+    def _set_csr(self, csr):
+        self.csr = csr
+        # Edges appended after the build, as {dst: [src, ...]}, until the next rebuild
+        self._extra = {edge_type: {} for edge_type in self.csr}
+        self._extra_keys = {}
+        self._num_extra = 0
+
+    def add_edges(self, edge_type, src, dst):
+        """Make newly appended edges samplable without rebuilding the CSR every time."""
+        extra = self._extra[edge_type]
+        for s, d in zip(np.asarray(src).tolist(), np.asarray(dst).tolist()):
+            extra.setdefault(d, []).append(s)
+        self._extra_keys.pop(edge_type, None)
+        self._num_extra += len(src)
+        num_csr_edges = sum(len(col) for _, col in self.csr.values())
+        if self._num_extra > max(100000, num_csr_edges // 20):
+            self.rebuild()
+
+    @staticmethod
+    def _build_csr(edge_index, num_dst):
+        src, dst = edge_index.cpu().numpy()
+        perm = np.argsort(dst, kind='stable')
+        rowptr = np.zeros(num_dst + 1, dtype=np.int64)
+        np.cumsum(np.bincount(dst, minlength=num_dst), out=rowptr[1:])
+        return rowptr, src[perm]
+
+    def _sample_neighbors(self, rowptr, col, dst_nodes, fanout):
+        start = rowptr[dst_nodes]
+        deg = rowptr[dst_nodes + 1] - start
+        take_all = deg <= fanout if fanout >= 0 else np.ones(len(dst_nodes), dtype=bool)
+
+        # Low-degree nodes keep every neighbor
+        f_start, f_deg = start[take_all], deg[take_all]
+        offsets = np.arange(f_deg.sum()) - np.repeat(np.cumsum(f_deg) - f_deg, f_deg)
+        src = [col[np.repeat(f_start, f_deg) + offsets]]
+        dst = [np.repeat(dst_nodes[take_all], f_deg)]
+
+        # High-degree nodes draw `fanout` neighbors (with replacement, deduplicated later)
+        many = ~take_all
+        if many.any():
+            draws = (self.rng.random((many.sum(), fanout)) * deg[many, None]).astype(np.int64)
+            src.append(col[(start[many, None] + draws).ravel()])
+            dst.append(np.repeat(dst_nodes[many], fanout))
+        return np.concatenate(src), np.concatenate(dst)
+
+    def _sample_relation(self, edge_type, dst_nodes, fanout):
+        rowptr, col = self.csr[edge_type]
+        # Nodes appended after the CSR build have no CSR row
+        src, dst = self._sample_neighbors(rowptr, col, dst_nodes[dst_nodes < len(rowptr) - 1], fanout)
+        extra = self._extra[edge_type]
+        if not extra:
+            return src, dst
+        keys = self._extra_keys.get(edge_type)
+        if keys is None:
+            keys = self._extra_keys[edge_type] = np.fromiter(extra.keys(), dtype=np.int64, count=len(extra))
+        srcs, dsts = [src], [dst]
+        for node in dst_nodes[np.isin(dst_nodes, keys)].tolist():
+            neighbors = np.asarray(extra[node], dtype=np.int64)
+            if 0 <= fanout < len(neighbors):
+                neighbors = self.rng.choice(neighbors, fanout)
+            srcs.append(neighbors)
+            dsts.append(np.full(len(neighbors), node, dtype=np.int64))
+        return np.concatenate(srcs), np.concatenate(dsts)
+
+    def neighbors(self, edge_type, dst_nodes):
+        """Every source node of edge_type pointing at any of dst_nodes, appended edges included."""
+        src, _ = self._sample_relation(edge_type, np.asarray(dst_nodes, dtype=np.int64), -1)
+        return np.unique(src)
+
+    def sample(self, seeds, num_neighbors=None):
+        """Sample around seeds {node_type: global indices}.
+
+        Returns global node ids per type (seeds first, in the given order) and
+        local [2, E] edge indices per relation.
+        """
+        fanouts = self.num_neighbors if num_neighbors is None else num_neighbors
+        node_types = self.data.node_types
+        empty = np.zeros(0, dtype=np.int64)
+        node_parts = {nt: [np.asarray(seeds.get(nt, empty), dtype=np.int64)] for nt in node_types}
+        visited = {nt: np.unique(node_parts[nt][0]) for nt in node_types}
+        frontier = {nt: visited[nt] for nt in node_types}
+        sampled = {edge_type: ([], []) for edge_type in self.csr}
+
+        for fanout in fanouts:
+            candidates = {nt: [] for nt in node_types}
+            for edge_type in self.csr:
+                dst_nodes = frontier[edge_type[2]]
+                if len(dst_nodes) == 0:
+                    continue
+                src, dst = self._sample_relation(edge_type, dst_nodes, fanout)
+                sampled[edge_type][0].append(src)
+                sampled[edge_type][1].append(dst)
+                candidates[edge_type[0]].append(src)
+            for nt in node_types:
+                if candidates[nt]:
+                    new = np.setdiff1d(np.concatenate(candidates[nt]), visited[nt])
+                    node_parts[nt].append(new)
+                    visited[nt] = np.union1d(visited[nt], new)
+                    frontier[nt] = new
+                else:
+                    frontier[nt] = empty
+
+        node_ids = {nt: np.concatenate(node_parts[nt]) for nt in node_types}
+        local = {nt: NodeIndex(ids) for nt, ids in node_ids.items()}
+        edge_index = {}
+        for edge_type, (src_parts, dst_parts) in sampled.items():
+            if not src_parts:
+                edge_index[edge_type] = np.zeros((2, 0), dtype=np.int64)
+                continue
+            src = local[edge_type[0]].lookup(np.concatenate(src_parts))
+            dst = local[edge_type[2]].lookup(np.concatenate(dst_parts))
+            # Drop duplicate draws from sampling with replacement
+            pairs = np.unique(np.stack([src, dst]), axis=1)
+            edge_index[edge_type] = pairs
+        return node_ids, edge_index
+
+    def subgraph(self, seeds, num_neighbors=None):
+        """Sampled HeteroData with features gathered and `n_id` holding global indices."""
+        node_ids, edge_index = self.sample(seeds, num_neighbors)
+        sub = HeteroData()
+        for node_type, ids in node_ids.items():
+            n_id = torch.from_numpy(ids)
+            sub[node_type].x = self.data[node_type].x[n_id]
+            sub[node_type].n_id = n_id
+            if 'y' in self.data[node_type]:
+                sub[node_type].y = self.data[node_type].y[n_id]
+        for edge_type, pairs in edge_index.items():
+            sub[edge_type].edge_index = torch.from_numpy(pairs)
+        # As in PyG loaders, the first batch_size nodes of a seed type are the seeds
+        for node_type, ids in seeds.items():
+            sub[node_type].batch_size = len(ids)
+        return sub
+
+    def _collate(self, seed_type, seeds):
+        return self.subgraph({seed_type: np.asarray(seeds, dtype=np.int64)})
+
+    def _reseed(self, worker_id):
+        # Forked workers would otherwise all inherit the same generator state
+        self.rng = np.random.default_rng(torch.initial_seed() % 2**32)
+
+    def loader(self, seed_type, seeds, batch_size, shuffle=False, num_workers=0):
+        """DataLoader yielding sampled subgraphs around batches of seed nodes."""
+        seeds = seeds.cpu().numpy() if torch.is_tensor(seeds) else np.asarray(seeds)
+        return torch.utils.data.DataLoader(
+            seeds, batch_size=batch_size, shuffle=shuffle, num_workers=num_workers,
+            collate_fn=partial(self._collate, seed_type),
+            worker_init_fn=self._reseed, persistent_workers=num_workers > 0)
+
 # ---------------------------
 # HGNN Model Definition - Compatible version
 # ---------------------------
@@ -193,66 +1394,550 @@ class FraudDetectionHGNN(torch.nn.Module):
             
         return out
 
+    def encode(self, x_dict):
+        """Layer-0 embeddings (the per-type input projections)."""
+        return {node_type: self.embeddings[node_type](x) for node_type, x in x_dict.items()}
+
+    def first_layer(self, h_dict, edge_index_dict):
+        """Layer-1 embeddings; node types that receive no messages are left out."""
+        if self.using_basic_layers:
+            return {ntype: F.leaky_relu(self.lin1[ntype](h)) for ntype, h in h_dict.items()}
+        h_dict = self.conv1(h_dict, edge_index_dict)
+        return {ntype: F.leaky_relu(h) for ntype, h in h_dict.items() if h is not None}
+
+    def score_orders_from_context(self, x_order, context_h0, context_h1, edge_index_dict):
+        """Order logits given precomputed layer-0/layer-1 embeddings of their neighbors.
+
+        edge_index_dict only needs the relations pointing into 'order', indexed
+        against the rows of context_h0/context_h1.
+        """
+        h0 = dict(context_h0)
+        h0['order'] = self.embeddings['order'](x_order)
+        if self.using_basic_layers:
+            h = F.leaky_relu(self.lin1['order'](h0['order']))
+            return self.output(F.leaky_relu(self.lin2['order'](h)))
+        h1 = dict(context_h1)
+        h1['order'] = F.leaky_relu(self.conv1(h0, edge_index_dict)['order'])
+        h2_order = F.leaky_relu(self.conv2(h1, edge_index_dict)['order'])
+        return self.output(h2_order)
+
+# ---------------------------
+# Checkpointing
+# ---------------------------
+def _cpu_snapshot(obj):
+    """Deep copy of a (nested) state dict with every tensor cloned to the CPU."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: _cpu_snapshot(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_cpu_snapshot(value) for value in obj)
+    return copy.deepcopy(obj)
+
+def _atomic_save(obj, path):
+    """torch.save to a temp file, fsync, then rename: readers see the old or the new file, never half."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def latest_checkpoint(checkpoint_dir):
+    """Path of the newest epoch checkpoint in checkpoint_dir, or None."""
+    if not os.path.isdir(checkpoint_dir):
+        return None
+    names = sorted(name for name in os.listdir(checkpoint_dir)
+                   if name.startswith('epoch_') and name.endswith('.pt'))
+    return os.path.join(checkpoint_dir, names[-1]) if names else None
+
+class AsyncCheckpointer:
+    """Writes training checkpoints from a background thread.
+
+    save() only snapshots the state to CPU memory; the writer thread saves it with
+    an atomic rename. At most one pending epoch checkpoint and one pending best
+    model are held: a newer snapshot replaces an unwritten older one. The last
+    `keep_last` epoch checkpoints are kept, plus best.pt (full state) and the bare
+    best weights at model_path that test() and FraudDetectionAPI load.
+    """
+
+    def __init__(self, checkpoint_dir, model_path, keep_last=3):
+        self.checkpoint_dir = checkpoint_dir
+        self.model_path = model_path
+        self.keep_last = keep_last
+        self._pending = {}
+        self._busy = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='checkpoint-writer', daemon=True)
+        self._thread.start()
+
+    def save(self, model, optimizer, epoch, extra=None, is_best=False):
+        self._raise_error()
+        state = _cpu_snapshot({'model': model.state_dict(), 'optimizer': optimizer.state_dict(),
+                               'epoch': epoch, **(extra or {})})
+        with self._cond:
+            self._pending['epoch'] = state
+            if is_best:
+                self._pending['best'] = state
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                pending, self._pending = self._pending, {}
+                self._busy = True
+            try:
+                if 'best' in pending:
+                    _atomic_save(pending['best'], os.path.join(self.checkpoint_dir, 'best.pt'))
+                    _atomic_save(pending['best']['model'], self.model_path)
+                if 'epoch' in pending:
+                    epoch = pending['epoch']['epoch']
+                    _atomic_save(pending['epoch'], os.path.join(self.checkpoint_dir, f'epoch_{epoch:05d}.pt'))
+                    self._prune()
+            except Exception as e:
+                self._error = e
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def _prune(self):
+        names = sorted(name for name in os.listdir(self.checkpoint_dir)
+                       if name.startswith('epoch_') and name.endswith('.pt'))
+        for name in names[:-self.keep_last] if self.keep_last > 0 else names:
+            os.remove(os.path.join(self.checkpoint_dir, name))
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Checkpoint write failed: {error}") from error
+
+    def flush(self):
+        """Block until every snapshot taken so far is on disk."""
+        with self._cond:
+            while self._pending or self._busy:
+                self._cond.wait()
+        self._raise_error()
+
+# ---------------------------
+# Training Profiler
+# ---------------------------
+def _proc_status_mb(field):
+    """A VmRSS/VmHWM-style field of /proc/self/status in MiB, or None off Linux."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 2**10
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def _reset_peak_rss():
+    """Reset the kernel's peak RSS (VmHWM) for this process; False where that is not possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+class TrainingProfiler:
+    """Per-epoch wall time by phase and by model layer, plus peak memory.
+
+    Phases (forward, backward, optimizer, validation, checkpoint) are timed around the
+    trainer's own calls; layers (embeddings, conv1, conv2, output) through forward hooks,
+    so they cover training and validation forwards. Each epoch is appended to log_path
+    as one JSON line; trace_path, if given, gets a Chrome trace-event file that
+    chrome://tracing and Perfetto open.
+
+    peak_rss_mb is the peak of the epoch itself: the kernel's high-water mark is reset at
+    the start of each epoch, or, where that isn't allowed, RSS is sampled at every phase
+    and layer boundary. It is None where /proc is unavailable.
+    """
+
+    PHASES = ('forward', 'backward', 'optimizer', 'validation', 'checkpoint')
+
+    def __init__(self, log_path=None, trace_path=None, device='cpu', max_trace_events=1000000):
+        self.log_path = log_path
+        self.trace_path = trace_path
+        # Kernels run asynchronously on CUDA, so spans only mean something after a sync
+        self._sync = torch.cuda.synchronize if str(device).startswith('cuda') else (lambda: None)
+        self._cuda = str(device).startswith('cuda')
+        self.max_trace_events = max_trace_events
+        self._events = []
+        self._origin = time.perf_counter()
+        self._handles = []
+        self._layer_starts = {}
+        self.records = []
+        self._reset()
+
+    def _reset(self):
+        self.phases = dict.fromkeys(self.PHASES, 0.0)
+        self.layers = {}
+        self.steps = 0
+        self._epoch_start = time.perf_counter()
+        self._kernel_peak = _reset_peak_rss()
+        self._sampled_peak = _proc_status_mb('VmRSS')
+        if self._cuda:
+            torch.cuda.reset_peak_memory_stats()
+
+    def _sample_rss(self):
+        if self._kernel_peak:
+            return
+        rss = _proc_status_mb('VmRSS')
+        if rss is not None:
+            self._sampled_peak = max(self._sampled_peak or 0.0, rss)
+
+    def _trace(self, name, category, start, end):
+        if self.trace_path and len(self._events) < self.max_trace_events:
+            self._events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                                 'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6})
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self._sync()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sync()
+            end = time.perf_counter()
+            self.phases[name] = self.phases.get(name, 0.0) + end - start
+            self._sample_rss()
+            if name == 'forward':
+                self.steps += 1
+            self._trace(name, 'phase', start, end)
+
+    @staticmethod
+    def model_layers(model):
+        """The model's top-level stages, each a list of modules."""
+        if getattr(model, 'using_basic_layers', False):
+            convs = {'conv1': list(model.lin1.values()), 'conv2': list(model.lin2.values())}
+        else:
+            convs = {'conv1': [model.conv1], 'conv2': [model.conv2]}
+        return {'embeddings': list(model.embeddings.values()), **convs, 'output': [model.output]}
+
+    def attach(self, model):
+        """Time every forward of the model's layers until detach()."""
+        for name, modules in self.model_layers(model).items():
+            for module in modules:
+                self._handles.append(module.register_forward_pre_hook(partial(self._layer_start, module)))
+                self._handles.append(module.register_forward_hook(partial(self._layer_end, name, module)))
+
+    def detach(self):
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+
+    def _layer_start(self, module, *_):
+        self._sync()
+        self._layer_starts[id(module)] = time.perf_counter()
+
+    def _layer_end(self, name, module, *_):
+        self._sync()
+        end = time.perf_counter()
+        start = self._layer_starts.pop(id(module), end)
+        self.layers[name] = self.layers.get(name, 0.0) + end - start
+        self._sample_rss()
+        self._trace(name, 'layer', start, end)
+
+    def end_epoch(self, epoch, **extra):
+        """Record the finished epoch, append it to the log and start timing the next one."""
+        wall = time.perf_counter() - self._epoch_start
+        record = {
+            'epoch': epoch,
+            'wall_seconds': wall,
+            'steps': self.steps,
+            'phases': dict(self.phases, other=max(wall - sum(self.phases.values()), 0.0)),
+            'layers': dict(self.layers),
+            'peak_rss_mb': _proc_status_mb('VmHWM') if self._kernel_peak else self._sampled_peak,
+            'peak_cuda_mb': torch.cuda.max_memory_allocated() / 2**20 if self._cuda else None,
+            **extra,
+        }
+        self.records.append(record)
+        if self.log_path:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        top = sorted(record['phases'].items(), key=lambda item: -item[1])[:3]
+        print(f"Epoch {epoch + 1} took {wall:.2f}s: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in top))
+        self._reset()
+        return record
+
+    def close(self):
+        self.detach()
+        if self.trace_path:
+            with open(self.trace_path, 'w') as f:
+                json.dump({'traceEvents': self._events, 'displayTimeUnit': 'ms'}, f)
+            print(f"Training trace written to {self.trace_path}")
+
 # ---------------------------
 # Training Pipeline
 # ---------------------------
 class FraudDetectionTrainer:
-    def __init__(self, model, data, device=None):
+    def __init__(self, model, data, device=None, model_path='best_fraud_model.pt',
+                 batch_size=None, num_neighbors=(10, 10), num_workers=0, checkpoint_dir=None,
+                 keep_checkpoints=3, rank=0, world_size=1, profile_log=None, profile_trace=None, sampler=None):
+        self.model_path = model_path
+        # Kept so train_data_parallel() can rebuild this trainer in each worker process
+        self._options = {'model_path': model_path, 'batch_size': batch_size, 'num_neighbors': num_neighbors,
+                         'num_workers': num_workers, 'checkpoint_dir': checkpoint_dir,
+                         'keep_checkpoints': keep_checkpoints, 'profile_log': profile_log,
+                         'profile_trace': profile_trace}
+        # Data-parallel workers train on every world_size-th training order; only rank 0 writes checkpoints
+        self.rank = rank
+        self.world_size = world_size
+        # Epoch checkpoints (weights, optimizer, epoch) for resuming go next to the model by default
+        self.checkpoint_dir = checkpoint_dir or os.path.splitext(model_path)[0] + '_checkpoints'
+        # Checkpointer and sampler are built on first use: a trainer that only hands off to
+        # train_data_parallel() never writes checkpoints itself, and its workers share one CSR
+        self._checkpointer = None
+        self._sampler = sampler
         if device is None:
             device = 'cuda' if torch.cuda.is_available() else 'cpu'
         self.device = device
         self.model = model.to(self.device)
-        self.data = data.to(self.device)
+
+        # batch_size=None keeps full-graph training; otherwise the graph stays on the CPU
+        # and each step trains on neighborhoods sampled around batch_size training orders.
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        if batch_size is None:
+            self.data = data.to(self.device)
+        else:
+            self.data = data
+            self._loaders = {}
 
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=0.001, weight_decay=5e-4)
 
+        # Optional per-epoch timing breakdown (rank 0 only in data-parallel runs)
+        self.profiler = None
+        if (profile_log or profile_trace) and rank == 0:
+            self.profiler = TrainingProfiler(profile_log, profile_trace, device=self.device)
+
         # Address class imbalance in fraud prediction
         order_labels = self.data['order'].y
         pos_weight = (order_labels == 0).sum() / max((order_labels == 1).sum(), 1)  # Prevent division by zero
-        self.criterion = torch.nn.BCEWithLogitsLoss(pos_weight=pos_weight)
+        self.criterion = torch.nn.BCEWithLogitsLoss(pos_weight=pos_weight.to(self.device))
 
-    def train(self, epochs=100, patience=10):
-        best_val_loss = float('inf')
-        counter = 0
+    @property
+    def checkpointer(self):
+        if self._checkpointer is None and self.rank == 0:
+            self._checkpointer = AsyncCheckpointer(self.checkpoint_dir, self.model_path,
+                                                   keep_last=self._options['keep_checkpoints'])
+        return self._checkpointer
 
-        for epoch in range(epochs):
-            self.model.train()
+    @property
+    def sampler(self):
+        if self._sampler is None:
+            self._sampler = HeteroNeighborSampler(self.data, self._options['num_neighbors'])
+        return self._sampler
+
+    def _loader(self, mask_name, shuffle):
+        if mask_name not in self._loaders:
+            seeds = self._shard(self.data['order'][mask_name].nonzero().view(-1), pad=mask_name == 'train_mask')
+            self._loaders[mask_name] = self.sampler.loader('order', seeds, self.batch_size,
+                                                           shuffle=shuffle, num_workers=self.num_workers)
+        return self._loaders[mask_name]
+
+    def _shard(self, seeds, pad):
+        """This worker's share of the seed orders.
+
+        Training shards are padded with repeated orders to equal length, so every worker
+        runs the same number of steps and gradient all-reduces always pair up.
+        """
+        if self.world_size == 1:
+            return seeds
+        # Same permutation in every worker, so shards are disjoint and mix the whole mask
+        seeds = seeds[torch.randperm(len(seeds), generator=torch.Generator().manual_seed(0))]
+        if pad and len(seeds) % self.world_size:
+            extra = self.world_size - len(seeds) % self.world_size
+            seeds = torch.cat([seeds, seeds[:extra]])
+        return seeds[self.rank::self.world_size]
+
+    def _all_reduce_gradients(self):
+        """Average gradients across workers in one flat all-reduce."""
+        params = [p for p in self.model.parameters() if p.requires_grad]
+        flat = torch.cat([(p.grad if p.grad is not None else torch.zeros_like(p)).reshape(-1) for p in params])
+        dist.all_reduce(flat)
+        flat /= self.world_size
+        offset = 0
+        for p in params:
+            p.grad = flat[offset:offset + p.numel()].view_as(p).clone()
+            offset += p.numel()
+
+    def _all_reduce_mean(self, total, count):
+        """Sample-weighted mean of a per-worker sum over all workers."""
+        if self.world_size > 1:
+            stats = torch.tensor([total, count], dtype=torch.float64)
+            dist.all_reduce(stats)
+            total, count = stats.tolist()
+        return total / max(count, 1)
+
+    def _phase(self, name):
+        return self.profiler.phase(name) if self.profiler is not None else contextlib.nullcontext()
+
+    def _forward(self, data):
+        return self.model(
+            {node_type: data[node_type].x for node_type in data.node_types},
+            {edge_type: data[edge_type].edge_index for edge_type in data.edge_types}
+        )
+
+    def _train_step(self):
+        """One optimisation pass over the training orders; returns the mean training loss."""
+        self.model.train()
+        if self.batch_size is None:
             self.optimizer.zero_grad()
-            out = self.model(
-                {node_type: self.data[node_type].x for node_type in self.data.node_types},
-                {edge_type: self.data[edge_type].edge_index for edge_type in self.data.edge_types}
-            )
-            train_mask = self.data['order'].train_mask
-            loss = self.criterion(out[train_mask].squeeze(), self.data['order'].y[train_mask].float())
-            loss.backward()
-            self.optimizer.step()
-
-            # Evaluate on validation data
-            val_loss = self.evaluate(mode='val')
-            print(f'Epoch: {epoch+1}, Train Loss: {loss.item():.4f}, Val Loss: {val_loss:.4f}')
-
-            if val_loss < best_val_loss:
-                best_val_loss = val_loss
-                counter = 0
-                torch.save(self.model.state_dict(), 'best_fraud_model.pt')
-            else:
-                counter += 1
+            with self._phase('forward'):
+                out = self._forward(self.data)
+                train_mask = self.data['order'].train_mask
+                loss = self.criterion(out[train_mask].view(-1), self.data['order'].y[train_mask].float())
+            with self._phase('backward'):
+                loss.backward()
+            with self._phase('optimizer'):
+                self.optimizer.step()
+            return loss.item()
+
+        total_loss, total = 0.0, 0
+        for batch in self._loader('train_mask', shuffle=True):
+            batch = batch.to(self.device)
+            num_seeds = batch['order'].batch_size
+            self.optimizer.zero_grad()
+            with self._phase('forward'):
+                out = self._forward(batch)
+                loss = self.criterion(out[:num_seeds].view(-1), batch['order'].y[:num_seeds].float())
+            with self._phase('backward'):
+                loss.backward()
+                if self.world_size > 1:
+                    self._all_reduce_gradients()
+            with self._phase('optimizer'):
+                self.optimizer.step()
+            total_loss += loss.item() * num_seeds
+            total += num_seeds
+        return self._all_reduce_mean(total_loss, total)
+
+    def _predict_mask(self, mask_name):
+        """Logits and labels for the orders in a mask, full-graph or batch by batch."""
+        if self.batch_size is None:
+            out = self._forward(self.data)
+            mask = self.data['order'][mask_name]
+            return out[mask].view(-1), self.data['order'].y[mask]
+
+        logits, labels = [], []
+        for batch in self._loader(mask_name, shuffle=False):
+            batch = batch.to(self.device)
+            num_seeds = batch['order'].batch_size
+            logits.append(self._forward(batch)[:num_seeds].view(-1))
+            labels.append(batch['order'].y[:num_seeds])
+        return torch.cat(logits), torch.cat(labels)
+
+    def resume(self, checkpoint_path):
+        """Restore weights, optimizer and early-stopping state; returns the next epoch to run."""
+        if checkpoint_path == 'latest':
+            checkpoint_path = latest_checkpoint(self.checkpoint_dir)
+            if checkpoint_path is None:
+                print(f"No checkpoint in {self.checkpoint_dir}; training from scratch.")
+                return 0, float('inf'), 0
+        checkpoint = torch.load(checkpoint_path, map_location=self.device)
+        self.model.load_state_dict(checkpoint['model'])
+        self.optimizer.load_state_dict(checkpoint['optimizer'])
+        print(f"Resumed from {checkpoint_path} (epoch {checkpoint['epoch'] + 1})")
+        return checkpoint['epoch'] + 1, checkpoint.get('best_val_loss', float('inf')), checkpoint.get('counter', 0)
+
+    def train(self, epochs=100, patience=10, resume_from=None):
+        """Train with early stopping; resume_from is a checkpoint path or 'latest'."""
+        start_epoch, best_val_loss, counter = 0, float('inf'), 0
+        if resume_from is not None:
+            start_epoch, best_val_loss, counter = self.resume(resume_from)
+
+        if self.profiler is not None:
+            self.profiler.attach(self.model)
+        try:
+            for epoch in range(start_epoch, epochs):
+                train_loss = self._train_step()
+
+                # Evaluate on validation data
+                with self._phase('validation'):
+                    val_loss = self.evaluate(mode='val')
+                if self.rank == 0:
+                    print(f'Epoch: {epoch+1}, Train Loss: {train_loss:.4f}, Val Loss: {val_loss:.4f}')
+
+                is_best = val_loss < best_val_loss
+                if is_best:
+                    best_val_loss = val_loss
+                    counter = 0
+                else:
+                    counter += 1
+                # Only the in-memory snapshot happens here; the write is on the checkpoint thread
+                if self.checkpointer is not None:
+                    with self._phase('checkpoint'):
+                        self.checkpointer.save(self.model, self.optimizer, epoch, is_best=is_best,
+                                               extra={'best_val_loss': best_val_loss, 'counter': counter})
+                if self.profiler is not None:
+                    self.profiler.end_epoch(epoch, train_loss=train_loss, val_loss=val_loss)
                 if counter >= patience:
-                    print(f'Early stopping at epoch {epoch+1}')
+                    if self.rank == 0:
+                        print(f'Early stopping at epoch {epoch+1}')
                     break
+            if self.checkpointer is not None:
+                with self._phase('checkpoint'):
+                    self.checkpointer.flush()
+        finally:
+            if self.profiler is not None:
+                self.profiler.close()
+
+    def train_data_parallel(self, num_processes, epochs=100, patience=10, resume_from=None):
+        """Train in num_processes local CPU workers with gradient all-reduce over gloo.
+
+        Needs mini-batch mode: each worker samples neighborhoods around its shard of the
+        training orders, validation loss is averaged over all workers for early stopping,
+        and rank 0 writes the checkpoints and model_path as train() does. The best weights
+        are loaded back into this trainer's model afterwards.
+        """
+        if self.batch_size is None:
+            raise ValueError("Data-parallel training needs mini-batch mode (batch_size)")
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        torch_threads = max(1, (os.cpu_count() or 1) // num_processes)
+        # Forked workers share the graph with this process copy-on-write instead of pickling it
+        ctx = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+        model = copy.deepcopy(self.model).to('cpu')
+        # One CSR for all workers (and this trainer's later test()), built here and moved to shared memory
+        csr = self.sampler.share_memory()
+        workers = [ctx.Process(target=_data_parallel_worker, name=f'train-rank-{rank}',
+                               args=(rank, num_processes, port, torch_threads, model, self.data, csr, self._options,
+                                     {'epochs': epochs, 'patience': patience, 'resume_from': resume_from}))
+                   for rank in range(num_processes)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+                if worker.exitcode != 0:
+                    raise RuntimeError(f"Training worker {worker.name} exited with code {worker.exitcode}")
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+        self.model.load_state_dict(torch.load(self.model_path, map_location=self.device))
 
     def evaluate(self, mode='val'):
         self.model.eval()
         with torch.no_grad():
-            out = self.model(
-                {node_type: self.data[node_type].x for node_type in self.data.node_types},
-                {edge_type: self.data[edge_type].edge_index for edge_type in self.data.edge_types}
-            )
-            mask = self.data['order'].val_mask if mode == 'val' else self.data['order'].test_mask
-            loss = self.criterion(out[mask].squeeze(), self.data['order'].y[mask].float())
+            logits, targets = self._predict_mask('val_mask' if mode == 'val' else 'test_mask')
+            loss = self.criterion(logits, targets.float())
+            if mode == 'val' and self.world_size > 1:
+                # Every worker scored its own shard; all of them need the same loss to stop together
+                return self._all_reduce_mean(loss.item() * len(targets), len(targets))
             if mode == 'test':
-                preds = torch.sigmoid(out[mask].squeeze()).cpu().numpy()
-                labels = self.data['order'].y[mask].cpu().numpy()
+                preds = torch.sigmoid(logits).cpu().numpy()
+                labels = targets.cpu().numpy()
                 
                 # Handle edge cases in evaluation
                 if len(np.unique(labels)) < 2:
@@ -279,115 +1964,1409 @@ class FraudDetectionTrainer:
             return loss.item()
 
     def test(self):
+        if self._checkpointer is not None:
+            self._checkpointer.flush()
         # Check if model file exists, otherwise skip loading
-        if os.path.exists('best_fraud_model.pt'):
-            self.model.load_state_dict(torch.load('best_fraud_model.pt', map_location=self.device))
+        if os.path.exists(self.model_path):
+            self.model.load_state_dict(torch.load(self.model_path, map_location=self.device))
         else:
             print("Warning: No saved model found. Using current model state.")
         return self.evaluate(mode='test')
 
+def _data_parallel_worker(rank, world_size, port, torch_threads, model, data, csr, options, train_kwargs):
+    torch.set_num_threads(torch_threads)
+    dist.init_process_group('gloo', init_method=f'tcp://127.0.0.1:{port}', rank=rank, world_size=world_size)
+    try:
+        # A private copy: a forked or shared-memory parent model must not be updated in place
+        model = copy.deepcopy(model).to('cpu')
+        for param in model.state_dict().values():
+            dist.broadcast(param, src=0)
+        # A sampler over the parent's shared CSR, with this worker's own random generator
+        sampler = HeteroNeighborSampler(data, options['num_neighbors'], csr=csr)
+        trainer = FraudDetectionTrainer(model, data, device='cpu', rank=rank, world_size=world_size,
+                                        sampler=sampler, **options)
+        trainer.train(**train_kwargs)
+    finally:
+        dist.destroy_process_group()
+
 # ---------------------------
-# Inference API
+# Model Manifest
 # ---------------------------
-class FraudDetectionAPI:
-    def __init__(self, model_path, data_processor, hidden_channels=64, threshold=0.5):
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.data_processor = data_processor
-        self.threshold = threshold
+def model_manifest_path(model_path):
+    """The manifest lives next to the weights: best_fraud_model.pt -> best_fraud_model.json."""
+    return os.path.splitext(model_path)[0] + '.json'
 
-        # Build a sample graph to extract metadata
-        try:
-            sample_data = self.data_processor.create_heterograph()
-            metadata = (
-                {node_type: sample_data[node_type].x.size(1) for node_type in sample_data.node_types},
-                sample_data.edge_types
-            )
-            
-            # Initialize model
-            self.model = FraudDetectionHGNN(hidden_channels=hidden_channels, out_channels=1, metadata=metadata).to(self.device)
-            
-            # Load model if the file exists
-            if os.path.exists(model_path):
-                self.model.load_state_dict(torch.load(model_path, map_location=self.device))
-                print(f"Model loaded from {model_path}")
-            else:
-                print(f"Warning: Model file {model_path} not found. Using untrained model.")
-                
-            self.model.eval()
-        except Exception as e:
-            print(f"Error initializing fraud detection API: {e}")
-            raise
+def save_model_manifest(model_path, metadata, hidden_channels, out_channels=1, feature_vocab=None,
+                        feature_columns=None, extra=None):
+    """Write everything needed to rebuild the model for serving without the raw data."""
+    manifest = {
+        'model_path': os.path.basename(model_path),
+        'hidden_channels': hidden_channels,
+        'out_channels': out_channels,
+        'node_feature_dims': dict(metadata[0]),
+        'edge_types': [list(edge_type) for edge_type in metadata[1]],
+        'feature_vocab': feature_vocab or {},
+        'feature_columns': feature_columns or {},
+    }
+    manifest.update(extra or {})
+    path = model_manifest_path(model_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
 
-    def process_new_order(self, order_data):
-        """Convert new order data into a mini-graph, perform inference, and return fraud probability."""
-        try:
-            graph_data = self._convert_order_to_graph(order_data)
-            with torch.no_grad():
-                out = self.model(
-                    {node_type: graph_data[node_type].x.to(self.device) for node_type in graph_data.node_types},
-                    {edge_type: graph_data[edge_type].edge_index.to(self.device) for edge_type in graph_data.edge_types}
-                )
-                fraud_prob = torch.sigmoid(out[0]).item()
-                is_fraud = fraud_prob >= self.threshold
-                
-            return {
-                'fraud_probability': float(fraud_prob),  # Ensure it's a Python float
-                'is_fraud': bool(is_fraud),
-                'order_id': order_data['order_id']
-            }
-        except Exception as e:
-            print(f"Error processing order: {e}")
-            return {
-                'error': str(e),
-                'fraud_probability': None,
-                'is_fraud': None,
-                'order_id': order_data.get('order_id', 'unknown')
-            }
+def manifest_attribute_types(manifest):
+    """Shared-attribute node types the saved model was trained with."""
+    return [node_type for node_type in manifest['metadata'][0] if node_type not in ('user', 'order', 'payment')]
 
-    def _convert_order_to_graph(self, order_data):
-        data = HeteroData()
-        
-        # Update user node: remove 'user_avg_order_value' to match training features.
-        data['user'].x = torch.tensor([[
-            float(order_data.get('user_age', 0)),
-            float(order_data.get('account_age_days', 0)),
-            float(order_data.get('user_total_orders', 0))
-        ]], dtype=torch.float)
-        
-        # Order node features remain the same.
-        data['order'].x = torch.tensor([[
-            float(order_data.get('order_amount', 0)),
-            float(order_data.get('num_items', 0)),
-            float(order_data.get('time_of_day', 0)),
-            float(order_data.get('day_of_week', 0))
-        ]], dtype=torch.float)
-        
-        # Payment node features (one-hot encoding)
-        payment_dim = 4  # Adjust based on your payment types.
-        payment_feature = torch.zeros((1, payment_dim))
-        payment_idx = int(order_data.get('payment_type_idx', 0))
-        if 0 <= payment_idx < payment_dim:
-            payment_feature[0, payment_idx] = 1
-        data['payment'].x = payment_feature
-        
-        # Set simple edge indices for the mini-graph.
-        data[('user', 'places', 'order')].edge_index = torch.tensor([[0], [0]])
-        data[('order', 'placed_by', 'user')].edge_index = torch.tensor([[0], [0]])
-        data[('order', 'uses', 'payment')].edge_index = torch.tensor([[0], [0]])
-        data[('payment', 'used_by', 'order')].edge_index = torch.tensor([[0], [0]])
+def load_model_manifest(model_path):
+    """Return the manifest for model_path with metadata restored, or None if absent."""
+    path = model_manifest_path(model_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest['metadata'] = (
+        manifest['node_feature_dims'],
+        [tuple(edge_type) for edge_type in manifest['edge_types']]
+    )
+    return manifest
+
+# ---------------------------
+# Inference Artifact Export
+# ---------------------------
+class _PositionalForward(torch.nn.Module):
+    """Tensor-only forward (node features, then edge indices, in metadata order) for tracing."""
+
+    def __init__(self, model, node_types, edge_types):
+        super().__init__()
+        self.model = model
+        self.node_types = list(node_types)
+        self.edge_types = [tuple(edge_type) for edge_type in edge_types]
+
+    def forward(self, *tensors):
+        num_node_types = len(self.node_types)
+        x_dict = dict(zip(self.node_types, tensors[:num_node_types]))
+        edge_index_dict = dict(zip(self.edge_types, tensors[num_node_types:]))
+        return self.model(x_dict, edge_index_dict)
+
+class InferenceArtifact(torch.nn.Module):
+    """An exported model behind the usual forward(x_dict, edge_index_dict) signature."""
+
+    def __init__(self, module, node_feature_dims, edge_types):
+        super().__init__()
+        self.module = module
+        self.node_feature_dims = dict(node_feature_dims)
+        self.edge_types = [tuple(edge_type) for edge_type in edge_types]
+
+    def forward(self, x_dict, edge_index_dict):
+        # Relations or node types missing from a request graph are passed as empty tensors
+        inputs = [x_dict[node_type] if node_type in x_dict else torch.zeros(0, dim)
+                  for node_type, dim in self.node_feature_dims.items()]
+        inputs += [edge_index_dict[edge_type] if edge_type in edge_index_dict
+                   else torch.zeros(2, 0, dtype=torch.long) for edge_type in self.edge_types]
+        return self.module(*inputs)
+
+def _to_torch_linear(lin):
+    """Copy a PyG Linear into torch.nn.Linear, which dynamic quantization understands."""
+    weight = lin.weight.detach()
+    torch_lin = torch.nn.Linear(weight.size(1), weight.size(0), bias=lin.bias is not None)
+    torch_lin.weight.data.copy_(weight)
+    if lin.bias is not None:
+        torch_lin.bias.data.copy_(lin.bias.detach())
+    return torch_lin
+
+def _positional_inputs(graph, node_types, edge_types):
+    return tuple([graph[node_type].x for node_type in node_types] +
+                 [graph[tuple(edge_type)].edge_index for edge_type in edge_types])
+
+def export_inference_artifact(model, metadata, example_graphs, artifact_path, quantize=True,
+                              hidden_channels=64, feature_vocab=None, feature_columns=None):
+    """Export a frozen CPU inference artifact of model and write its manifest.
+
+    With quantize, the embedding and output Linear layers are converted to dynamic
+    int8. The model is then traced on example_graphs[0] and frozen. The trace is kept
+    only if it matches eager outputs on every other example graph. Graphs of another
+    size are the usual failure mode for traced message passing. Otherwise the
+    quantized eager module is saved instead, and 'artifact_format' records which.
+    """
+    sizes = [graph['order'].num_nodes for graph in example_graphs]
+    if len(sizes) < 2 or min(sizes) == 0 or len(set(sizes)) < 2:
+        raise ValueError(f"Need non-empty example graphs of at least two sizes to check the trace, got {sizes}")
+    node_types = list(metadata[0].keys())
+    edge_types = [tuple(edge_type) for edge_type in metadata[1]]
+    module = copy.deepcopy(model).cpu().eval()
+    if quantize:
+        for node_type in list(module.embeddings.keys()):
+            module.embeddings[node_type] = _to_torch_linear(module.embeddings[node_type])
+        module.output = _to_torch_linear(module.output)
+        module = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+    wrapper = _PositionalForward(module, node_types, edge_types).eval()
+
+    artifact_format = 'torchscript'
+    try:
+        with torch.no_grad():
+            traced = torch.jit.trace(wrapper, _positional_inputs(example_graphs[0], node_types, edge_types),
+                                     check_trace=False, strict=False)
+            traced = torch.jit.freeze(traced.eval())
+            for graph in example_graphs[1:]:
+                inputs = _positional_inputs(graph, node_types, edge_types)
+                if not torch.allclose(traced(*inputs), wrapper(*inputs), atol=1e-4):
+                    raise RuntimeError("traced outputs differ from eager on a differently sized graph")
+        torch.jit.save(traced, artifact_path + '.tmp')
+    except Exception as e:
+        print(f"Warning: TorchScript export failed ({e}); saving the eager module instead.")
+        artifact_format = 'eager'
+        torch.save(wrapper, artifact_path + '.tmp')
+    os.replace(artifact_path + '.tmp', artifact_path)
+
+    save_model_manifest(artifact_path, metadata, hidden_channels, feature_vocab=feature_vocab,
+                        feature_columns=feature_columns,
+                        extra={'artifact_format': artifact_format, 'quantized': bool(quantize)})
+    print(f"Exported {artifact_format} artifact ({'int8' if quantize else 'fp32'} linears) to {artifact_path}")
+    return artifact_format
+
+def load_inference_artifact(artifact_path, manifest):
+    """Load an exported artifact as an InferenceArtifact module."""
+    if manifest['artifact_format'] == 'torchscript':
+        module = torch.jit.load(artifact_path, map_location='cpu')
+    else:
+        module = torch.load(artifact_path, map_location='cpu', weights_only=False)
+    return InferenceArtifact(module, manifest['node_feature_dims'], manifest['metadata'][1]).eval()
+
+def check_artifact_parity(model, artifact, data, mask_name='test_mask'):
+    """AUC/AP of the eager model and the artifact on the same orders, plus their deltas."""
+    mask = data['order'][mask_name]
+    labels = data['order'].y[mask].numpy()
+    x_dict = {node_type: data[node_type].x for node_type in data.node_types}
+    edge_index_dict = {edge_type: data[edge_type].edge_index for edge_type in data.edge_types}
+    report = {}
+    # A CPU copy: the caller's model keeps its device and train/eval mode
+    model = copy.deepcopy(model).cpu().eval()
+    with torch.no_grad():
+        for name, module in (('eager', model), ('artifact', artifact)):
+            preds = torch.sigmoid(module(x_dict, edge_index_dict)[mask].view(-1)).numpy()
+            if len(np.unique(labels)) < 2:
+                report[name] = {'auc': float('nan'), 'ap': float('nan')}
+            else:
+                report[name] = {'auc': float(roc_auc_score(labels, preds)),
+                                'ap': float(average_precision_score(labels, preds))}
+    report['auc_delta'] = report['artifact']['auc'] - report['eager']['auc']
+    report['ap_delta'] = report['artifact']['ap'] - report['eager']['ap']
+    print(f"Eager AUC {report['eager']['auc']:.4f} / AP {report['eager']['ap']:.4f}; "
+          f"artifact AUC {report['artifact']['auc']:.4f} / AP {report['artifact']['ap']:.4f} "
+          f"(delta AUC {report['auc_delta']:+.4f}, AP {report['ap_delta']:+.4f})")
+    return report
+
+# ---------------------------
+# Node Embedding Cache
+# ---------------------------
+class NodeEmbeddingCache:
+    """Size-bounded LRU of (layer-0, layer-1) embeddings keyed by (node_type, node index)."""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.nbytes = 0
+
+    @staticmethod
+    def _size(entry):
+        return sum(t.element_size() * t.nelement() for t in entry)
+
+    def get_many(self, node_type, indices):
+        """Cached entries for indices, with None for misses."""
+        found = []
+        with self._lock:
+            for index in indices:
+                entry = self._entries.get((node_type, int(index)))
+                if entry is None:
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end((node_type, int(index)))
+                    self.hits += 1
+                found.append(entry)
+        return found
+
+    def put_many(self, node_type, indices, h0, h1):
+        with self._lock:
+            for row, index in enumerate(indices):
+                key = (node_type, int(index))
+                # Clone the rows so the cache never pins whole batch tensors
+                entry = (h0[row].detach().clone(), h1[row].detach().clone())
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self.nbytes -= self._size(old)
+                self._entries[key] = entry
+                self.nbytes += self._size(entry)
+            while len(self._entries) > self.max_entries:
+                _, old = self._entries.popitem(last=False)
+                self.nbytes -= self._size(old)
+                self.evictions += 1
+
+    def invalidate(self, node_type, indices):
+        """Drop entries whose features or edges changed."""
+        with self._lock:
+            for index in indices:
+                old = self._entries.pop((node_type, int(index)), None)
+                if old is not None:
+                    self.nbytes -= self._size(old)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'bytes': self.nbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+# ---------------------------
+# Prediction Result Cache
+# ---------------------------
+class PredictionCache:
+    """TTL + LRU cache of scoring results keyed by (order_id, hash of the request payload).
+
+    Entries are tagged with the model version that produced them and only served while
+    that version is live, so a model swap never returns the old model's decisions.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=30.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(order_data):
+        payload = json.dumps(order_data, sort_keys=True, separators=(',', ':'), default=str)
+        return str(order_data.get('order_id')), hashlib.sha1(payload.encode()).hexdigest()
+
+    def get(self, key, version):
+        """A copy of the cached result, or None if absent, expired or from another model."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] != version or entry[1] <= now):
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[2])
+
+    def put(self, key, version, result):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (version, time.monotonic() + self.ttl_seconds, dict(result))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+# ---------------------------
+# Metrics
+# ---------------------------
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.type = 'counter'
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+class Gauge(Counter):
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.type = 'gauge'
+        self._function = None
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """Compute the value at scrape time; function returns a number or {label tuple: number}."""
+        self._function = function
+
+    def samples(self):
+        if self._function is None:
+            return super().samples()
+        value = self._function()
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [(self.name, key, (), v) for key, v in value.items()]
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.type = 'histogram'
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if position < len(self.buckets):
+                state[position] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, **labels):
+        """Context manager observing the elapsed wall time of its block."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                samples.append((self.name + '_bucket', key, (('le', repr(float(bound))),), cumulative))
+            samples.append((self.name + '_bucket', key, (('le', '+Inf'),), state[-1]))
+            samples.append((self.name + '_sum', key, (), state[-2]))
+            samples.append((self.name + '_count', key, (), state[-1]))
+        return samples
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+class MetricsRegistry:
+    """Minimal in-process metrics exposed in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = OrderedDict()
+
+    def _register(self, metric):
+        # Re-registering returns the existing metric so components can share a registry
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        """Current samples of every metric in a JSON-serialisable form."""
+        return {metric.name: [[name, list(key), [list(pair) for pair in extra], value]
+                              for name, key, extra, value in metric.samples()]
+                for metric in self._metrics.values()}
+
+    def merge(self, snapshots):
+        """Combine (worker, live, snapshot) triples from several processes into one sample set.
+
+        Counters and histograms add up across workers, including workers that have exited so
+        totals never go backwards; gauges are per process, so live workers' values get a
+        `worker` label and exited workers' gauges are dropped.
+        """
+        merged = {}
+        for worker, live, snapshot in snapshots:
+            for metric_name, samples in snapshot.items():
+                metric = self._metrics.get(metric_name)
+                if metric is None:
+                    continue
+                totals = merged.setdefault(metric_name, OrderedDict())
+                for name, key, extra, value in samples:
+                    key, extra = tuple(key), tuple(tuple(pair) for pair in extra)
+                    if metric.type == 'gauge':
+                        if live:
+                            totals[name, key, extra + (('worker', str(worker)),)] = value
+                    else:
+                        totals[name, key, extra] = totals.get((name, key, extra), 0) + value
+        return {metric_name: [(name, key, extra, value) for (name, key, extra), value in totals.items()]
+                for metric_name, totals in merged.items()}
+
+    def render(self, samples=None):
+        """Prometheus text for this process, or for `samples` as returned by merge()."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, key, extra, value in (metric.samples() if samples is None else samples.get(metric.name, ())):
+                lines.append(f'{name}{_format_labels(metric.labelnames, key, extra)} {float(value)!r}')
+        return '\n'.join(lines) + '\n'
+
+def write_metrics_snapshot(registry, directory):
+    """Publish this process's metrics as <directory>/<pid>.json for a sibling to merge."""
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp_path, path)
+
+def read_metrics_snapshots(directory):
+    """(worker, live, snapshot) for every file written by write_metrics_snapshot."""
+    snapshots = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        # serve_prefork renames an exited worker's file to <pid>.exited-<ns>.json
+        worker, _, state = filename[:-len('.json')].partition('.')
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshots.append((worker, not state, json.load(f)))
+        except (OSError, ValueError):
+            continue  # renamed or removed between listdir and open
+    return snapshots
+
+# ---------------------------
+# Inference API
+# ---------------------------
+class ServingModel:
+    """A loaded model plus the state that is only valid for it; swapped as one unit."""
+
+    def __init__(self, model, model_format, device, embedding_cache, source, version):
+        self.model = model
+        self.model_format = model_format
+        self.device = device
+        self.embedding_cache = embedding_cache
+        self.source = source
+        self.version = version
+        self.loaded_at = time.time()
+
+    def describe(self):
+        return {'version': self.version, 'source': self.source, 'format': self.model_format,
+                'device': str(self.device), 'loaded_at': self.loaded_at}
+
+class FraudDetectionAPI:
+    def __init__(self, model_path, data_processor=None, hidden_channels=64, threshold=0.5,
+                 inference_mode='minigraph', neighborhood_fanout=(20,), latency_budget_ms=None,
+                 embedding_cache_size=0, append_scored_orders=False, metrics=None, velocity_max_keys=100000,
+                 result_cache_size=0, result_cache_ttl=30.0, live_velocity=True):
+        self.model_path = model_path
+        self.embedding_cache_size = embedding_cache_size
+        # Feature builders only need the vocabulary/columns, so a bare processor is enough for serving
+        self.data_processor = data_processor if data_processor is not None else DataProcessor(None, None, None)
+        self.threshold = threshold
+        if inference_mode not in ('minigraph', 'neighborhood'):
+            raise ValueError(f"Unknown inference_mode: {inference_mode}")
+        self.inference_mode = inference_mode
+
+        # In neighborhood mode, neighborhood_fanout is the per-hop fanout sampled around the
+        # order's existing user/payment nodes; with a latency budget it is scaled down when
+        # the observed p99 exceeds the budget and back up when there is headroom.
+        self.neighborhood_fanout = list(neighborhood_fanout)
+        self._current_fanout = list(neighborhood_fanout)
+        self.latency_budget_ms = latency_budget_ms
+        self._latencies = deque(maxlen=1000)
+        self._num_scored = 0
+        self._lock = threading.Lock()
+        self.graph = None
+
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self._stage_seconds = self.metrics.histogram(
+            'fraud_stage_seconds', 'Wall time per scoring stage', ('stage',))
+        self._batch_sizes = self.metrics.histogram(
+            'fraud_batch_size', 'Orders per model forward pass', (),
+            buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096))
+        self._errors = self.metrics.counter('fraud_errors_total', 'Scoring errors by stage', ('stage',))
+        self._orders_scored = self.metrics.counter('fraud_orders_scored_total', 'Orders scored by decision',
+                                                   ('decision',))
+        self._reloads = self.metrics.counter('fraud_model_reloads_total', 'Model reloads by outcome', ('status',))
+        self._shadow_deltas = self.metrics.histogram(
+            'fraud_shadow_score_delta', 'Absolute shadow minus primary fraud probability', (),
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.2, 0.5, 1.0))
+        self._shadow_events = self.metrics.counter('fraud_shadow_orders_total', 'Shadow-scored orders by outcome',
+                                                   ('outcome',))
+
+        # Hot reload and shadow scoring; their threads start lazily in the serving process
+        self.serving = None
+        self.shadow = None
+        self.shadow_rate = 0.0
+        self._shadow_queue = None
+        self._watch_interval = None
+        self._background_pid = None
+        self._shadow_pid = None
+        self._background_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._model_versions = 0
+        self.last_reload_error = None
+        # A few recent (already annotated) orders serve as sanity inputs for a reloaded model
+        self._recent_orders = deque(maxlen=32)
+        # Grow the resident graph with every scored order (neighborhood mode only)
+        self.append_scored_orders = append_scored_orders and inference_mode == 'neighborhood'
+        # Retried submissions of an unchanged order are answered without rescoring
+        self.result_cache = PredictionCache(result_cache_size, result_cache_ttl) if result_cache_size else None
+
+        try:
+            manifest = load_model_manifest(model_path)
+            if manifest is not None:
+                # Saved manifest: no need to touch the raw data at all
+                metadata = manifest['metadata']
+                hidden_channels = manifest['hidden_channels']
+                self.data_processor.feature_vocab = manifest['feature_vocab']
+                self.data_processor.feature_columns = manifest.get('feature_columns', {})
+                print(f"Model manifest loaded from {model_manifest_path(model_path)}")
+            else:
+                if data_processor is None:
+                    raise ValueError(f"No manifest for {model_path}; a DataProcessor is required")
+                # Build a sample graph to extract metadata
+                self.graph = self.data_processor.create_heterograph()
+                metadata = (
+                    {node_type: self.graph[node_type].x.size(1) for node_type in self.graph.node_types},
+                    self.graph.edge_types
+                )
+            self.metadata = metadata
+            self.serving = self._load_serving_model(model_path, manifest, hidden_channels)
+
+            if self.inference_mode == 'neighborhood':
+                self._load_resident_graph()
+
+            # Velocity features are live state, seeded from orders.csv and updated by every scored order.
+            # With live_velocity=False orders must carry their own velocity columns (offline backfills).
+            self.velocity = None
+            if live_velocity and set(DataProcessor.velocity_columns()) <= set(
+                    self.data_processor.feature_columns.get('order', [])):
+                self.velocity = self.data_processor.new_velocity_store(velocity_max_keys)
+                self.data_processor.seed_velocity(self.velocity)
+
+            self._register_gauges()
+        except Exception as e:
+            print(f"Error initializing fraud detection API: {e}")
+            raise
+
+    # The live model's attributes, for callers that don't care about hot reloads
+    model = property(lambda self: self.serving.model)
+    model_format = property(lambda self: self.serving.model_format)
+    device = property(lambda self: self.serving.device)
+    embedding_cache = property(lambda self: self.serving.embedding_cache)
+
+    def _load_serving_model(self, model_path, manifest, hidden_channels):
+        if manifest is not None and manifest.get('artifact_format'):
+            # Exported artifacts are CPU-optimized and already carry their weights
+            device = 'cpu'
+            model_format = manifest['artifact_format']
+            model = load_inference_artifact(model_path, manifest)
+            print(f"Inference artifact ({manifest['artifact_format']}) loaded from {model_path}")
+        else:
+            # Initialize model
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            model_format = 'eager'
+            model = FraudDetectionHGNN(hidden_channels=hidden_channels, out_channels=1, metadata=self.metadata).to(device)
+
+            # Load model if the file exists
+            if os.path.exists(model_path):
+                model.load_state_dict(torch.load(model_path, map_location=device))
+                print(f"Model loaded from {model_path}")
+            else:
+                print(f"Warning: Model file {model_path} not found. Using untrained model.")
+        model.eval()
+
+        # Cached user/payment embeddings need the resident graph to compute misses from
+        embedding_cache = None
+        if self.embedding_cache_size:
+            if not hasattr(model, 'score_orders_from_context'):
+                print("Warning: The embedding cache needs the eager model, not an exported artifact; disabled.")
+            elif self.inference_mode == 'neighborhood':
+                embedding_cache = NodeEmbeddingCache(self.embedding_cache_size)
+            else:
+                print("Warning: The embedding cache requires inference_mode='neighborhood'; disabled.")
+        self._model_versions += 1
+        return ServingModel(model, model_format, device, embedding_cache, model_path, self._model_versions)
+
+    def _check_compatible(self, manifest):
+        """A swapped-in model must read the same features and graph as the one it replaces."""
+        dp = self.data_processor
+        metadata = manifest['metadata']
+        if dict(metadata[0]) != dict(self.metadata[0]) or set(metadata[1]) != set(map(tuple, self.metadata[1])):
+            raise ValueError("New model has different node/edge types or feature widths; restart to switch")
+        if (manifest['feature_vocab'] != dp.feature_vocab
+                or manifest.get('feature_columns', {}) != dp.feature_columns):
+            raise ValueError("New model was trained on different feature columns; restart to switch")
+
+    def _prepare_model(self, model_path):
+        """Load a model off the request path, then warm it up and sanity-check it on recent orders."""
+        manifest = load_model_manifest(model_path)
+        if manifest is None:
+            raise ValueError(f"No manifest next to {model_path}")
+        self._check_compatible(manifest)
+        serving = self._load_serving_model(model_path, manifest, manifest['hidden_channels'])
+        orders = list(self._recent_orders) or [{'order_id': 'warmup', 'user_id': None, 'payment_id': None}]
+        for _ in range(2):
+            fraud_probs = np.asarray(self._predict_probabilities(orders, serving))
+        if not (np.isfinite(fraud_probs).all() and ((fraud_probs >= 0) & (fraud_probs <= 1)).all()):
+            raise ValueError("New model produced invalid probabilities on the sanity orders")
+        return serving
+
+    def reload_model(self, model_path=None):
+        """Load and warm a model (default: the watched model_path), then swap it in atomically.
+
+        Runs in the calling thread; requests keep scoring on the old model meanwhile, and
+        requests already in flight finish on it. Returns the new model version.
+        """
+        model_path = model_path or self.model_path
+        with self._reload_lock:
+            try:
+                serving = self._prepare_model(model_path)
+            except Exception as e:
+                self.last_reload_error = str(e)
+                self._reloads.inc(status='failed')
+                print(f"Model reload from {model_path} failed: {e}")
+                raise
+            self.serving = serving
+            if self.result_cache is not None:
+                self.result_cache.clear()
+            self.last_reload_error = None
+            self._reloads.inc(status='ok')
+            print(f"Model version {serving.version} from {model_path} is live")
+            return serving.version
+
+    def watch_model(self, interval=10.0):
+        """Hot-reload whenever model_path or its manifest changes (polled every interval seconds)."""
+        self._watch_interval = interval
+
+    def _model_stamp(self):
+        stamp = []
+        for path in (self.model_path, model_manifest_path(self.model_path)):
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamp.append(None)
+        return stamp
+
+    def _watch_loop(self, interval):
+        last = self._model_stamp()
+        while True:
+            time.sleep(interval)
+            stamp = self._model_stamp()
+            if stamp == last:
+                continue
+            # Let the writer finish the weights/manifest pair before loading
+            time.sleep(min(interval, 1.0))
+            if stamp != self._model_stamp():
+                continue
+            last = stamp
+            try:
+                self.reload_model()
+            except Exception:
+                pass
+
+    def start_shadow(self, model_path, sample_rate=0.1, max_pending=1000):
+        """Score a sampled fraction of traffic on a second model and record score deltas."""
+        serving = self._prepare_model(model_path)
+        self._shadow_max_pending = max_pending
+        self.shadow_rate = sample_rate
+        self.shadow = serving
+        print(f"Shadow model {model_path} scoring {sample_rate:.0%} of traffic")
+
+    def stop_shadow(self):
+        self.shadow = None
+
+    def _shadow_loop(self, pending):
+        while True:
+            orders, primary = pending.get()
+            shadow = self.shadow
+            if shadow is None:
+                continue
+            try:
+                fraud_probs = np.asarray(self._predict_probabilities(orders, shadow))
+            except Exception as e:
+                print(f"Shadow scoring failed: {e}")
+                self._shadow_events.inc(len(orders), outcome='error')
+                continue
+            primary = np.asarray(primary)
+            for delta in np.abs(fraud_probs - primary).tolist():
+                self._shadow_deltas.observe(delta)
+            disagree = int(((fraud_probs >= self.threshold) != (primary >= self.threshold)).sum())
+            self._shadow_events.inc(disagree, outcome='disagree')
+            self._shadow_events.inc(len(orders) - disagree, outcome='agree')
+
+    def _ensure_background(self):
+        # Threads don't survive fork, so they start in whichever process serves requests
+        pid = os.getpid()
+        if self._background_pid == pid and (self.shadow is None or self._shadow_pid == pid):
+            return
+        with self._background_lock:
+            if self._background_pid != pid:
+                if self._watch_interval:
+                    threading.Thread(target=self._watch_loop, args=(self._watch_interval,),
+                                     name='model-watcher', daemon=True).start()
+                self._background_pid = pid
+            if self.shadow is not None and self._shadow_pid != pid:
+                self._shadow_queue = queue.Queue(maxsize=self._shadow_max_pending)
+                threading.Thread(target=self._shadow_loop, args=(self._shadow_queue,),
+                                 name='shadow-scorer', daemon=True).start()
+                self._shadow_pid = pid
+
+    def _submit_shadow(self, orders, fraud_probs):
+        if self.shadow is None or self._shadow_queue is None or random.random() >= self.shadow_rate:
+            return
+        try:
+            self._shadow_queue.put_nowait((orders, fraud_probs))
+        except queue.Full:
+            self._shadow_events.inc(len(orders), outcome='dropped')
+
+    def model_status(self):
+        return {'model': self.serving.describe(),
+                'shadow': dict(self.shadow.describe(), sample_rate=self.shadow_rate) if self.shadow else None,
+                'reloading': self._reload_lock.locked(), 'last_reload_error': self.last_reload_error}
+
+    def _register_gauges(self):
+        """Model, graph and cache gauges are computed at scrape time, off the hot path."""
+        self.metrics.gauge('fraud_model_info', 'Loaded model', ('format', 'inference_mode', 'version')).set_function(
+            lambda: {(self.model_format, self.inference_mode, str(self.serving.version)): 1})
+        self.metrics.gauge('fraud_model_parameters', 'Model parameter count').set_function(
+            lambda: sum(p.numel() for p in self.model.parameters()))
+        self.metrics.gauge('fraud_graph_nodes', 'Resident graph nodes', ('node_type',)).set_function(
+            lambda: None if self.graph is None else
+            {(node_type,): self.graph[node_type].num_nodes for node_type in self.graph.node_types})
+        self.metrics.gauge('fraud_neighborhood_fanout', 'Current first-hop fanout').set_function(
+            lambda: self._current_fanout[0] if self._current_fanout else None)
+
+        def cache_stat(name):
+            return lambda: None if self.embedding_cache is None else self.embedding_cache.stats()[name]
+        for name, documentation in (('entries', 'Cached node embeddings'), ('bytes', 'Embedding cache size'),
+                                    ('hits', 'Embedding cache hits'), ('misses', 'Embedding cache misses'),
+                                    ('hit_rate', 'Embedding cache hit rate')):
+            self.metrics.gauge(f'fraud_embedding_cache_{name}', documentation).set_function(cache_stat(name))
+
+        def result_stat(name):
+            return lambda: None if self.result_cache is None else self.result_cache.stats()[name]
+        for name, documentation in (('entries', 'Cached prediction results'), ('hits', 'Prediction cache hits'),
+                                    ('misses', 'Prediction cache misses'), ('hit_rate', 'Prediction cache hit rate'),
+                                    ('evictions', 'Prediction cache LRU evictions')):
+            self.metrics.gauge(f'fraud_prediction_cache_{name}', documentation).set_function(result_stat(name))
+        self.metrics.gauge('fraud_velocity_keys', 'Users/payments tracked by the velocity store').set_function(
+            lambda: None if self.velocity is None else len(self.velocity))
+
+    def _load_resident_graph(self):
+        """Keep the training graph in memory so new orders are scored in context."""
+        if self.graph is None:
+            # Reuse a graph the processor already built (e.g. for training) instead of rebuilding it
+            self.graph = self.data_processor.graph
+            if self.graph is None:
+                self.graph = self.data_processor.create_heterograph()
+        for node_type, dim in self.metadata[0].items():
+            if self.graph[node_type].x.size(1) != dim:
+                raise ValueError(f"Resident graph '{node_type}' features have width "
+                                 f"{self.graph[node_type].x.size(1)}, model expects {dim}")
+        self.sampler = HeteroNeighborSampler(self.graph, self.neighborhood_fanout)
+        print("Resident graph loaded: " + ", ".join(
+            f"{node_type}={self.graph[node_type].num_nodes}" for node_type in self.graph.node_types))
+
+    def process_new_order(self, order_data):
+        """Convert new order data into a graph, perform inference, and return fraud probability."""
+        return self.process_orders([order_data])[0]
+
+    def process_orders(self, orders):
+        """Score a list of orders in one forward pass; each result matches process_new_order."""
+        orders = list(orders)
+        if not orders:
+            return []
+        self._ensure_background()
+        if self.result_cache is not None:
+            return self._cached_orders(orders)
+        if self.velocity is not None:
+            orders = self._with_velocity(orders)
+        return self._score_orders(orders)
+
+    def _cached_orders(self, orders):
+        """Serve repeated (order_id, payload) submissions from the result cache, scoring only the rest.
+
+        Cache hits skip the velocity store and graph append as well, so a retried order is
+        counted once.
+        """
+        cache = self.result_cache
+        version = self.serving.version
+        keys = [cache.key(order_data) for order_data in orders]
+        results = [cache.get(key, version) for key in keys]
+        rows = [i for i, result in enumerate(results) if result is None]
+        if rows:
+            misses = [orders[i] for i in rows]
+            if self.velocity is not None:
+                misses = self._with_velocity(misses)
+            for i, result in zip(rows, self._score_orders(misses)):
+                if result.get('error') is None:
+                    cache.put(keys[i], version, result)
+                results[i] = result
+        return results
+
+    def _with_velocity(self, orders):
+        """Copy orders with their velocity features attached, recording each one in the store.
+
+        Orders are recorded in request order, so an order sees the ones before it in the
+        same batch, as in training.
+        """
+        dp = self.data_processor
+        frame = dp.request_frame(orders)
+        timestamps = dp.order_timestamps(frame)
+        now = time.time()
+        timestamps = np.full(len(frame), now) if timestamps is None else np.where(np.isnan(timestamps), now,
+                                                                                  timestamps)
+        amounts = pd.to_numeric(frame.get('order_amount', pd.Series(0, index=frame.index)),
+                                errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        keys = {kind: velocity_keys(kind, frame[f'{kind}_id']) for kind in ('user', 'payment')}
+        columns = {kind: dp.velocity_columns(kind) for kind in keys}
+        annotated = []
+        with self._lock:
+            for i, order_data in enumerate(orders):
+                order_data = dict(order_data)
+                for kind, kind_keys in keys.items():
+                    if kind_keys[i] is None:
+                        order_data.update(dict.fromkeys(columns[kind], 0.0))
+                        continue
+                    values = self.velocity.update(kind_keys[i], timestamps[i], amounts[i])
+                    order_data.update(zip(columns[kind], values.tolist()))
+                annotated.append(order_data)
+        return annotated
+
+    def _score_orders(self, orders):
+        start = time.perf_counter()
+        # The whole batch runs on the model that is live now, even if a reload swaps it meanwhile
+        serving = self.serving
+        try:
+            fraud_probs = self._predict_probabilities(orders, serving)
+        except Exception as e:
+            if len(orders) > 1:
+                # Score one by one so a single bad payload doesn't fail the whole batch
+                return [self._score_orders([order_data])[0] for order_data in orders]
+            print(f"Error processing order: {e}")
+            self._errors.inc(stage='score')
+            return [{
+                'error': str(e),
+                'fraud_probability': None,
+                'is_fraud': None,
+                'order_id': orders[0].get('order_id', 'unknown')
+            }]
+        self._record_latency(time.perf_counter() - start)
+        self._recent_orders.extend(orders[-8:])
+        self._submit_shadow(orders, fraud_probs)
+
+        if self.append_scored_orders:
+            try:
+                self.append_orders(orders)
+            except Exception as e:
+                print(f"Error appending scored orders to the graph: {e}")
+                self._errors.inc(stage='append')
+
+        num_fraud = sum(fraud_prob >= self.threshold for fraud_prob in fraud_probs)
+        self._orders_scored.inc(num_fraud, decision='fraud')
+        self._orders_scored.inc(len(fraud_probs) - num_fraud, decision='legit')
+
+        return [{
+            'fraud_probability': float(fraud_prob),  # Ensure it's a Python float
+            'is_fraud': bool(fraud_prob >= self.threshold),
+            'order_id': order_data.get('order_id')
+        } for order_data, fraud_prob in zip(orders, fraud_probs)]
+
+    def _predict_probabilities(self, orders, serving):
+        """Fraud probabilities for a batch, using cached neighbor embeddings where possible."""
+        if serving.embedding_cache is None:
+            return self._forward_probabilities(orders, serving).tolist()
+
+        dp = self.data_processor
+        frame = dp.request_frame(orders)
+        user_idx = dp.node_mappings['user'].get_indexer(frame['user_id'].to_numpy())
+        payment_idx = dp.node_mappings['payment'].get_indexer(frame['payment_id'].to_numpy())
+        # Orders from unseen users/payments have nothing cached and take the full subgraph path
+        cached = (user_idx >= 0) & (payment_idx >= 0)
+        fraud_probs = np.empty(len(orders))
+        rows = np.flatnonzero(cached)
+        if len(rows):
+            fraud_probs[rows] = self._score_from_cache(frame.iloc[rows], user_idx[rows], payment_idx[rows], serving)
+        rows = np.flatnonzero(~cached)
+        if len(rows):
+            fraud_probs[rows] = self._forward_probabilities([orders[i] for i in rows], serving)
+        return fraud_probs.tolist()
+
+    def _forward_probabilities(self, orders, serving):
+        with self._stage_seconds.time(stage='convert'):
+            graph_data = self._convert_orders_to_graph(orders)
+        self._batch_sizes.observe(len(orders))
+        device = serving.device
+        with self._stage_seconds.time(stage='forward'), torch.no_grad():
+            out = serving.model(
+                {node_type: graph_data[node_type].x.to(device) for node_type in graph_data.node_types},
+                {edge_type: graph_data[edge_type].edge_index.to(device) for edge_type in graph_data.edge_types}
+            )
+        return torch.sigmoid(out[:len(orders)].view(-1)).cpu().numpy()
+
+    def _score_from_cache(self, frame, user_idx, payment_idx, serving):
+        """Run only the order-side path and output layer on top of cached neighbor embeddings.
+
+        This is an approximation of the full neighborhood forward: a cached user/payment
+        layer-1 embedding is computed without the request orders' own places/uses edges,
+        which _neighborhood_graph adds. Including them would mean re-running conv1 for
+        every request, which is what the cache avoids. The difference is one message
+        among a node's neighbors; tests/test_embedding_cache.py bounds it on a trained model.
+        """
+        users, user_local = np.unique(user_idx, return_inverse=True)
+        payments, payment_local = np.unique(payment_idx, return_inverse=True)
+        with self._stage_seconds.time(stage='context'):
+            context = self._context_embeddings({'user': users, 'payment': payments}, serving)
+        self._batch_sizes.observe(len(frame))
+        order_local = np.arange(len(frame))
+        device = serving.device
+        edges = {
+            ('user', 'places', 'order'): torch.from_numpy(np.stack([user_local, order_local])).to(device),
+            ('payment', 'used_by', 'order'): torch.from_numpy(np.stack([payment_local, order_local])).to(device),
+        }
+        x_order = self.data_processor.build_order_features(frame).to(device)
+        with self._stage_seconds.time(stage='forward'), torch.no_grad():
+            out = serving.model.score_orders_from_context(
+                x_order,
+                {node_type: h0 for node_type, (h0, _) in context.items()},
+                {node_type: h1 for node_type, (_, h1) in context.items()},
+                edges)
+        return torch.sigmoid(out.view(-1)).cpu().numpy()
+
+    def _context_embeddings(self, indices, serving):
+        """Stacked (layer-0, layer-1) embeddings for resident nodes, filling cache misses.
+
+        Misses are computed on a one-hop sample of the resident graph around the nodes
+        (without the request orders), so a cached layer-1 embedding reflects the graph as
+        of when it was computed until invalidated.
+        """
+        cache, model, device = serving.embedding_cache, serving.model, serving.device
+        entries = {node_type: cache.get_many(node_type, idx) for node_type, idx in indices.items()}
+        missing = {node_type: idx[[entry is None for entry in entries[node_type]]]
+                   for node_type, idx in indices.items()}
+        if any(len(idx) for idx in missing.values()):
+            with self._lock:
+                sub = self.sampler.subgraph(missing, self._current_fanout[:1])
+            with torch.no_grad():
+                h0 = model.encode({node_type: sub[node_type].x.to(device) for node_type in sub.node_types})
+                h1 = model.first_layer(
+                    h0, {edge_type: sub[edge_type].edge_index.to(device) for edge_type in sub.edge_types})
+            for node_type, idx in missing.items():
+                if not len(idx):
+                    continue
+                # Seeds are the first rows of their type in the sampled subgraph
+                fresh_h0, fresh_h1 = h0[node_type][:len(idx)], h1[node_type][:len(idx)]
+                cache.put_many(node_type, idx, fresh_h0, fresh_h1)
+                fresh = dict(zip(idx.tolist(), zip(fresh_h0, fresh_h1)))
+                entries[node_type] = [entry if entry is not None else fresh[int(index)]
+                                      for entry, index in zip(entries[node_type], indices[node_type])]
+        return {node_type: (torch.stack([entry[0] for entry in node_entries]),
+                            torch.stack([entry[1] for entry in node_entries]))
+                for node_type, node_entries in entries.items()}
+
+    def append_orders(self, orders):
+        """Add orders (and any unseen users/payments) to the resident graph for later requests."""
+        if self.graph is None:
+            raise ValueError("append_orders() needs inference_mode='neighborhood'")
+        dp = self.data_processor
+        with self._lock:
+            delta = dp.append(orders=dp.request_frame(orders))
+            for edge_type, (src, dst) in delta['edges'].items():
+                self.sampler.add_edges(edge_type, src, dst)
+            # New edges change the first-layer embeddings of the orders' users and payments, and a
+            # new holder changes an attribute node's count feature, which every other holder reads
+            stale = {node_type: [delta['nodes'][node_type]] for node_type in ('user', 'payment')}
+            for source_type, _, _, name, attr_type in dp.attribute_relations:
+                changed = delta['nodes'].get(attr_type)
+                if changed is not None and len(changed) and (source_type, name, attr_type) in self.sampler.csr:
+                    stale[source_type].append(self.sampler.neighbors((source_type, name, attr_type), changed))
+        for cache in self._embedding_caches():
+            for node_type, parts in stale.items():
+                cache.invalidate(node_type, np.unique(np.concatenate(parts)))
+        return delta
+
+    def _embedding_caches(self):
+        return [serving.embedding_cache for serving in (self.serving, self.shadow)
+                if serving is not None and serving.embedding_cache is not None]
+
+    def replay_orders(self, orders, graph=True):
+        """Re-apply already-scored orders to the velocity store and resident graph without scoring.
+
+        Each order is recorded at its own timestamp, in time order; orders without one are
+        skipped by the store (and get zero velocity columns) instead of counting as now.
+        With graph=True and append_scored_orders they are appended like scored orders.
+        """
+        orders = [dict(order_data) for order_data in orders]
+        if not orders:
+            return 0
+        if self.velocity is not None:
+            dp = self.data_processor
+            frame = dp.request_frame(orders)
+            timestamps = dp.order_timestamps(frame)
+            if timestamps is None:
+                timestamps = np.full(len(frame), np.nan)
+            amounts = pd.to_numeric(frame.get('order_amount', pd.Series(0, index=frame.index)),
+                                    errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+            keys = {kind: velocity_keys(kind, frame[f'{kind}_id']) for kind in ('user', 'payment')}
+            with self._lock:
+                for i in np.argsort(timestamps, kind='stable').tolist():
+                    for kind, kind_keys in keys.items():
+                        columns = dp.velocity_columns(kind)
+                        if np.isnan(timestamps[i]) or kind_keys[i] is None:
+                            orders[i].update(dict.fromkeys(columns, 0.0))
+                        else:
+                            values = self.velocity.update(kind_keys[i], timestamps[i], amounts[i])
+                            orders[i].update(zip(columns, values.tolist()))
+        if graph and self.append_scored_orders:
+            self.append_orders(orders)
+        return len(orders)
+
+    def save_graph_snapshot(self, directory, **info):
+        """Save the resident graph, appended orders included, for load_graph_snapshot().
+
+        info (e.g. a stream offset) is stored with it and returned by load_graph_snapshot().
+        """
+        if self.graph is None:
+            raise ValueError("save_graph_snapshot() needs inference_mode='neighborhood'")
+        os.makedirs(directory, exist_ok=True)
+        info_path = os.path.join(directory, 'snapshot.json')
+        # The info goes last, so a crash mid-save never pairs it with another snapshot's graph
+        if os.path.exists(info_path):
+            os.remove(info_path)
+        with self._lock:
+            snapshot = copy.copy(self.data_processor)
+            snapshot.cache_dir = directory
+            # save_cache may swap object-dtype indices for string ones; keep that off the live processor
+            snapshot.node_mappings = dict(snapshot.node_mappings)
+            snapshot.save_cache()
+        tmp_path = info_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp_path, info_path)
+
+    def graph_snapshot_info(self, directory):
+        """The info saved with a graph snapshot, or None when there is no complete one."""
+        try:
+            with open(os.path.join(directory, 'snapshot.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load_graph_snapshot(self, directory):
+        """Replace the resident graph with a saved snapshot; returns its info, or None if missing or stale."""
+        info = self.graph_snapshot_info(directory)
+        if info is None or self.graph is None:
+            return None
+        dp = self.data_processor
+        snapshot = DataProcessor(dp.order_data_path, dp.user_data_path, dp.payment_data_path, cache_dir=directory,
+                                 hash_sources=dp.hash_sources,
+                                 shared_attributes=[relation[-1] for relation in dp.attribute_relations])
+        if not snapshot.load_cache():
+            return None
+        with self._lock:
+            for name in ('node_features', 'edge_indices', 'node_mappings', 'labels'):
+                setattr(dp, name, getattr(snapshot, name))
+            self.graph = dp._assemble_graph()
+            self._load_resident_graph()
+            for cache in self._embedding_caches():
+                cache.clear()
+        return info
+
+    def invalidate_embeddings(self, node_type, node_ids):
+        """Drop cached embeddings for nodes (by original ID) whose features or edges changed."""
+        indices = self.data_processor.node_mappings[node_type].get_indexer(np.asarray(node_ids))
+        for cache in self._embedding_caches():
+            cache.invalidate(node_type, indices[indices >= 0])
+
+    def embedding_cache_stats(self):
+        return self.embedding_cache.stats() if self.embedding_cache is not None else None
+
+    def prediction_cache_stats(self):
+        return self.result_cache.stats() if self.result_cache is not None else None
+
+    def _record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds * 1000)
+            self._num_scored += 1
+            if (self.latency_budget_ms is None or self.inference_mode != 'neighborhood'
+                    or self._num_scored % 100):
+                return
+            p99 = float(np.percentile(self._latencies, 99))
+            if p99 > self.latency_budget_ms:
+                fanout = [max(1, f // 2) for f in self._current_fanout]
+            elif p99 < self.latency_budget_ms / 2:
+                fanout = [min(max_f, f * 2) for f, max_f in zip(self._current_fanout, self.neighborhood_fanout)]
+            else:
+                return
+            if fanout != self._current_fanout:
+                print(f"p99 latency {p99:.1f}ms vs budget {self.latency_budget_ms}ms: fanout {fanout}")
+                self._current_fanout = fanout
+
+    def latency_stats(self):
+        """Rolling latency percentiles over the last 1000 scored requests."""
+        with self._lock:
+            latencies = list(self._latencies)
+            fanout = list(self._current_fanout)
+        if not latencies:
+            return {'count': 0, 'fanout': fanout}
+        return {
+            'count': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'fanout': fanout,
+        }
+
+    def _convert_order_to_graph(self, order_data):
+        """Build the graph to score; the request's order is always order node 0."""
+        return self._convert_orders_to_graph([order_data])
+
+    def _convert_orders_to_graph(self, orders):
+        """Build one graph for a batch; request order i is order node i."""
+        frame = self.data_processor.request_frame(orders)
+        if self.inference_mode == 'neighborhood':
+            return self._neighborhood_graph(frame)
+        return self._minigraph(frame)
+
+    def _minigraph(self, frame):
+        """Isolated user-order-payment triple per request row."""
+        dp = self.data_processor
+        data = HeteroData()
+        data['user'].x = dp.build_user_features(frame)
+        data['order'].x = dp.build_order_features(frame)
+        data['payment'].x = dp.build_payment_features(frame)
+        
+        # Row i's user and payment connect only to row i's order
+        pairs = torch.arange(len(frame)).repeat(2, 1)
+        data[('user', 'places', 'order')].edge_index = pairs
+        data[('order', 'placed_by', 'user')].edge_index = pairs
+        data[('order', 'uses', 'payment')].edge_index = pairs
+        data[('payment', 'used_by', 'order')].edge_index = pairs
         
         return data
 
+    def _attach(self, frame, node_type, id_column, global_idx, n_id, x, build_features):
+        """Local indices of each row's node, creating request-built nodes for unseen IDs."""
+        local = np.empty(len(frame), dtype=np.int64)
+        known = global_idx >= 0
+        local[known] = NodeIndex(n_id.numpy()).lookup(global_idx[known])
+        unknown_rows = np.flatnonzero(~known)
+        if len(unknown_rows):
+            # Rows repeating an unseen ID share one node; rows without an ID get their own
+            ids = frame[id_column].to_numpy()[unknown_rows]
+            keys = [str(v) if pd.notna(v) else f'\0row{i}' for i, v in zip(unknown_rows, ids)]
+            codes, _ = pd.factorize(np.array(keys, dtype=object))
+            _, first = np.unique(codes, return_index=True)
+            local[unknown_rows] = x[node_type].size(0) + codes
+            x[node_type] = torch.cat([x[node_type], build_features(frame.iloc[unknown_rows[first]])])
+        return local
+
+    def _resident_local(self, node_type, global_idx, node_ids, x):
+        """Local indices of resident nodes, gathering any the sample did not reach."""
+        local = NodeIndex(node_ids[node_type]).get_indexer(global_idx)
+        missing = local < 0
+        if missing.any():
+            extra = np.unique(global_idx[missing])
+            local[missing] = x[node_type].size(0) + np.searchsorted(extra, global_idx[missing])
+            x[node_type] = torch.cat([x[node_type], self.graph[node_type].x[torch.from_numpy(extra)]])
+        return local
+
+    def _neighborhood_graph(self, frame):
+        """Attach request orders to their resident user/payment nodes inside a sampled subgraph."""
+        dp = self.data_processor
+        num_orders = len(frame)
+        user_idx = dp.node_mappings['user'].get_indexer(frame['user_id'].to_numpy())
+        payment_idx = dp.node_mappings['payment'].get_indexer(frame['payment_id'].to_numpy())
+        with self._lock:
+            fanout = list(self._current_fanout)
+            node_ids, edge_index = self.sampler.sample(
+                {'user': np.unique(user_idx[user_idx >= 0]), 'payment': np.unique(payment_idx[payment_idx >= 0])},
+                fanout)
+
+        x = {node_type: self.graph[node_type].x[torch.from_numpy(ids)] for node_type, ids in node_ids.items()}
+        # Request orders go first so out[:num_orders] lines up with the request rows
+        x['order'] = torch.cat([dp.build_order_features(frame), x['order']])
+        edges = {}
+        for edge_type, pairs in edge_index.items():
+            pairs = pairs.copy()
+            if edge_type[0] == 'order':
+                pairs[0] += num_orders
+            if edge_type[2] == 'order':
+                pairs[1] += num_orders
+            edges[edge_type] = pairs
+
+        user_local = self._attach(frame, 'user', 'user_id', user_idx, torch.from_numpy(node_ids['user']),
+                                  x, dp.build_user_features)
+        payment_local = self._attach(frame, 'payment', 'payment_id', payment_idx,
+                                     torch.from_numpy(node_ids['payment']), x, dp.build_payment_features)
+        order_local = np.arange(num_orders)
+        for edge_type, src, dst in (
+                (('user', 'places', 'order'), user_local, order_local),
+                (('order', 'placed_by', 'user'), order_local, user_local),
+                (('order', 'uses', 'payment'), order_local, payment_local),
+                (('payment', 'used_by', 'order'), payment_local, order_local)):
+            edges[edge_type] = np.concatenate([edges[edge_type], np.stack([src, dst])], axis=1)
+
+        # Request-built users/payments join the resident nodes of the attributes they share
+        for _, _, column, name, attr_type in dp.attribute_relations:
+            for source_type, source_idx, source_local in (('user', user_idx, user_local),
+                                                          ('payment', payment_idx, payment_local)):
+                edge_type = (source_type, name, attr_type)
+                if edge_type not in edges:
+                    continue
+                values = dp.attribute_values(frame, column)
+                rows = np.flatnonzero((source_idx < 0) & values.notna().to_numpy())
+                attr_idx = dp.node_mappings[attr_type].get_indexer(values.to_numpy()[rows])
+                rows, attr_idx = rows[attr_idx >= 0], attr_idx[attr_idx >= 0]
+                if not len(rows):
+                    continue
+                pairs = np.unique(np.stack([source_local[rows],
+                                            self._resident_local(attr_type, attr_idx, node_ids, x)]), axis=1)
+                edges[edge_type] = np.concatenate([edges[edge_type], pairs], axis=1)
+                reverse = (attr_type, 'shared_by', source_type)
+                edges[reverse] = np.concatenate([edges[reverse], pairs[::-1]], axis=1)
+
+        data = HeteroData()
+        for node_type, features in x.items():
+            data[node_type].x = features
+        for edge_type, pairs in edges.items():
+            data[edge_type].edge_index = torch.from_numpy(pairs)
+        return data
+
+
+# ---------------------------
+# Micro-batching
+# ---------------------------
+class MicroBatcher:
+    """Coalesces concurrent single-order requests into one batched forward pass.
+
+    A background thread takes the first queued order, waits at most max_wait_ms for
+    more (up to max_batch_size) and scores them together with score_batch.
+    """
+
+    def __init__(self, score_batch, max_batch_size=64, max_wait_ms=3.0):
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # Threads don't survive fork, so the worker starts lazily in the serving process
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                                name='micro-batcher', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def submit(self, order_data):
+        """Queue one order and block until its batch has been scored."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((order_data, future))
+        return future.result()
+
+    def _run(self, pending):
+        while True:
+            batch = [pending.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                results = self.score_batch([order_data for order_data, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
 
 # ---------------------------
 # Flask API Setup
 # ---------------------------
-def create_fraud_detection_app(model_path, data_processor):
+def create_fraud_detection_app(model_path, data_processor, micro_batching=False, max_batch_size=64,
+                               max_wait_ms=3.0, max_request_orders=10000, **api_kwargs):
     app = Flask(__name__)
+    metrics = MetricsRegistry()
+    http_requests = metrics.counter('fraud_http_requests_total', 'HTTP requests by endpoint and status',
+                                    ('endpoint', 'status'))
+    http_seconds = metrics.histogram('fraud_http_request_seconds', 'End-to-end request latency', ('endpoint',))
+    stage_seconds = metrics.histogram('fraud_stage_seconds', 'Wall time per scoring stage', ('stage',))
     
     # Initialize fraud API with robust error handling
     try:
-        fraud_api = FraudDetectionAPI(model_path, data_processor)
+        fraud_api = FraudDetectionAPI(model_path, data_processor, metrics=metrics, **api_kwargs)
     except Exception as e:
         print(f"Failed to initialize fraud detection API: {e}")
         # Create a dummy API that returns errors
@@ -399,7 +3378,26 @@ def create_fraud_detection_app(model_path, data_processor):
                     'is_fraud': None,
                     'order_id': order_data.get('order_id', 'unknown')
                 }
+
+            def process_orders(self, orders):
+                return [self.process_new_order(order_data) for order_data in orders]
         fraud_api = DummyAPI()
+    app.fraud_api = fraud_api
+    app.metrics = metrics
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        http_requests.inc(endpoint=endpoint, status=str(response.status_code))
+        http_seconds.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+        return response
+
+    # Optionally coalesce concurrent /predict calls into batched forwards
+    batcher = MicroBatcher(fraud_api.process_orders, max_batch_size, max_wait_ms) if micro_batching else None
 
     @app.route('/predict', methods=['POST'])
     def predict_fraud():
@@ -408,7 +3406,8 @@ def create_fraud_detection_app(model_path, data_processor):
             if not request.is_json:
                 return jsonify({'error': 'Request must be JSON'}), 400
                 
-            order_data = request.get_json()
+            with stage_seconds.time(stage='parse'):
+                order_data = request.get_json()
             if not order_data:
                 return jsonify({'error': 'Empty request body'}), 400
                 
@@ -417,36 +3416,1299 @@ def create_fraud_detection_app(model_path, data_processor):
                 return jsonify({'error': 'Missing order_id field'}), 400
 
             # Process order and get prediction
-            result = fraud_api.process_new_order(order_data)
+            if batcher is not None:
+                result = batcher.submit(order_data)
+            else:
+                result = fraud_api.process_new_order(order_data)
             
             # Check if there was an error in processing
             if 'error' in result and result['error'] is not None:
                 return jsonify({'error': result['error']}), 500
                 
-            return jsonify(result)
+            with stage_seconds.time(stage='serialize'):
+                return jsonify(result)
             
         except Exception as e:
             return jsonify({'error': f'Prediction failed: {str(e)}'}), 500
 
+    @app.route('/predict/batch', methods=['POST'])
+    def predict_fraud_batch():
+        try:
+            if not request.is_json:
+                return jsonify({'error': 'Request must be JSON'}), 400
+
+            # Accept either a bare array or {"orders": [...]}
+            with stage_seconds.time(stage='parse'):
+                payload = request.get_json()
+            orders = payload.get('orders') if isinstance(payload, dict) else payload
+            if not isinstance(orders, list) or not orders:
+                return jsonify({'error': 'Request body must be a non-empty array of orders'}), 400
+            if len(orders) > max_request_orders:
+                return jsonify({'error': f'Batch too large ({len(orders)} orders)'}), 413
+            for position, order_data in enumerate(orders):
+                if not isinstance(order_data, dict) or 'order_id' not in order_data:
+                    return jsonify({'error': f'Missing order_id field in order {position}'}), 400
+
+            # Per-order failures are reported inline, in the same shape as /predict
+            results = fraud_api.process_orders(orders)
+            with stage_seconds.time(stage='serialize'):
+                return jsonify({'results': results})
+
+        except Exception as e:
+            return jsonify({'error': f'Batch prediction failed: {str(e)}'}), 500
+
     @app.route('/healthcheck', methods=['GET'])
     def healthcheck():
         return jsonify({'status': 'ok'}), 200
 
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        # Under serve_prefork every worker publishes snapshots; whichever worker is scraped merges them
+        metrics_dir = app.config.get('PREFORK_METRICS_DIR')
+        if metrics_dir:
+            write_metrics_snapshot(metrics, metrics_dir)
+            body = metrics.render(metrics.merge(read_metrics_snapshots(metrics_dir)))
+        else:
+            body = metrics.render()
+        return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    # Admin endpoints load model files from disk, so they only exist when FRAUD_ADMIN_TOKEN is set
+    admin_token = os.environ.get('FRAUD_ADMIN_TOKEN')
+
+    def admin_error():
+        if not admin_token:
+            return jsonify({'error': 'Admin endpoints are disabled (set FRAUD_ADMIN_TOKEN)'}), 404
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token):
+            return jsonify({'error': 'Invalid admin token'}), 403
+        if not isinstance(fraud_api, FraudDetectionAPI):
+            return jsonify({'error': 'Model initialization failed'}), 503
+        return None
+
+    def prefork_error():
+        # Under serve_prefork a request reaches one forked worker; the others would keep their model
+        if app.config.get('PREFORK_WORKERS', 1) > 1:
+            return jsonify({'error': 'Model changes through the admin API reach only one of '
+                                     f"{app.config['PREFORK_WORKERS']} workers; use --watch-model (every "
+                                     'worker polls the model file) or --shadow-model at startup'}), 409
+        return None
+
+    def in_background(target, *args):
+        def run():
+            try:
+                target(*args)
+            except Exception as e:
+                print(f"Admin task failed: {e}")
+        threading.Thread(target=run, name='admin-task', daemon=True).start()
+
+    @app.route('/admin/model', methods=['GET'])
+    def model_status():
+        # Under serve_prefork this is the state of the worker that took the request
+        return admin_error() or jsonify(dict(fraud_api.model_status(), pid=os.getpid(),
+                                             workers=app.config.get('PREFORK_WORKERS', 1)))
+
+    @app.route('/admin/reload', methods=['POST'])
+    def reload_model():
+        error = admin_error() or prefork_error()
+        if error:
+            return error
+        if fraud_api.model_status()['reloading']:
+            return jsonify({'error': 'A reload is already running'}), 409
+        model_path = (request.get_json(silent=True) or {}).get('model_path') or fraud_api.model_path
+        # Loading and warm-up run in the background; poll /admin/model for the new version
+        in_background(fraud_api.reload_model, model_path)
+        return jsonify({'status': 'reloading', 'model_path': model_path}), 202
+
+    @app.route('/admin/shadow', methods=['POST', 'DELETE'])
+    def shadow_model():
+        error = admin_error() or prefork_error()
+        if error:
+            return error
+        if request.method == 'DELETE':
+            fraud_api.stop_shadow()
+            return jsonify({'status': 'stopped'})
+        payload = request.get_json(silent=True) or {}
+        sample_rate = payload.get('sample_rate', 0.1)
+        if not payload.get('model_path') or not isinstance(sample_rate, (int, float)) or not 0 < sample_rate <= 1:
+            return jsonify({'error': 'Expected {"model_path": ..., "sample_rate": (0, 1]}'}), 400
+        in_background(fraud_api.start_shadow, payload['model_path'], sample_rate)
+        return jsonify({'status': 'loading', 'model_path': payload['model_path']}), 202
+
     return app
 
+# ---------------------------
+# Multi-process Serving
+# ---------------------------
+def _share_tensor(tensor):
+    """Move one tensor's storage to shared memory; returns the bytes moved."""
+    if tensor.is_shared():
+        return 0
+    try:
+        tensor.share_memory_()
+    except RuntimeError:
+        # Storage we can't move (e.g. a mapped graph cache file) is shared through the page cache anyway
+        return 0
+    return tensor.numel() * tensor.element_size()
+
+def share_serving_memory(fraud_api):
+    """Move model weights and resident graph tensors to shared memory before forking workers."""
+    shared = sum(_share_tensor(tensor) for tensor in
+                 list(fraud_api.model.parameters()) + list(fraud_api.model.buffers()))
+    if fraud_api.graph is not None:
+        for store in fraud_api.graph.stores:
+            shared += sum(_share_tensor(value) for value in store.values() if isinstance(value, torch.Tensor))
+    return shared
+
+def serve_prefork(app, host='0.0.0.0', port=5000, workers=2, torch_threads=None, metrics_interval=1.0):
+    """Serve app from `workers` forked processes accepting on one listening socket.
+
+    The model and resident graph are loaded once in the parent and moved to shared
+    memory before forking, so an extra worker costs little beyond its interpreter.
+    Each worker runs torch with torch_threads intra-op threads (default: cores / workers).
+    Workers that die are restarted; SIGINT/SIGTERM stops them all.
+
+    /metrics reports all workers: each publishes a snapshot to a shared temporary directory
+    every metrics_interval seconds (and on every scrape it serves), and the scraped worker
+    merges them, so the other workers' figures can be up to metrics_interval old.
+    """
+    import shutil
+    import tempfile
+    from werkzeug.serving import make_server
+    if not hasattr(os, 'fork'):
+        raise RuntimeError("Multi-process serving needs os.fork")
+    torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // workers)
+    fraud_api = getattr(app, 'fraud_api', None)
+    if isinstance(fraud_api, FraudDetectionAPI):
+        if fraud_api.append_scored_orders:
+            raise ValueError("append_scored_orders needs a single serving process; "
+                             "each worker would grow its own copy of the graph")
+        if fraud_api.velocity is not None:
+            print("Warning: velocity features are counted per worker; route a user's orders to one worker "
+                  "or serve with --workers 1 for exact counts")
+        shared = share_serving_memory(fraud_api)
+        print(f"Moved {shared / 2 ** 20:.1f} MiB of model and graph tensors to shared memory")
+
+    # Admin reload/shadow would only reach the worker that accepts the request, so they refuse
+    app.config['PREFORK_WORKERS'] = workers
+    registry = getattr(app, 'metrics', None)
+    metrics_dir = tempfile.mkdtemp(prefix='fraud-metrics-') if registry is not None else None
+    app.config['PREFORK_METRICS_DIR'] = metrics_dir
+    server = make_server(host, port, app, threaded=True)
+    # Objects that exist now are never collected, so the GC doesn't dirty (and copy) their pages
+    gc.collect()
+    gc.freeze()
+
+    children = set()
+    stopping = False
+
+    def publish_metrics():
+        while True:
+            try:
+                write_metrics_snapshot(registry, metrics_dir)
+            except OSError as e:
+                print(f"Could not publish metrics snapshot: {e}")
+            time.sleep(metrics_interval)
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            torch.set_num_threads(torch_threads)
+            if metrics_dir:
+                threading.Thread(target=publish_metrics, name='metrics-snapshot', daemon=True).start()
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print(f"Serving on http://{host}:{port} with {workers} workers x {torch_threads} torch threads")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if metrics_dir:
+            # Keep the exited worker's counters in the totals but stop reporting its gauges
+            snapshot_path = os.path.join(metrics_dir, f'{pid}.json')
+            if os.path.exists(snapshot_path):
+                os.replace(snapshot_path, os.path.join(metrics_dir, f'{pid}.exited-{time.time_ns()}.json'))
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}; restarting")
+            spawn()
+    server.server_close()
+    if metrics_dir:
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+# ---------------------------
+# Offline Batch Scoring
+# ---------------------------
+_scoring_api = None
+
+def _init_scoring_worker(model_path, api_kwargs, torch_threads):
+    """Pool initializer: every worker loads the model once."""
+    global _scoring_api
+    torch.set_num_threads(torch_threads)
+    # Chunks arrive with velocity columns computed over the whole file, so no live store
+    _scoring_api = FraudDetectionAPI(model_path, live_velocity=False, **api_kwargs)
+
+def _backfill_velocity(model_path, orders_path, velocity_path, reuse=False, chunk_size=100000,
+                       max_partitions=256):
+    """Velocity features of every row of orders_path, as create_heterograph computes them.
+
+    Events are replayed in time order over the whole file, so the result does not depend
+    on chunking, worker count or resuming, without holding the file in memory: a first
+    pass counts rows and samples timestamps to cut the file into up to max_partitions
+    time ranges of similar size, a second spills each range's events to a temporary
+    file, and each range is then replayed together with the last largest-window of the
+    range before it. Memory is O(rows / max_partitions + chunk_size + one window of events).
+    Features are written into a memory-mapped .npy, which a resumed run reuses.
+    None when the model has no velocity features.
+    """
+    import tempfile
+    manifest = load_model_manifest(model_path) or {}
+    if not set(DataProcessor.velocity_columns()) <= set(manifest.get('feature_columns', {}).get('order', [])):
+        return None
+    if not (reuse and os.path.exists(velocity_path)):
+        processor = DataProcessor(orders_path, None, None)
+        if processor.order_time_column() is None:
+            print(f"Warning: {orders_path} has none of {list(DataProcessor.TIMESTAMP_COLUMNS)}; "
+                  "velocity features are scored as 0")
+            return None
+        num_rows, sample = 0, []
+        for _, _, timestamps, _ in processor.velocity_event_chunks(chunk_size=chunk_size):
+            num_rows += len(timestamps)
+            sample.append(timestamps[::64])
+        sample = np.concatenate(sample) if sample else np.empty(0)
+        sample = sample[~np.isnan(sample)]
+        partitions = int(min(max(1, -(-num_rows // chunk_size)), max_partitions))
+        bounds = np.unique(np.quantile(sample, np.arange(1, partitions) / partitions)) if len(sample) else np.empty(0)
+
+        tmp_path = velocity_path + '.tmp'
+        # Rows without a timestamp are never written and keep the file's zeros, as in velocity_frame
+        velocity = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                             shape=(num_rows, len(DataProcessor.velocity_columns())))
+        columns = ['row', 'time', 'amount', 'user', 'payment']
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(velocity_path))) as spill_dir:
+            spill_paths = [os.path.join(spill_dir, f'{i}.csv') for i in range(len(bounds) + 1)]
+            spills = [open(path, 'w', newline='') for path in spill_paths]
+            try:
+                row = 0
+                for users, payments, timestamps, amounts in processor.velocity_event_chunks(chunk_size=chunk_size):
+                    events = pd.DataFrame({'row': np.arange(row, row + len(timestamps)), 'time': timestamps,
+                                           'amount': amounts, 'user': users, 'payment': payments})
+                    row += len(timestamps)
+                    events = events[~np.isnan(timestamps)]
+                    for i, group in events.groupby(np.searchsorted(bounds, events['time'].to_numpy(), 'right')):
+                        group.to_csv(spills[i], header=False, index=False)
+            finally:
+                for spill in spills:
+                    spill.close()
+
+            store, tail = processor.new_velocity_store(), None
+            for spill_path in spill_paths:
+                part = pd.read_csv(spill_path, header=None, names=columns, dtype={'user': object, 'payment': object})
+                os.remove(spill_path)
+                if part.empty:
+                    continue
+                # Time order with file order for ties, after the window of earlier events that can still count
+                part = part.sort_values(['time', 'row'], kind='stable')
+                events = part if tail is None else pd.concat([tail, part], ignore_index=True)
+                times, amounts = events['time'].to_numpy(), events['amount'].to_numpy()
+                features = np.concatenate([store.replay(events[kind].to_numpy(dtype=object), times, amounts)
+                                           for kind in ('user', 'payment')], axis=1)
+                velocity[part['row'].to_numpy()] = features[len(events) - len(part):]
+                tail = events[times > times[-1] - store.horizon]
+        velocity.flush()
+        del velocity
+        os.replace(tmp_path, velocity_path)
+    return np.load(velocity_path, mmap_mode='r')
+
+SCORE_COLUMNS = ['order_id', 'fraud_probability', 'is_fraud', 'error']
+
+def _score_chunk(chunk, batch_size):
+    results = []
+    for start in range(0, len(chunk), batch_size):
+        records = chunk.iloc[start:start + batch_size].to_dict('records')
+        results.extend(_scoring_api.process_orders(records))
+    # Failed orders keep their row, with an empty probability and the reason in 'error'
+    frame = pd.DataFrame.from_records(results, columns=SCORE_COLUMNS)
+    return frame
+
+def score_orders_file(model_path, orders_path, output_path, user_data_path, payment_data_path,
+                      chunk_size=50000, batch_size=4096, workers=1, checkpoint_path=None, **api_kwargs):
+    """Stream orders_path through the model and write order_id, fraud_probability, is_fraud, error.
+
+    Orders are read chunk by chunk and joined to the user and payment features, and at
+    most 2 * workers chunks are in flight. After
+    every written chunk the checkpoint records the rows done, the input byte offset and
+    the output size; rerunning with the same checkpoint truncates any partial tail and
+    seeks straight to the next unscored row.
+
+    Orders that fail to score are written with an empty probability and the reason in
+    the error column, and counted in the progress lines. Returns (rows scored, rows failed).
+
+    Velocity features are computed up front over the whole file in time order (see
+    _backfill_velocity; saved next to the checkpoint), never from the serving store, so
+    scores do not depend on workers or resumes. Memory is bounded by chunk_size and the
+    backfill's partitions, not by the length of the input.
+    """
+    checkpoint_path = checkpoint_path or output_path + '.ckpt'
+    rows_done, output_bytes, input_offset, failed = 0, 0, None, 0
+    header_line = ','.join(SCORE_COLUMNS) + '\n'
+    if os.path.exists(checkpoint_path) and os.path.exists(output_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        with open(output_path) as f:
+            output_header = f.readline()
+        if output_header != header_line:
+            print(f"{output_path} was written without the error column; scoring from the start")
+        elif checkpoint.get('orders_path') == os.path.abspath(orders_path):
+            rows_done, output_bytes = checkpoint['rows_done'], checkpoint['output_bytes']
+            input_offset, failed = checkpoint.get('input_offset'), checkpoint.get('failed', 0)
+            print(f"Resuming from checkpoint: {rows_done} orders already scored")
+
+    # Users and payments are small next to the order history, so they are joined from memory
+    users = pd.read_csv(user_data_path)
+    users = users[['user_id'] + [c for c in DataProcessor.USER_FEATURE_COLUMNS if c in users.columns]]
+    payments = pd.read_csv(payment_data_path, usecols=['payment_id', 'payment_type'])
+    velocity = _backfill_velocity(model_path, orders_path, checkpoint_path + '.velocity.npy',
+                                  reuse=rows_done > 0, chunk_size=chunk_size)
+
+    header = list(pd.read_csv(orders_path, nrows=0).columns)
+
+    def read_chunks():
+        """(chunk, byte offset after it) pairs from the first unscored row, in O(chunk) memory."""
+        with open(orders_path, 'rb') as source:
+            source.readline()
+            if input_offset is not None:
+                source.seek(input_offset)
+            else:
+                # Checkpoints without an offset: skip the scored rows line by line
+                for _ in range(rows_done):
+                    source.readline()
+            while True:
+                lines = list(itertools.islice(source, chunk_size))
+                if not lines:
+                    return
+                yield pd.read_csv(io.BytesIO(b''.join(lines)), header=None, names=header), source.tell()
+
+    def chunks():
+        joined = {'user_id', 'payment_id'}
+        position = rows_done
+        for chunk, offset in read_chunks():
+            # users.csv/payments.csv are the source of truth for the joined feature columns
+            chunk = chunk.drop(columns=[c for c in chunk.columns
+                                        if c not in joined and (c in users.columns or c in payments.columns)])
+            chunk = chunk.merge(users, on='user_id', how='left').merge(payments, on='payment_id', how='left')
+            if velocity is not None:
+                chunk[DataProcessor.velocity_columns()] = np.asarray(velocity[position:position + len(chunk)])
+            position += len(chunk)
+            yield chunk, offset
+
+    torch_threads = max(1, (os.cpu_count() or 1) // max(workers, 1))
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.get_context().Pool(workers, initializer=_init_scoring_worker,
+                                                  initargs=(model_path, api_kwargs, torch_threads))
+    else:
+        _init_scoring_worker(model_path, api_kwargs, torch_threads)
+
+    mode = 'r+' if output_bytes else 'w'
+    start_time, scored = time.perf_counter(), 0
+    with open(output_path, mode, newline='') as out:
+        if output_bytes:
+            out.truncate(output_bytes)
+            out.seek(output_bytes)
+        else:
+            out.write(header_line)
+
+        def write(results, num_rows, offset):
+            nonlocal rows_done, scored, failed
+            results.to_csv(out, header=False, index=False)
+            out.flush()
+            os.fsync(out.fileno())
+            rows_done += num_rows
+            scored += num_rows
+            chunk_failed = int(results['error'].notna().sum())
+            failed += chunk_failed
+            tmp_path = checkpoint_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'orders_path': os.path.abspath(orders_path), 'rows_done': rows_done,
+                           'input_offset': offset, 'output_bytes': out.tell(), 'failed': failed}, f)
+            os.replace(tmp_path, checkpoint_path)
+            elapsed = time.perf_counter() - start_time
+            line = f"Scored {rows_done:,} orders ({scored / max(elapsed, 1e-9):,.0f} orders/sec)"
+            if chunk_failed:
+                first = results['error'].dropna().iloc[0]
+                line += f"; {chunk_failed:,} failed in this chunk ({failed:,} total), e.g. {first}"
+            print(line)
+
+        try:
+            if pool is None:
+                for chunk, offset in chunks():
+                    write(_score_chunk(chunk, batch_size), len(chunk), offset)
+            else:
+                in_flight = deque()
+                for chunk, offset in chunks():
+                    in_flight.append((pool.apply_async(_score_chunk, (chunk, batch_size)), len(chunk), offset))
+                    # Results are written in input order, which keeps the checkpoint a simple row count
+                    while len(in_flight) >= 2 * workers:
+                        result, num_rows, offset = in_flight.popleft()
+                        write(result.get(), num_rows, offset)
+                while in_flight:
+                    result, num_rows, offset = in_flight.popleft()
+                    write(result.get(), num_rows, offset)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Finished: {rows_done:,} orders in {output_path} "
+          f"({scored / max(elapsed, 1e-9):,.0f} orders/sec this run)")
+    if failed:
+        print(f"{failed:,} orders failed to score; see the error column of {output_path}")
+    return rows_done, failed
+
+# ---------------------------
+# Stream Processing
+# ---------------------------
+class OrderStreamProcessor:
+    """Scores a JSONL stream of orders in batches and writes one JSON decision per line.
+
+    A reader task feeds a bounded queue (so a slow model pushes back on the reader), a
+    scorer task groups up to batch_size orders or max_wait_ms into one process_orders()
+    call, and a writer task appends the decisions to sink_path. With an API created
+    with append_scored_orders=True every scored order is also added to the resident
+    graph through DataProcessor.append().
+
+    After each written batch the checkpoint records the input byte offset and sink size.
+    A restart truncates any unrecorded sink tail and re-reads from the recorded offset,
+    so every order is emitted at least once; readers of a live sink may see the
+    truncated tail twice.
+
+    The API rebuilds its velocity store and graph from orders.csv on start, so before
+    resuming the already-emitted orders are replayed into them (without emitting)
+    through FraudDetectionAPI.replay_orders(). The checkpoint also records the offset of
+    the oldest event still inside the largest velocity window, so the velocity replay
+    does not grow with the stream's history. With graph_snapshot_interval (seconds) the
+    resident graph is saved next to the checkpoint, alternating between two slots, and
+    a restart loads the newest snapshot the checkpoint covers and replays only the
+    orders after it; without snapshots the graph replay starts at the beginning.
+    """
+
+    def __init__(self, fraud_api, source_path, sink_path, checkpoint_path=None, batch_size=256, max_wait_ms=20.0,
+                 max_pending=10000, follow=False, poll_interval=0.5, report_interval=10.0,
+                 graph_snapshot_interval=None):
+        self.fraud_api = fraud_api
+        self.source_path = source_path
+        self.sink_path = sink_path
+        self.checkpoint_path = checkpoint_path or sink_path + '.ckpt'
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_pending = max_pending
+        # follow=True keeps tailing the source for new lines instead of stopping at its end
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.report_interval = report_interval
+        self.graph_snapshot_interval = graph_snapshot_interval
+        self._snapshot_slot = 0
+        self._last_snapshot = time.monotonic()
+        # (start offset, latest event time) per written batch still inside the largest velocity window
+        self._velocity_marks = deque()
+        self._latest_event_time = -np.inf
+        self.consumed = 0
+        self.emitted = 0
+        self.errors = 0
+        self.offset = 0
+        self._lags = deque(maxlen=10000)
+        self._event_lags = deque(maxlen=10000)
+        self._start = None
+        # One scoring thread keeps batches (and graph appends) in stream order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stream-scorer')
+        self._lag_seconds = fraud_api.metrics.histogram(
+            'fraud_stream_lag_seconds', 'Seconds from reading (ingest) or placing (event) an order to its decision',
+            ('kind',), buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+
+    def _load_checkpoint(self):
+        if not (os.path.exists(self.checkpoint_path) and os.path.exists(self.sink_path)):
+            return 0, 0, 0
+        with open(self.checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('source_path') != os.path.abspath(self.source_path):
+            return 0, 0, 0
+        print(f"Resuming stream from byte {checkpoint['offset']:,} of {self.source_path}")
+        # Checkpoints without a velocity offset replay the velocity store from the start
+        return checkpoint['offset'], checkpoint['output_bytes'], checkpoint.get('velocity_offset', 0)
+
+    def _commit(self, sink, offset):
+        sink.flush()
+        os.fsync(sink.fileno())
+        tmp_path = self.checkpoint_path + '.tmp'
+        velocity_offset = self._velocity_marks[0][0] if self._velocity_marks else offset
+        with open(tmp_path, 'w') as f:
+            json.dump({'source_path': os.path.abspath(self.source_path), 'offset': offset,
+                       'output_bytes': sink.tell(), 'velocity_offset': velocity_offset}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _mark_events(self, start, event_times):
+        """Track where the velocity window begins in the source, for the next restart."""
+        velocity = self.fraud_api.velocity
+        if velocity is None:
+            return
+        event_times = [t for t in event_times if t is not None and t == t]
+        if event_times:
+            self._latest_event_time = max(self._latest_event_time, max(event_times))
+            self._velocity_marks.append((start, max(event_times)))
+        while self._velocity_marks and self._velocity_marks[0][1] <= self._latest_event_time - velocity.horizon:
+            self._velocity_marks.popleft()
+
+    def _snapshot_dirs(self):
+        return [f'{self.checkpoint_path}.graph{slot}' for slot in (0, 1)]
+
+    def _maybe_snapshot(self, offset):
+        """Save the resident graph every graph_snapshot_interval seconds (on the scoring thread)."""
+        api = self.fraud_api
+        if (not self.graph_snapshot_interval or not api.append_scored_orders
+                or time.monotonic() - self._last_snapshot < self.graph_snapshot_interval):
+            return
+        # Alternate slots: the writer may not have committed up to this offset yet, and a
+        # restart can then fall back to the other, older snapshot
+        directory = self._snapshot_dirs()[self._snapshot_slot]
+        self._snapshot_slot ^= 1
+        api.save_graph_snapshot(directory, source_path=os.path.abspath(self.source_path), offset=offset)
+        self._last_snapshot = time.monotonic()
+
+    def _restore(self, offset, velocity_offset):
+        """Re-apply the emitted part of the source to the velocity store and graph; returns the orders replayed."""
+        api = self.fraud_api
+        if not offset:
+            return 0
+        graph_offset = offset
+        if api.append_scored_orders:
+            graph_offset = 0
+            snapshots = []
+            for directory in self._snapshot_dirs():
+                info = api.graph_snapshot_info(directory)
+                if (info and info.get('source_path') == os.path.abspath(self.source_path)
+                        and info.get('offset', offset + 1) <= offset):
+                    snapshots.append((info['offset'], directory))
+            for snapshot_offset, directory in sorted(snapshots, reverse=True):
+                if api.load_graph_snapshot(directory) is not None:
+                    print(f"Loaded graph snapshot {directory} (stream byte {snapshot_offset:,})")
+                    graph_offset = snapshot_offset
+                    break
+        if api.velocity is None:
+            velocity_offset = offset
+        start = min(graph_offset, velocity_offset)
+        if start >= offset:
+            return 0
+
+        restored, position = 0, start
+        with open(self.source_path, 'rb') as source:
+            source.seek(start)
+            while position < offset:
+                lines = source.readlines(1 << 20)
+                if not lines:
+                    break
+                chunk_start = position
+                # Orders before graph_offset are already in the loaded snapshot
+                before, after = [], []
+                for line in lines:
+                    # Checkpoint offsets are line boundaries; stop at the first line past it
+                    if position + len(line) > offset:
+                        position = offset
+                        break
+                    line_start, position = position, position + len(line)
+                    try:
+                        order_data = json.loads(line) if line.strip() else None
+                    except ValueError:
+                        continue
+                    if isinstance(order_data, dict) and 'order_id' in order_data:
+                        (after if line_start >= graph_offset else before).append(order_data)
+                for orders, graph in ((before, False), (after, True)):
+                    if orders:
+                        restored += api.replay_orders(orders, graph=graph)
+                if before or after:
+                    timestamps = api.data_processor.order_timestamps(pd.DataFrame.from_records(before + after))
+                    if timestamps is not None:
+                        self._mark_events(chunk_start, timestamps.tolist())
+        print(f"Replayed {restored:,} already-emitted orders into the velocity store and graph")
+        return restored
+
+    async def _read(self, pending, offset):
+        loop = asyncio.get_running_loop()
+        with open(self.source_path, 'rb') as source:
+            source.seek(offset)
+            partial = b''
+            while True:
+                lines = await loop.run_in_executor(None, source.readlines, 1 << 20)
+                if not lines:
+                    if not self.follow:
+                        break
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                for line in lines:
+                    if self.follow and not line.endswith(b'\n'):
+                        # The producer is mid-write; the rest of the line comes with the next read
+                        partial += line
+                        continue
+                    line, partial = partial + line, b''
+                    offset += len(line)
+                    await pending.put((offset, time.time(), line))
+        await pending.put(None)
+
+    def _score_batch(self, batch):
+        """Decisions (None for blank lines) and event timestamps for a batch of raw lines."""
+        results, event_times, orders, rows = [None] * len(batch), [None] * len(batch), [], []
+        for i, (_, _, line) in enumerate(batch):
+            if not line.strip():
+                continue
+            try:
+                order_data = json.loads(line)
+            except ValueError as e:
+                order_data = {'error': f'Invalid JSON: {e}'}
+            if not isinstance(order_data, dict) or 'order_id' not in order_data:
+                error = order_data.get('error') if isinstance(order_data, dict) else None
+                results[i] = {'error': error or 'Missing order_id field', 'fraud_probability': None,
+                              'is_fraud': None, 'order_id': None}
+                continue
+            orders.append(order_data)
+            rows.append(i)
+        if orders:
+            for i, result in zip(rows, self.fraud_api.process_orders(orders)):
+                results[i] = result
+            timestamps = self.fraud_api.data_processor.order_timestamps(pd.DataFrame.from_records(orders))
+            if timestamps is not None:
+                for i, timestamp in zip(rows, timestamps.tolist()):
+                    event_times[i] = timestamp if timestamp == timestamp else None
+        self._maybe_snapshot(batch[-1][0])
+        return results, event_times
+
+    async def _score(self, pending, scored):
+        loop = asyncio.get_running_loop()
+        done = False
+        while not done:
+            item = await pending.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                # Polled rather than wait_for(get()), which can drop an item when it times out
+                try:
+                    item = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    await asyncio.sleep(min(remaining, 0.001))
+                    continue
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+            self.consumed += len(batch)
+            results, event_times = await loop.run_in_executor(self._executor, self._score_batch, batch)
+            await scored.put((batch, results, event_times))
+        await scored.put(None)
+
+    def _emit(self, sink, batch, results, event_times):
+        now = time.time()
+        lines = []
+        for (_, received, _), result, event_time in zip(batch, results, event_times):
+            if result is None:
+                continue
+            lines.append(json.dumps(result) + '\n')
+            if result.get('error') is not None:
+                self.errors += 1
+            self._lags.append(now - received)
+            self._lag_seconds.observe(now - received, kind='ingest')
+            if event_time is not None:
+                self._event_lags.append(now - event_time)
+                self._lag_seconds.observe(max(now - event_time, 0.0), kind='event')
+        sink.write(''.join(lines))
+        first_offset, _, first_line = batch[0]
+        self._mark_events(first_offset - len(first_line), event_times)
+        self._commit(sink, batch[-1][0])
+        self.emitted += len(lines)
+        self.offset = batch[-1][0]
+
+    async def _write(self, scored, output_bytes):
+        loop = asyncio.get_running_loop()
+        with open(self.sink_path, 'r+' if output_bytes else 'w') as sink:
+            if output_bytes:
+                sink.truncate(output_bytes)
+                sink.seek(output_bytes)
+            while True:
+                item = await scored.get()
+                if item is None:
+                    break
+                await loop.run_in_executor(None, self._emit, sink, *item)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.print_stats()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._start if self._start is not None else 0.0
+        stats = {'consumed': self.consumed, 'emitted': self.emitted, 'errors': self.errors, 'offset': self.offset,
+                 'orders_per_sec': self.emitted / max(elapsed, 1e-9)}
+        for name, lags in (('lag', self._lags), ('event_lag', self._event_lags)):
+            if lags:
+                stats[f'{name}_p50_ms'] = float(np.percentile(lags, 50)) * 1000
+                stats[f'{name}_p99_ms'] = float(np.percentile(lags, 99)) * 1000
+        return stats
+
+    def print_stats(self):
+        stats = self.stats()
+        line = f"Stream: {stats['emitted']:,} decisions ({stats['orders_per_sec']:,.0f} orders/sec)"
+        if 'lag_p99_ms' in stats:
+            line += f", lag p50 {stats['lag_p50_ms']:.1f}ms p99 {stats['lag_p99_ms']:.1f}ms"
+        if 'event_lag_p99_ms' in stats:
+            line += f", event lag p99 {stats['event_lag_p99_ms'] / 1000:.1f}s"
+        print(line)
+
+    async def run(self):
+        """Process the stream until the source ends (never, with follow=True); returns stats()."""
+        offset, output_bytes, velocity_offset = self._load_checkpoint()
+        self.offset = offset
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._restore, offset, velocity_offset)
+        self._start = time.perf_counter()
+        # Bounded queues are the backpressure: a slow model stalls the reader, a slow sink the scorer
+        pending = asyncio.Queue(maxsize=self.max_pending)
+        scored = asyncio.Queue(maxsize=4)
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in
+                 (self._read(pending, offset), self._score(pending, scored), self._write(scored, output_bytes))]
+        reporter = asyncio.ensure_future(self._report())
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks + [reporter]:
+                task.cancel()
+        self.print_stats()
+        return self.stats()
+
+# ---------------------------
+# Synthetic Data
+# ---------------------------
+def _random_ips(rng, n):
+    octets = [pd.Series(column) for column in rng.integers(1, 255, size=(4, n)).astype(str)]
+    return octets[0] + '.' + octets[1] + '.' + octets[2] + '.' + octets[3]
+
+def generate_synthetic_data(output_dir, num_users=100000, num_orders=1000000, fraud_rate=0.02,
+                            num_rings=100, ring_size=8, days=90, chunk_size=1000000, seed=0):
+    """Write users.csv, payments.csv and orders.csv in the production schema, chunk by chunk.
+
+    Orders per user follow a power law (Pareto activity weights) and users hold one to
+    five payment instruments. Fraud rings are groups of ring_size users sharing a
+    registration IP, device and email domain whose cards share card_last4; their orders
+    are fraudulent with probability 0.7. Other orders are fraudulent at fraud_rate and
+    fraud orders skew to larger amounts and baskets. Memory stays O(users + chunk_size).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    start_time = time.perf_counter()
+
+    # Per-user state needed to write orders later: activity weight, payments and ring
+    activity = rng.pareto(1.2, num_users) + 1
+    activity_cdf = np.cumsum(activity) / activity.sum()
+    payments_per_user = np.minimum(rng.geometric(0.55, num_users), 5)
+    payment_offsets = np.concatenate([[0], np.cumsum(payments_per_user)])
+    ring_of_user = np.full(num_users, -1, dtype=np.int64)
+    num_rings = min(num_rings, num_users // max(ring_size, 1))
+    ring_members = rng.choice(num_users, num_rings * ring_size, replace=False)
+    ring_of_user[ring_members] = np.repeat(np.arange(num_rings), ring_size)
+    ring_ips = _random_ips(rng, num_rings).to_numpy()
+    ring_cards = rng.integers(0, 10000, num_rings)
+
+    locations = np.array(['United States', 'United Kingdom', 'Germany', 'France', 'India', 'Brazil',
+                          'Canada', 'Nigeria', 'Japan', 'Australia', 'Mexico', 'Spain'])
+    location_weights = rng.dirichlet(np.ones(len(locations)))
+    domains = np.array(['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'icloud.com', 'aol.com'])
+    domain_weights = np.array([0.5, 0.15, 0.12, 0.1, 0.08, 0.05])
+    devices = np.array(['mobile', 'desktop', 'tablet'])
+    payment_types = np.array(['credit_card', 'debit_card', 'paypal', 'bank_transfer'])
+
+    for start in range(0, num_users, chunk_size):
+        users = np.arange(start, min(start + chunk_size, num_users))
+        n = len(users)
+        ring = ring_of_user[users]
+        in_ring = ring >= 0
+        ips = _random_ips(rng, n).to_numpy()
+        ips[in_ring] = ring_ips[ring[in_ring]]
+        device = rng.choice(devices, n, p=[0.6, 0.3, 0.1])
+        device[in_ring] = devices[ring[in_ring] % len(devices)]
+        domain = rng.choice(domains, n, p=domain_weights).astype(object)
+        domain[in_ring] = 'mail' + ring[in_ring].astype(str).astype(object) + '.example'
+        frame = pd.DataFrame({
+            'user_id': users + 1,
+            'account_age_days': np.where(in_ring, rng.integers(1, 60, n), rng.integers(1, 3000, n)),
+            'total_past_orders': np.minimum(rng.poisson(activity[users] * 3), 5000),
+            'age': rng.integers(18, 80, n),
+            'location': rng.choice(locations, n, p=location_weights),
+            'email_domain': domain,
+            'registration_device': device,
+            'registration_ip': ips,
+            'last_login_days_ago': rng.integers(0, 365, n),
+        })
+        frame.to_csv(os.path.join(output_dir, 'users.csv'), mode='w' if start == 0 else 'a',
+                     header=start == 0, index=False)
+
+        counts = payments_per_user[users]
+        owner = np.repeat(users, counts)
+        m = len(owner)
+        last4 = rng.integers(0, 10000, m).astype(float)
+        owner_ring = ring_of_user[owner]
+        last4[owner_ring >= 0] = ring_cards[owner_ring[owner_ring >= 0]]
+        last4[rng.random(m) < 0.1] = np.nan
+        frame = pd.DataFrame({
+            'payment_id': np.arange(payment_offsets[users[0]], payment_offsets[users[-1] + 1]) + 1,
+            'user_id': owner + 1,
+            'payment_type': rng.choice(payment_types, m, p=[0.45, 0.3, 0.2, 0.05]),
+            'is_verified': rng.random(m) < 0.85,
+            'payment_age_days': rng.integers(0, 1500, m),
+            'card_last4': pd.array(last4, dtype='Int64'),
+            'is_international': rng.random(m) < 0.1,
+        })
+        frame.to_csv(os.path.join(output_dir, 'payments.csv'), mode='w' if start == 0 else 'a',
+                     header=start == 0, index=False)
+
+    epoch_start = pd.Timestamp('2024-01-01').value // 10**9
+    fraud_total = 0
+    for start in range(0, num_orders, chunk_size):
+        n = min(chunk_size, num_orders - start)
+        user = np.minimum(np.searchsorted(activity_cdf, rng.random(n)), num_users - 1)
+        payment = payment_offsets[user] + (rng.random(n) * payments_per_user[user]).astype(np.int64)
+        ring = ring_of_user[user]
+        is_fraud = np.where(ring >= 0, rng.random(n) < 0.7, rng.random(n) < fraud_rate)
+        fraud_total += int(is_fraud.sum())
+        # Orders are written in time order, each chunk covering its slice of the period
+        offsets = np.sort(rng.uniform(start, start + n, n)) / num_orders * days * 86400
+        frame = pd.DataFrame({
+            'order_id': np.arange(start, start + n) + 1,
+            'user_id': user + 1,
+            'payment_id': payment + 1,
+            'order_amount': np.round(rng.lognormal(np.where(is_fraud, 5.0, 3.8), 0.8), 2),
+            'num_items': np.where(is_fraud, rng.integers(2, 15, n), rng.integers(1, 8, n)),
+            'timestamp': pd.to_datetime(epoch_start + offsets, unit='s').strftime('%Y-%m-%dT%H:%M:%S'),
+            'is_fraud': is_fraud.astype(np.int8),
+        })
+        frame.to_csv(os.path.join(output_dir, 'orders.csv'), mode='w' if start == 0 else 'a',
+                     header=start == 0, index=False)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Synthetic data in {output_dir}: {num_users:,} users, {int(payment_offsets[-1]):,} payments, "
+          f"{num_orders:,} orders ({fraud_total / max(num_orders, 1):.2%} fraud, {num_rings} rings) "
+          f"in {elapsed:.1f}s")
+    return {'users': num_users, 'payments': int(payment_offsets[-1]), 'orders': num_orders,
+            'fraud_orders': fraud_total, 'rings': num_rings}
+
+# ---------------------------
+# Benchmarks
+# ---------------------------
+def _peak_rss_mb():
+    """Peak resident set size of this process, or None where resource is unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def _git_revision():
+    import subprocess
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_benchmarks(data_dir, output_path=None, epochs=2, batch_size=None, predict_requests=500,
+                   score_orders=100000, score_batch_size=1024, inference_mode='neighborhood'):
+    """Time graph construction, training, /predict latency and batch scoring on data_dir.
+
+    Results are one JSON document (stable key order) so runs can be diffed between
+    commits. Peak memory is tracemalloc's peak (Python and numpy allocations) for
+    graph construction and the process peak RSS at the end of each stage.
+    """
+    import tempfile
+    results = {
+        'timestamp': pd.Timestamp.now(tz='UTC').isoformat(),
+        'git_revision': _git_revision(),
+        'versions': {'python': sys.version.split()[0], 'torch': torch.__version__, 'numpy': np.__version__,
+                     'pandas': pd.__version__},
+        'cpu_count': os.cpu_count(),
+        'torch_threads': torch.get_num_threads(),
+    }
+    paths = [os.path.join(data_dir, name) for name in ('orders.csv', 'users.csv', 'payments.csv')]
+
+    # Graph construction, from CSV (no cache)
+    data_processor = DataProcessor(*paths)
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = data_processor.create_heterograph()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results['graph'] = {
+        'seconds': elapsed,
+        'traced_peak_mb': peak / 2**20,
+        'peak_rss_mb': _peak_rss_mb(),
+        'nodes': {node_type: int(data[node_type].num_nodes) for node_type in data.node_types},
+        'edges': int(sum(data[edge_type].edge_index.size(1) for edge_type in data.edge_types)),
+    }
+    print(f"Graph: {elapsed:.2f}s, traced peak {peak / 2**20:.0f} MB")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Training epochs
+        data = data_processor.split_data(data, random_state=42)
+        metadata = ({node_type: data[node_type].x.size(1) for node_type in data.node_types}, data.edge_types)
+        model_path = os.path.join(tmp_dir, 'bench_model.pt')
+        model = FraudDetectionHGNN(hidden_channels=64, out_channels=1, metadata=metadata)
+        trainer = FraudDetectionTrainer(model, data, model_path=model_path, batch_size=batch_size)
+        epoch_seconds_list = []
+        for epoch in range(epochs):
+            start = time.perf_counter()
+            trainer._train_step()
+            epoch_seconds_list.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        val_loss = trainer.evaluate(mode='val')
+        eval_seconds = time.perf_counter() - start
+        trainer.checkpointer.save(trainer.model, trainer.optimizer, epochs - 1, is_best=True)
+        trainer.checkpointer.flush()
+        save_model_manifest(model_path, metadata, 64, feature_vocab=data_processor.feature_vocab,
+                            feature_columns=data_processor.feature_columns)
+        results['train'] = {
+            'mode': 'full-graph' if batch_size is None else f'mini-batch ({batch_size})',
+            'epoch_seconds': epoch_seconds_list,
+            'mean_epoch_seconds': float(np.mean(epoch_seconds_list)) if epoch_seconds_list else None,
+            'eval_seconds': eval_seconds,
+            'val_loss': val_loss,
+            'peak_rss_mb': _peak_rss_mb(),
+        }
+        print(f"Training: {results['train']['mean_epoch_seconds']}s/epoch, eval {eval_seconds:.2f}s")
+        del trainer, data
+
+        # /predict latency through the Flask stack, one request at a time
+        sample = pd.read_csv(paths[0], nrows=max(predict_requests, 1) + 50)
+        sample = sample.drop(columns=['is_fraud']).merge(
+            pd.read_csv(paths[1]), on='user_id', how='left').merge(
+            pd.read_csv(paths[2]).drop(columns=['user_id']), on='payment_id', how='left')
+        records = json.loads(sample.to_json(orient='records'))
+        app = create_fraud_detection_app(model_path, data_processor, inference_mode=inference_mode)
+        client = app.test_client()
+        latencies = []
+        for i in range(predict_requests + 50):
+            start = time.perf_counter()
+            response = client.post('/predict', json=records[i % len(records)])
+            if i >= 50:  # the first requests warm up caches and allocators
+                latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f"/predict failed during benchmark: {response.get_json()}")
+        results['predict'] = {
+            'inference_mode': inference_mode,
+            'requests': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50)) if latencies else None,
+            'p99_ms': float(np.percentile(latencies, 99)) if latencies else None,
+        }
+        print(f"/predict: p50 {results['predict']['p50_ms']}ms, p99 {results['predict']['p99_ms']}ms")
+
+        # Offline batch scoring throughput
+        output_path_csv = os.path.join(tmp_dir, 'scores.csv')
+        orders_path = os.path.join(tmp_dir, 'orders.csv')
+        pd.read_csv(paths[0], nrows=score_orders).to_csv(orders_path, index=False)
+        start = time.perf_counter()
+        rows, _ = score_orders_file(model_path, orders_path, output_path_csv, paths[1], paths[2],
+                                    batch_size=score_batch_size, inference_mode=inference_mode,
+                                    data_processor=data_processor)
+        elapsed = time.perf_counter() - start
+        results['batch_scoring'] = {
+            'orders': rows,
+            'batch_size': score_batch_size,
+            'seconds': elapsed,
+            'orders_per_sec': rows / max(elapsed, 1e-9),
+            'peak_rss_mb': _peak_rss_mb(),
+        }
+        print(f"Batch scoring: {results['batch_scoring']['orders_per_sec']:,.0f} orders/sec")
+
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Benchmark results written to {output_path}")
+    return results
+
 # ---------------------------
 # Main Application
 # ---------------------------
-def main():
+def export_model(args, model_path, data_processor):
+    """Export the trained model and gate on AUC/AP parity against the eager model."""
+    data = data_processor.split_data(data_processor.create_heterograph(), random_state=42)
+    metadata = (
+        {node_type: data[node_type].x.size(1) for node_type in data.node_types},
+        data.edge_types
+    )
+    manifest = load_model_manifest(model_path) or {}
+    hidden_channels = manifest.get('hidden_channels', 64)
+    model = FraudDetectionHGNN(hidden_channels=hidden_channels, out_channels=1, metadata=metadata)
+    model.load_state_dict(torch.load(model_path, map_location='cpu'))
+    model.eval()
+
+    # Trace on one sampled neighborhood, verify on a smaller one; small test sets fall back to all orders
+    seeds = data['order'].test_mask.nonzero().view(-1).numpy()
+    if len(seeds) < 3:
+        seeds = np.arange(data['order'].num_nodes)
+    if len(seeds) < 3:
+        raise ValueError("Export needs at least 3 orders to check the traced artifact")
+    large = min(64, len(seeds) - 1)
+    small = max(1, min(7, large // 2))
+    sampler = HeteroNeighborSampler(data, [10, 10], seed=0)
+    example_graphs = [sampler.subgraph({'order': seeds[:large]}),
+                      sampler.subgraph({'order': seeds[large:large + small]})]
+    feature_vocab = manifest.get('feature_vocab', data_processor.feature_vocab)
+    feature_columns = manifest.get('feature_columns', data_processor.feature_columns)
+
+    # Export next to the deploy path and only move it there once the parity gate passes
+    root, ext = os.path.splitext(args.output)
+    staging_path = f'{root}.staging{ext}'
+    staged = [staging_path, model_manifest_path(staging_path)]
+    try:
+        artifact_format = export_inference_artifact(model, metadata, example_graphs, staging_path,
+                                                    quantize=not args.no_quantize, hidden_channels=hidden_channels,
+                                                    feature_vocab=feature_vocab, feature_columns=feature_columns)
+        artifact = load_inference_artifact(staging_path, load_model_manifest(staging_path))
+        report = check_artifact_parity(model, artifact, data)
+        if report['auc_delta'] < -args.max_auc_drop:
+            print(f"AUC dropped by {-report['auc_delta']:.4f} (> {args.max_auc_drop}); "
+                  f"not deploying to {args.output}.")
+            sys.exit(1)
+        os.replace(staging_path, args.output)
+        save_model_manifest(args.output, metadata, hidden_channels, feature_vocab=feature_vocab,
+                            feature_columns=feature_columns,
+                            extra={'artifact_format': artifact_format, 'quantized': not args.no_quantize,
+                                   'parity': report})
+        print(f"Artifact passed the parity gate and is at {args.output}")
+    finally:
+        for path in staged:
+            if os.path.exists(path):
+                os.remove(path)
+
+def parse_args(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = argparse.ArgumentParser(description="HGNN fraud detection system")
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'),
+                        help="Directory holding orders.csv, users.csv and payments.csv")
+    parser.add_argument('--model-path', default='best_fraud_model.pt',
+                        help="Model weights; its manifest is stored alongside as .json")
+    parser.add_argument('--no-graph-cache', action='store_true',
+                        help="Always rebuild the graph from CSV instead of using <data-dir>/.graph_cache")
+    parser.add_argument('--csv-engine', choices=['c', 'pyarrow'], default=None,
+                        help="CSV parser for graph construction (pyarrow is multi-threaded; needs pyarrow)")
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help="Train the model and start the Flask API (default)")
+    run_parser.add_argument('--epochs', type=int, default=20)
+    run_parser.add_argument('--patience', type=int, default=5)
+    run_parser.add_argument('--batch-size', type=int, default=None,
+                            help="Train on sampled neighborhoods of this many orders (default: full graph)")
+    run_parser.add_argument('--num-neighbors', type=int, nargs='+', default=[10, 10],
+                            help="Per-hop fanout for mini-batch training")
+    run_parser.add_argument('--num-workers', type=int, default=0,
+                            help="Sampling worker processes for mini-batch training")
+    run_parser.add_argument('--train-processes', type=int, default=1,
+                            help="Data-parallel CPU training processes (needs --batch-size)")
+    run_parser.add_argument('--profile-log', default=None,
+                            help="Append per-epoch phase/layer timings and peak memory to this JSONL file")
+    run_parser.add_argument('--profile-trace', default=None,
+                            help="Write a Chrome trace-event file of training phases and layers")
+    run_parser.add_argument('--checkpoint-dir', default=None,
+                            help="Epoch checkpoints for resuming (default: <model-path>_checkpoints)")
+    run_parser.add_argument('--keep-checkpoints', type=int, default=3, help="Epoch checkpoints to keep")
+    run_parser.add_argument('--resume-from', default=None,
+                            help="Checkpoint to resume training from, or 'latest'")
+    serve_parser = subparsers.add_parser('serve', help="Start the Flask API from a saved model and manifest")
+    serve_parser.add_argument('--inference-mode', choices=['minigraph', 'neighborhood'], default='minigraph',
+                              help="Score orders in isolation or attached to the resident training graph")
+    serve_parser.add_argument('--fanout', type=int, nargs='+', default=[20],
+                              help="Per-hop neighbor fanout around the order's user/payment nodes")
+    serve_parser.add_argument('--latency-budget-ms', type=float, default=None,
+                              help="p99 latency target; fanout is reduced while it is exceeded")
+    serve_parser.add_argument('--embedding-cache-size', type=int, default=0,
+                              help="Cache user/payment embeddings for this many nodes (neighborhood mode); "
+                                   "cached scores leave out the request order's own edges, an approximation")
+    serve_parser.add_argument('--append-scored-orders', action='store_true',
+                              help="Add every scored order to the resident graph (neighborhood mode)")
+    serve_parser.add_argument('--micro-batching', action='store_true',
+                              help="Coalesce concurrent /predict requests into batched forward passes")
+    serve_parser.add_argument('--max-batch-size', type=int, default=64,
+                              help="Largest micro-batch scored in one forward pass")
+    serve_parser.add_argument('--max-wait-ms', type=float, default=3.0,
+                              help="How long the micro-batcher waits to fill a batch")
+    serve_parser.add_argument('--velocity-max-keys', type=int, default=100000,
+                              help="Users/payments tracked by the velocity feature store before LRU eviction")
+    serve_parser.add_argument('--result-cache-size', type=int, default=0,
+                              help="Cache results for this many (order_id, payload) pairs per worker")
+    serve_parser.add_argument('--result-cache-ttl', type=float, default=30.0,
+                              help="Seconds a cached result is served before the order is rescored")
+    serve_parser.add_argument('--watch-model', type=float, default=None, metavar='SECONDS',
+                              help="Poll --model-path at this interval and hot-reload it when it changes")
+    serve_parser.add_argument('--shadow-model', default=None,
+                              help="Also score a sample of traffic on this model and record score deltas")
+    serve_parser.add_argument('--shadow-rate', type=float, default=0.1, help="Fraction of requests shadow-scored")
+    serve_parser.add_argument('--port', type=int, default=5000)
+    serve_parser.add_argument('--workers', type=int, default=1,
+                              help="Forked serving processes sharing one copy of the model and graph")
+    serve_parser.add_argument('--torch-threads', type=int, default=None,
+                              help="Intra-op torch threads per worker (default: cores / workers)")
+    score_parser = subparsers.add_parser('score', help="Stream an orders file through the saved model")
+    score_parser.add_argument('--orders', required=True, help="Orders CSV to score")
+    score_parser.add_argument('--output', required=True, help="Output CSV (order_id, fraud_probability, is_fraud)")
+    score_parser.add_argument('--checkpoint', default=None, help="Resume checkpoint (default: <output>.ckpt)")
+    score_parser.add_argument('--chunk-size', type=int, default=50000)
+    score_parser.add_argument('--batch-size', type=int, default=4096, help="Orders per forward pass")
+    score_parser.add_argument('--workers', type=int, default=1, help="Scoring worker processes")
+    score_parser.add_argument('--inference-mode', choices=['minigraph', 'neighborhood'], default='minigraph')
+    stream_parser = subparsers.add_parser('stream', help="Score a JSONL order stream and grow the resident graph")
+    stream_parser.add_argument('--input', required=True, help="JSONL file of order events")
+    stream_parser.add_argument('--output', required=True, help="JSONL file the decisions are appended to")
+    stream_parser.add_argument('--checkpoint', default=None, help="Resume checkpoint (default: <output>.ckpt)")
+    stream_parser.add_argument('--follow', action='store_true', help="Keep tailing --input for new orders")
+    stream_parser.add_argument('--batch-size', type=int, default=256, help="Most orders per forward pass")
+    stream_parser.add_argument('--max-wait-ms', type=float, default=20.0, help="How long to wait to fill a batch")
+    stream_parser.add_argument('--max-pending', type=int, default=10000,
+                               help="Orders read ahead of scoring before the reader blocks")
+    stream_parser.add_argument('--inference-mode', choices=['minigraph', 'neighborhood'], default='neighborhood')
+    stream_parser.add_argument('--no-append', action='store_true',
+                               help="Do not add scored orders to the resident graph")
+    stream_parser.add_argument('--report-interval', type=float, default=10.0,
+                               help="Seconds between throughput/lag reports")
+    stream_parser.add_argument('--graph-snapshot-interval', type=float, default=None,
+                               help="Seconds between resident-graph snapshots, so a restart replays only "
+                                    "the orders after the last one")
+    export_parser = subparsers.add_parser('export', help="Export a frozen, optionally int8, inference artifact")
+    export_parser.add_argument('--output', default='fraud_model.ts', help="Artifact path (manifest goes alongside)")
+    export_parser.add_argument('--no-quantize', action='store_true', help="Keep fp32 embedding/output layers")
+    export_parser.add_argument('--max-auc-drop', type=float, default=0.01,
+                               help="Exit non-zero if test AUC drops by more than this vs the eager model")
+    subparsers.add_parser('bench-graph', help="Compare dict-based and vectorized graph construction")
+    generate_parser = subparsers.add_parser('generate', help="Write synthetic users/payments/orders to --data-dir")
+    generate_parser.add_argument('--users', type=int, default=100000)
+    generate_parser.add_argument('--orders', type=int, default=1000000)
+    generate_parser.add_argument('--fraud-rate', type=float, default=0.02, help="Fraud rate outside fraud rings")
+    generate_parser.add_argument('--rings', type=int, default=100, help="Number of fraud rings")
+    generate_parser.add_argument('--ring-size', type=int, default=8, help="Users per fraud ring")
+    generate_parser.add_argument('--days', type=int, default=90, help="Time span of the orders")
+    generate_parser.add_argument('--chunk-size', type=int, default=1000000, help="Rows generated per write")
+    generate_parser.add_argument('--seed', type=int, default=0)
+    bench_parser = subparsers.add_parser('bench', help="Benchmark graph build, training, /predict and batch scoring")
+    bench_parser.add_argument('--output', default='benchmark.json', help="JSON results file")
+    bench_parser.add_argument('--epochs', type=int, default=2)
+    bench_parser.add_argument('--batch-size', type=int, default=None, help="Mini-batch training (default: full graph)")
+    bench_parser.add_argument('--requests', type=int, default=500, help="/predict requests to time")
+    bench_parser.add_argument('--score-orders', type=int, default=100000, help="Orders for the batch scoring run")
+    bench_parser.add_argument('--score-batch-size', type=int, default=1024)
+    bench_parser.add_argument('--inference-mode', choices=['minigraph', 'neighborhood'], default='neighborhood')
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = parser.parse_args(argv + ['run'])
+    if args.command == 'run' and args.train_processes > 1 and args.batch_size is None:
+        run_parser.error("--train-processes needs --batch-size")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
     print("Starting fraud detection system...")
     
-    # File paths: update these paths based on your environment
-    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    # File paths: pass --data-dir to point at your environment
+    data_dir = args.data_dir
     os.makedirs(data_dir, exist_ok=True)
     
     order_data_path = os.path.join(data_dir, 'orders.csv')
     user_data_path = os.path.join(data_dir, 'users.csv')
     payment_data_path = os.path.join(data_dir, 'payments.csv')
+    cache_dir = None if args.no_graph_cache else os.path.join(data_dir, '.graph_cache')
+    model_path = args.model_path
+    # Serving/export must rebuild the graph with the shared attributes the model was trained on
+    manifest = load_model_manifest(model_path) if args.command != 'run' else None
+    shared_attributes = manifest_attribute_types(manifest) if manifest is not None else None
+
+    if args.command == 'generate':
+        generate_synthetic_data(data_dir, num_users=args.users, num_orders=args.orders, fraud_rate=args.fraud_rate,
+                                num_rings=args.rings, ring_size=args.ring_size, days=args.days,
+                                chunk_size=args.chunk_size, seed=args.seed)
+        return
+
+    if args.command == 'score':
+        _, failed = score_orders_file(
+            model_path, args.orders, args.output, user_data_path, payment_data_path,
+            chunk_size=args.chunk_size, batch_size=args.batch_size, workers=args.workers,
+            checkpoint_path=args.checkpoint, inference_mode=args.inference_mode,
+            data_processor=DataProcessor(order_data_path, user_data_path, payment_data_path, cache_dir=cache_dir,
+                                         shared_attributes=shared_attributes, csv_engine=args.csv_engine))
+        if failed:
+            sys.exit(1)
+        return
+
+    if args.command == 'stream':
+        data_processor = DataProcessor(order_data_path, user_data_path, payment_data_path, cache_dir=cache_dir,
+                                       shared_attributes=shared_attributes, csv_engine=args.csv_engine)
+        fraud_api = FraudDetectionAPI(model_path, data_processor, inference_mode=args.inference_mode,
+                                      append_scored_orders=not args.no_append)
+        processor = OrderStreamProcessor(fraud_api, args.input, args.output, checkpoint_path=args.checkpoint,
+                                         batch_size=args.batch_size, max_wait_ms=args.max_wait_ms,
+                                         max_pending=args.max_pending, follow=args.follow,
+                                         report_interval=args.report_interval,
+                                         graph_snapshot_interval=args.graph_snapshot_interval)
+        asyncio.run(processor.run())
+        return
+
+    if args.command == 'serve':
+        if args.workers > 1:
+            # Before the model loads, so the parent never starts a thread pool the workers would inherit
+            torch.set_num_threads(args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers))
+        # With a manifest the model dimensions are known, so the raw data is never read
+        if manifest is None:
+            print(f"Warning: No manifest next to {model_path}; deriving metadata from the data files.")
+        data_processor = DataProcessor(order_data_path, user_data_path, payment_data_path, cache_dir=cache_dir,
+                                       shared_attributes=shared_attributes, csv_engine=args.csv_engine)
+        app = create_fraud_detection_app(model_path, data_processor, inference_mode=args.inference_mode,
+                                         neighborhood_fanout=args.fanout,
+                                         latency_budget_ms=args.latency_budget_ms,
+                                         embedding_cache_size=args.embedding_cache_size,
+                                         append_scored_orders=args.append_scored_orders,
+                                         velocity_max_keys=args.velocity_max_keys,
+                                         result_cache_size=args.result_cache_size,
+                                         result_cache_ttl=args.result_cache_ttl,
+                                         micro_batching=args.micro_batching, max_batch_size=args.max_batch_size,
+                                         max_wait_ms=args.max_wait_ms)
+        if isinstance(app.fraud_api, FraudDetectionAPI):
+            if args.watch_model:
+                app.fraud_api.watch_model(args.watch_model)
+            if args.shadow_model:
+                app.fraud_api.start_shadow(args.shadow_model, args.shadow_rate)
+        if args.workers > 1:
+            serve_prefork(app, port=args.port, workers=args.workers, torch_threads=args.torch_threads)
+        else:
+            app.run(host='0.0.0.0', port=args.port)
+        return
 
     # Check if data files exist
     missing_files = []
@@ -462,14 +4724,33 @@ def main():
         # Create sample data files for demonstration
         create_sample_data(data_dir)
 
+    if args.command == 'export':
+        export_model(args, model_path, DataProcessor(order_data_path, user_data_path, payment_data_path,
+                                                     cache_dir=cache_dir, shared_attributes=shared_attributes,
+                                                     csv_engine=args.csv_engine))
+        return
+
+    if args.command == 'bench':
+        run_benchmarks(data_dir, args.output, epochs=args.epochs, batch_size=args.batch_size,
+                       predict_requests=args.requests, score_orders=args.score_orders,
+                       score_batch_size=args.score_batch_size, inference_mode=args.inference_mode)
+        return
+
+    if args.command == 'bench-graph':
+        DataProcessor(order_data_path, user_data_path, payment_data_path,
+                      csv_engine=args.csv_engine).benchmark_construction()
+        return
+
     try:
         # Initialize DataProcessor
-        data_processor = DataProcessor(order_data_path, user_data_path, payment_data_path)
+        data_processor = DataProcessor(order_data_path, user_data_path, payment_data_path, cache_dir=cache_dir,
+                                       csv_engine=args.csv_engine)
         
         # Create and split the heterogeneous graph
         print("Creating heterogeneous graph...")
         data = data_processor.create_heterograph()
-        data = data_processor.split_data(data)
+        # Fixed seed so a resumed run validates on the same orders
+        data = data_processor.split_data(data, random_state=42)
 
         # Define metadata for HGNN
         metadata = (
@@ -483,12 +4764,20 @@ def main():
         model = FraudDetectionHGNN(hidden_channels=hidden_channels, out_channels=1, metadata=metadata)
         
         print("Training model...")
-        trainer = FraudDetectionTrainer(model, data)
-        trainer.train(epochs=20, patience=5)  # Reduced epochs for faster testing
+        trainer = FraudDetectionTrainer(model, data, model_path=model_path, batch_size=args.batch_size,
+                                        num_neighbors=args.num_neighbors, num_workers=args.num_workers,
+                                        checkpoint_dir=args.checkpoint_dir, keep_checkpoints=args.keep_checkpoints,
+                                        profile_log=args.profile_log, profile_trace=args.profile_trace)
+        if args.train_processes > 1:
+            trainer.train_data_parallel(args.train_processes, epochs=args.epochs, patience=args.patience,
+                                        resume_from=args.resume_from)
+        else:
+            trainer.train(epochs=args.epochs, patience=args.patience, resume_from=args.resume_from)
         test_metrics = trainer.test()
         
-        model_path = 'best_fraud_model.pt'
         print(f"Model saved to {model_path}")
+        save_model_manifest(model_path, metadata, hidden_channels, feature_vocab=data_processor.feature_vocab,
+                            feature_columns=data_processor.feature_columns)
 
         # Start the Flask API
         print("Starting Flask API for fraud detection...")
@@ -502,41 +4791,8 @@ def main():
 
 def create_sample_data(data_dir):
     """Create sample CSV files for demonstration purposes."""
-    # Create sample users data
-    users_data = {
-        'user_id': range(1, 101),
-        'age': np.random.randint(18, 80, 100),
-        'account_age_days': np.random.randint(1, 1500, 100),
-        'total_past_orders': np.random.randint(0, 50, 100)
-    }
-    users_df = pd.DataFrame(users_data)
-    
-    # Create sample payments data
-    payment_types = ['credit_card', 'debit_card', 'paypal', 'bank_transfer']
-    payments_data = {
-        'payment_id': range(1, 101),
-        'payment_type': np.random.choice(payment_types, 100)
-    }
-    payments_df = pd.DataFrame(payments_data)
-    
-    # Create sample orders data (with 5% fraud rate)
-    num_orders = 200
-    orders_data = {
-        'order_id': range(1, num_orders + 1),
-        'user_id': np.random.randint(1, 101, num_orders),
-        'payment_id': np.random.randint(1, 101, num_orders),
-        'order_amount': np.random.uniform(10, 500, num_orders),
-        'num_items': np.random.randint(1, 10, num_orders),
-        'is_fraud': np.random.choice([0, 1], num_orders, p=[0.95, 0.05])
-    }
-    orders_df = pd.DataFrame(orders_data)
-    
-    # Save to CSV
-    users_df.to_csv(os.path.join(data_dir, 'users.csv'), index=False)
-    payments_df.to_csv(os.path.join(data_dir, 'payments.csv'), index=False)
-    orders_df.to_csv(os.path.join(data_dir, 'orders.csv'), index=False)
-    
-    print(f"Sample data files created in {data_dir}")
+    generate_synthetic_data(data_dir, num_users=100, num_orders=200, fraud_rate=0.05, num_rings=2,
+                            ring_size=3, days=30, seed=None)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fraud_detection_system as fds  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def data_dir(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('data'))
+    fds.generate_synthetic_data(path, num_users=300, num_orders=3000, num_rings=4, ring_size=4, days=5, seed=0)
+    return path
+
+
+def data_processor(data_dir, **kwargs):
+    return fds.DataProcessor(os.path.join(data_dir, 'orders.csv'), os.path.join(data_dir, 'users.csv'),
+                             os.path.join(data_dir, 'payments.csv'), **kwargs)
+
+
+@pytest.fixture(scope='session')
+def model_path(data_dir, tmp_path_factory):
+    """A small model trained for a few full-graph epochs, with its manifest."""
+    torch.manual_seed(0)
+    path = str(tmp_path_factory.mktemp('model') / 'model.pt')
+    dp = data_processor(data_dir)
+    data = dp.split_data(dp.create_heterograph(), random_state=42)
+    metadata = ({node_type: data[node_type].x.size(1) for node_type in data.node_types}, data.edge_types)
+    model = fds.FraudDetectionHGNN(hidden_channels=16, out_channels=1, metadata=metadata)
+    trainer = fds.FraudDetectionTrainer(model, data, model_path=path, device='cpu')
+    trainer.train(epochs=3, patience=3)
+    fds.save_model_manifest(path, metadata, 16, feature_vocab=dp.feature_vocab, feature_columns=dp.feature_columns)
+    return path
@@ -0,0 +1,20 @@
+import torch
+
+import fraud_detection_system as fds
+from conftest import data_processor
+
+
+def test_parity_check_leaves_the_callers_model_alone(data_dir):
+    dp = data_processor(data_dir)
+    data = dp.split_data(dp.create_heterograph(), random_state=42)
+    metadata = ({node_type: data[node_type].x.size(1) for node_type in data.node_types}, data.edge_types)
+    model = fds.FraudDetectionHGNN(hidden_channels=16, out_channels=1, metadata=metadata).train()
+    before = {name: param.clone() for name, param in model.state_dict().items()}
+
+    report = fds.check_artifact_parity(model, model, data)
+
+    assert report['auc_delta'] == 0
+    assert model.training
+    for name, param in model.state_dict().items():
+        assert param.device == before[name].device
+        assert torch.equal(param, before[name])
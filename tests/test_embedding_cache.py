@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+import fraud_detection_system as fds
+from conftest import data_processor
+
+# Cached user/payment embeddings leave out the request order's own edges (see
+# FraudDetectionAPI._score_from_cache); this is how far that may move a probability.
+MAX_CACHED_DIFFERENCE = 0.02
+
+
+def request_orders(data_dir, count=50):
+    orders = pd.read_csv(f'{data_dir}/orders.csv').tail(count)
+    users = pd.read_csv(f'{data_dir}/users.csv').set_index('user_id')
+    velocity = dict.fromkeys(fds.DataProcessor.velocity_columns(), 0.0)
+    requests = []
+    for i, row in enumerate(orders.itertuples()):
+        user = users.loc[row.user_id]
+        requests.append(dict(velocity, order_id=10 ** 6 + i, user_id=int(row.user_id), payment_id=int(row.payment_id),
+                             order_amount=row.order_amount, num_items=row.num_items, timestamp=row.timestamp,
+                             user_age=float(user.age), account_age_days=float(user.account_age_days),
+                             user_total_orders=float(user.total_past_orders)))
+    return requests
+
+
+def serving_api(data_dir, model_path, **kwargs):
+    # A fanout above every degree makes neighborhood sampling exhaustive, hence deterministic
+    return fds.FraudDetectionAPI(model_path, data_processor(data_dir), inference_mode='neighborhood',
+                                 neighborhood_fanout=(10000, 10000), live_velocity=False, **kwargs)
+
+
+def probabilities(api, requests):
+    # One order per call: a batch's orders also message each other's users in the full path
+    return np.array([api.process_orders([order])[0]['fraud_probability'] for order in requests])
+
+
+def test_cached_scores_stay_close_to_full_neighborhood(data_dir, model_path):
+    requests = request_orders(data_dir)
+    uncached = probabilities(serving_api(data_dir, model_path), requests)
+    cached_api = serving_api(data_dir, model_path, embedding_cache_size=10000)
+    misses = probabilities(cached_api, requests)
+    hits = probabilities(cached_api, requests)
+
+    assert cached_api.embedding_cache_stats()['hits'] >= len(requests)
+    np.testing.assert_allclose(hits, misses, atol=1e-6)
+    assert np.abs(hits - uncached).max() <= MAX_CACHED_DIFFERENCE
+
+
+def test_append_invalidates_other_holders_of_changed_attributes(data_dir, model_path):
+    api = serving_api(data_dir, model_path, embedding_cache_size=10000)
+    holder = pd.read_csv(f'{data_dir}/users.csv').iloc[0]
+    order = request_orders(data_dir, count=1)[0]
+    api.process_orders([dict(order, user_id=int(holder.user_id))])
+    holder_index = api.data_processor.node_mappings['user'].get_indexer(np.array([holder.user_id]))
+    assert api.embedding_cache.get_many('user', holder_index)[0] is not None
+
+    # A new user registering from the holder's IP bumps that IP node's holder count
+    newcomer = dict(order, order_id=order['order_id'] + 1, user_id=10 ** 7,
+                    registration_ip=holder.registration_ip)
+    delta = api.append_orders([newcomer])
+    assert len(delta['nodes']['ip'])
+    assert api.embedding_cache.get_many('user', holder_index)[0] is None
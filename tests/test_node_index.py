@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from fraud_detection_system import NodeIndex
+
+
+def test_missing_ids_in_object_index_are_unknown():
+    index = NodeIndex(np.array(['u1', 'u2', 'u3'], dtype=object))
+    ids = np.array(['u2', None, float('nan'), 'u1'], dtype=object)
+    np.testing.assert_array_equal(index.get_indexer(ids), [1, -1, -1, 0])
+
+
+def test_integer_ids_are_not_truncated_to_string_index_width():
+    index = NodeIndex(np.array(['123', '456']))
+    np.testing.assert_array_equal(index.get_indexer(np.array([123, 12345, 4567])), [0, -1, -1])
+    np.testing.assert_array_equal(index.get_indexer(np.array([12345, None], dtype=object)), [-1, -1])
+
+
+def test_float_ids_match_integer_index_only_when_integral():
+    index = NodeIndex(np.array([10, 20, 30], dtype=np.int32))
+    np.testing.assert_array_equal(index.get_indexer(np.array([20.0, 20.5, np.nan, 1e30])), [1, -1, -1, -1])
+
+
+def test_indices_follow_first_appearance_and_lookup_uses_sorted_copy():
+    index = NodeIndex(np.array([30, 10, 30, 20]))
+    assert len(index) == 3
+    np.testing.assert_array_equal(index.ids, [30, 10, 20])
+    np.testing.assert_array_equal(index.get_indexer(np.array([20, 30, 99, 10])), [2, 0, -1, 1])
+    assert index[10] == 1 and 99 not in index
+    np.testing.assert_array_equal(index.get_ids([2, 0]), [20, 30])
+    with pytest.raises(KeyError):
+        index.lookup([10, 99])
+
+
+def test_lookup_after_append_and_compact():
+    index = NodeIndex(np.array(['b', 'a']))
+    np.testing.assert_array_equal(index.append(np.array(['d', 'c'])), [2, 3])
+    # Appended IDs resolve through the pending dict before compaction...
+    assert index._lookup[2]
+    np.testing.assert_array_equal(index.get_indexer(np.array(['c', 'a', 'd', 'x'])), [3, 1, 2, -1])
+    index.compact()
+    # ...and through the sorted arrays after it, with the same indices
+    assert not index._lookup[2]
+    np.testing.assert_array_equal(index.get_indexer(np.array(['c', 'a', 'd', 'x'])), [3, 1, 2, -1])
+    with pytest.raises(ValueError):
+        index.append(np.array(['a']))
+
+
+def test_many_appends_compact_automatically():
+    index = NodeIndex(np.arange(10))
+    for start in range(10, 5010, 7):
+        index.append(np.arange(start, start + 7))
+    ids = np.arange(len(index))
+    assert len(ids) == 5015
+    assert len(index._lookup[2]) <= 1024
+    np.testing.assert_array_equal(index.get_indexer(ids), ids)
+
+
+def test_append_widens_string_ids():
+    index = NodeIndex(np.array(['u1', 'u2']))
+    index.append(np.array(['user-000003']))
+    assert index.ids.dtype.itemsize >= np.dtype('U11').itemsize
+    np.testing.assert_array_equal(index.get_indexer(np.array(['user-000003', 'u2', 'user-00000'])), [2, 1, -1])
+
+
+def test_append_widens_int32_ids_instead_of_wrapping():
+    index = NodeIndex(np.array([1, 2], dtype=np.int32))
+    big = 2 ** 40
+    np.testing.assert_array_equal(index.append(np.array([big], dtype=np.int64)), [2])
+    assert index.ids.dtype == np.int64
+    np.testing.assert_array_equal(index.get_indexer(np.array([big, big % 2 ** 32, 2])), [2, -1, 1])
+    index.compact()
+    np.testing.assert_array_equal(index.get_indexer(np.array([big, 1])), [2, 0])
+
+
+def test_from_arrays_round_trip():
+    index = NodeIndex(np.array([5, 3, 9]))
+    restored = NodeIndex.from_arrays(index.ids, index._order)
+    np.testing.assert_array_equal(restored.get_indexer(np.array([9, 5, 4])), [2, 0, -1])
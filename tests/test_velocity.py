@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from fraud_detection_system import DataProcessor, VelocityFeatureStore, velocity_keys
+
+WINDOWS = list(DataProcessor.VELOCITY_WINDOWS.values())
+
+
+def serve_sequentially(store, keys, timestamps, amounts):
+    """Features as the serving path computes them: one update() per event, in time order."""
+    features = np.zeros((len(keys), 2 * len(store.windows)), dtype=np.float32)
+    for i in np.argsort(timestamps, kind='stable').tolist():
+        if keys[i] is not None and not np.isnan(timestamps[i]):
+            features[i] = store.update(keys[i], timestamps[i], amounts[i])
+    return features
+
+
+def random_events(seed, n=3000):
+    rng = np.random.default_rng(seed)
+    # Bursts within seconds, exact bucket and window boundaries, and gaps longer than the
+    # largest window so keys expire between visits
+    gaps = rng.choice([0.0, 1.0, 59.0, 60.0, 360.0, 600.0, 3600.0, 86400.0, 200000.0], size=n,
+                      p=[.15, .2, .1, .1, .1, .1, .1, .1, .05])
+    timestamps = 1.7e9 + np.cumsum(gaps)
+    timestamps = timestamps[rng.permutation(n)]
+    keys = velocity_keys('user', rng.integers(0, 20, n))
+    keys[rng.random(n) < 0.03] = None
+    timestamps[rng.random(n) < 0.03] = np.nan
+    amounts = rng.integers(1, 500, n).astype(np.float64)
+    return keys, timestamps, amounts
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_training_replay_matches_serving_updates(seed):
+    keys, timestamps, amounts = random_events(seed)
+    replayed = VelocityFeatureStore(WINDOWS).replay(keys, timestamps, amounts)
+    served = serve_sequentially(VelocityFeatureStore(WINDOWS), keys, timestamps, amounts)
+    np.testing.assert_array_equal(replayed, served)
+
+
+def test_window_boundary_and_expiry():
+    store = VelocityFeatureStore([600], resolution=10)
+    # Buckets are 60s wide and a read in bucket b covers buckets (b - 10, b]: an event at
+    # 600 (bucket 10) is seen from 1199 (bucket 19) but not from 1200 (bucket 20), and
+    # 10000s later the key has expired
+    timestamps = np.array([600.0, 1199.0, 1200.0, 11200.0])
+    keys = np.array(['user:1'] * 4, dtype=object)
+    amounts = np.array([10.0, 20.0, 30.0, 40.0])
+    replayed = store.replay(keys, timestamps, amounts)
+    np.testing.assert_array_equal(replayed, [[0, 0], [1, 10], [1, 20], [0, 0]])
+    np.testing.assert_array_equal(serve_sequentially(VelocityFeatureStore([600], resolution=10), keys,
+                                                     timestamps, amounts), replayed)
+
+
+def test_velocity_frame_matches_serving_store():
+    rng = np.random.default_rng(7)
+    n = 500
+    orders = pd.DataFrame({'user_id': rng.integers(0, 15, n), 'payment_id': rng.integers(0, 25, n).astype(float),
+                           'order_amount': rng.integers(1, 300, n).astype(np.float32)})
+    timestamps = 1.7e9 + np.sort(rng.integers(0, 3 * 86400, n)).astype(float)
+    dp = DataProcessor(None, None, None)
+    expected = dp.velocity_frame(orders, timestamps).to_numpy()
+    store = dp.new_velocity_store()
+    served = np.concatenate([serve_sequentially(store, velocity_keys(kind, orders[f'{kind}_id']), timestamps,
+                                                orders['order_amount'].to_numpy(dtype=np.float64))
+                             for kind in ('user', 'payment')], axis=1)
+    np.testing.assert_array_equal(expected, served)